@@ -0,0 +1,209 @@
+#!/usr/bin/python
+# Headless renderer of the scheduler animation of
+# general/nrstat_visualize.ipynb, for the binary traces of nrstatss.py -o
+#
+# @author: parth@linux.ibm.com
+#
+# The frames are the events the notebook animates. Their bar heights come
+# from nrstat_trace.nr_running_at() and their bar colors from array
+# assignments over all frames, instead of a Python pass per CPU per frame.
+# Frame ranges are rendered into video segments by a pool of processes with
+# the matplotlib Agg backend, and the segments are then concatenated with
+# ffmpeg, which must be installed.
+#
+# Huge traces can be bounded to a video length:
+# - --every N keeps one frame out of N,
+# - --bucket-ms T keeps the last frame of every T ms of trace, i.e. renders
+#   the trace at 1000/T trace-time frames per second,
+# - --max-frames M keeps M frames evenly spread over the rest.
+#
+# Example:
+# ========
+# $> python nrstatss.py -a -t 10 -o trace.nrstat
+# $> python nrstat_render.py trace.nrstat -o trace.mp4 --bucket-ms 1 -j 16
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+
+import numpy as np
+
+import nrstat_trace
+
+# bar colors of the notebook
+COLORS = ("black", "red", "green", "blue", "violet", "cyan", "magenta")
+BLACK, RED, GREEN, BLUE, VIOLET, CYAN, MAGENTA = range(len(COLORS))
+LEGEND = ((RED, "Removed"), (GREEN, "Added"), (BLUE, "Waker"), (VIOLET, "waker=wakee"),
+        (CYAN, "Waker-fork"), (MAGENTA, "waker=wakee-fork"), (BLACK, "No Change"))
+SEGMENT_FRAMES = 500
+
+# set before the pool forks, shared with the workers
+records = None
+cpumask = None
+ops = None
+frames = None
+ymax = None
+args = None
+
+def select_frames(events, ts, every=1, bucket_ns=None, max_frames=None):
+    '''
+    Decimate the frame events, ts being the timestamps of the records
+    '''
+    if bucket_ns and len(events):
+        bucket = (ts[events] - ts[events[0]]) // bucket_ns
+        last = np.ones(len(events), dtype=bool)
+        last[:-1] = bucket[1:] != bucket[:-1]
+        events = events[last]
+    if every > 1:
+        events = events[::every]
+    if max_frames and len(events) > max_frames:
+        events = events[np.unique(np.linspace(0, len(events) - 1, max_frames).astype(np.int64))]
+    return events
+
+def frame_colors(records, events, cpumask):
+    '''
+    len(events) x len(cpumask) array of the COLORS index of every bar, as
+    painted by the notebook
+    '''
+    column = np.full(max(max(cpumask), int(records['this_cpu'].max()),
+            int(records['target_cpu'].max()), int(records['orig_cpu'].max())) + 1, -1)
+    column[cpumask] = np.arange(len(cpumask))
+    colors = np.full((len(events), len(cpumask)), BLACK, dtype=np.int8)
+    event_type = np.asarray(records['event_type'])[events]
+    this_col = column[np.asarray(records['this_cpu'])[events]]
+    orig_col = column[np.asarray(records['orig_cpu'])[events]]
+    target_col = column[np.asarray(records['target_cpu'])[events]]
+    rows = np.arange(len(events))
+
+    def paint(selected, col, color):
+        selected = selected & (col >= 0)
+        colors[rows[selected], col[selected]] = color
+
+    for et, waker_color, same_color in ((nrstat_trace.WAKEUP, BLUE, VIOLET),
+            (nrstat_trace.WAKEUP_NEW, CYAN, MAGENTA)):
+        wakeup = event_type == et
+        paint(wakeup, this_col, waker_color)
+        paint(wakeup, target_col, GREEN)
+        paint(wakeup & (this_col == target_col), this_col, same_color)
+    migrate = event_type == nrstat_trace.MIGRATE_TASK
+    paint(migrate, orig_col, RED)
+    paint(migrate, target_col, GREEN)
+    paint(event_type == nrstat_trace.TASK_EXIT, this_col, RED)
+    return colors
+
+def render_segment(work):
+    '''
+    Render the frames [start, end) into a video segment at path
+    '''
+    start, end, path = work
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib import animation
+    from matplotlib.collections import PolyCollection
+    from matplotlib.colors import to_rgba_array
+    from matplotlib.lines import Line2D
+
+    events = frames[start:end]
+    heights = nrstat_trace.nr_running_at(records, cpumask, events, ops)
+    colors = to_rgba_array(COLORS)[frame_colors(records, events, cpumask)]
+    ts = np.asarray(records['ts'])
+    t0 = int(ts[0])
+
+    fig, ax = plt.subplots(figsize=(args.width, args.height))
+    # one rectangle per CPU of the mask, only the top edge moves
+    x = np.asarray(cpumask, dtype=float)
+    verts = np.zeros((len(cpumask), 4, 2))
+    verts[:, 0, 0] = verts[:, 1, 0] = x - 0.4
+    verts[:, 2, 0] = verts[:, 3, 0] = x + 0.4
+    bars = PolyCollection(verts, edgecolors="none")
+    ax.add_collection(bars)
+    ax.set_xlim(x.min() - 1, x.max() + 1)
+    ax.set_ylim(bottom=0, top=ymax)
+    ax.legend([Line2D([0], [0], color=COLORS[color], lw=4) for color, label in LEGEND],
+            [label for color, label in LEGEND], bbox_to_anchor=(1.0, 1), loc="upper left")
+    title = ax.set_title("")
+    fig.tight_layout()
+
+    writer = animation.FFMpegWriter(fps=args.fps)
+    with writer.saving(fig, path, args.dpi):
+        for frame in range(len(events)):
+            verts[:, 1, 1] = verts[:, 2, 1] = heights[frame]
+            bars.set_verts(verts)
+            bars.set_facecolor(colors[frame])
+            title.set_text("%.3f ms" % ((int(ts[events[frame]]) - t0) / 1e6))
+            writer.grab_frame()
+    plt.close(fig)
+    return path
+
+def concat(segments, output):
+    listing = output + ".segments"
+    with open(listing, "w") as f:
+        for segment in segments:
+            f.write("file '%s'\n" % os.path.abspath(segment))
+    try:
+        subprocess.check_call(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+                "-i", listing, "-c", "copy", output])
+    finally:
+        os.remove(listing)
+
+def main():
+    global records, cpumask, ops, frames, ymax, args
+    parser = argparse.ArgumentParser(
+            description="Render the nrstat scheduler animation of a nrstatss.py -o trace to a video")
+    parser.add_argument("trace", help="binary trace of nrstatss.py -o")
+    parser.add_argument("-o", "--output", default="nrstat.mp4", help="video file (default nrstat.mp4)")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+            help="rendering processes (default: one per CPU)")
+    parser.add_argument("-r", "--range", help="CPUs to show, e.g. 0-4 (default: the cpumask of the trace)")
+    parser.add_argument("--every", type=int, default=1, help="keep one frame out of EVERY")
+    parser.add_argument("--bucket-ms", type=float, default=None,
+            help="keep the last frame of every BUCKET_MS ms of trace")
+    parser.add_argument("--max-frames", type=int, default=None, help="keep at most MAX_FRAMES frames")
+    parser.add_argument("--fps", type=int, default=10, help="frames per second of the video (default 10)")
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--width", type=float, default=12, help="inches")
+    parser.add_argument("--height", type=float, default=5, help="inches")
+    parser.add_argument("--segment-frames", type=int, default=SEGMENT_FRAMES,
+            help="frames rendered per segment (default %d)" % SEGMENT_FRAMES)
+    args = parser.parse_args()
+
+    header, records = nrstat_trace.load(args.trace)
+    cpumask = header["cpumask"]
+    if args.range:
+        first, last = args.range.split('-')
+        cpumask = list(range(int(first), int(last) + 1))
+    if len(records) == 0:
+        parser.error("%s has no events" % args.trace)
+
+    ops = nrstat_trace.nr_running_ops(records)
+    frames = select_frames(nrstat_trace.animation_events(records, cpumask, ops),
+            np.asarray(records['ts'], dtype=np.int64), args.every,
+            int(args.bucket_ms * 1e6) if args.bucket_ms else None, args.max_frames)
+    if len(frames) == 0:
+        parser.error("no event changes the nr_running of the CPUs")
+    op_cpu, op_event, op_after = ops
+    ymax = max(int(op_after[np.isin(op_cpu, cpumask)].max(initial=0)) + 1, 2)
+    print("%d events, %d frames, %.1f s of video" % (len(records), len(frames), len(frames) / float(args.fps)))
+
+    tmpdir = tempfile.mkdtemp(prefix="nrstat_render.")
+    try:
+        work = [(start, min(start + args.segment_frames, len(frames)),
+                os.path.join(tmpdir, "segment%06d.mp4" % i))
+                for i, start in enumerate(range(0, len(frames), args.segment_frames))]
+        pool = multiprocessing.Pool(args.jobs)
+        segments = pool.map(render_segment, work, chunksize=1)
+        pool.close()
+        pool.join()
+        concat(segments, args.output)
+    finally:
+        shutil.rmtree(tmpdir)
+    print("written", args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+# Binary trace files of nrstatss.py -o, and their NumPy loader
+#
+# @author: parth@linux.ibm.com
+#
+# A trace file is a small header followed by the raw data_t records of the
+# BPF program, written as they come out of the ring buffer:
+#   MAGIC | u32 header length | JSON header, space padded | records
+# The header holds the cpumask and the NumPy dtype of the records, and is
+# padded so that the records start 64 bytes aligned. load() maps the records
+# straight into a NumPy structured array, without parsing them.
+#
+# Records are the events of the kernel: every event sets the nr_running of
+# this_cpu, and wakeups and migrations also add one to their target_cpu.
+# nr_running_at() replays them with vectorized operations into the
+# nr_running of any CPUs after any events.
+#
+# Example:
+# ========
+# $> python nrstatss.py -a -t 10 -o trace.nrstat
+# >>> header, records = nrstat_trace.load("trace.nrstat")
+# >>> nr = nrstat_trace.nr_running_at(records, header["cpumask"], np.arange(len(records)))
+
+from __future__ import print_function
+
+import json
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b"NRSTAT1\n"
+ALIGN = 64
+
+# event types of the data_t records
+WAKEUP = 0
+WAKEUP_NEW = 1
+MIGRATE_TASK = 2
+TASK_EXIT = 3
+SCHED_SWITCH = 4
+
+# struct data_t of nrstatss.py, in native byte order
+RECORD_DTYPE = np.dtype([('ts', 'u8'), ('event_type', 'i4'), ('this_cpu', 'i4'),
+        ('orig_cpu', 'i4'), ('target_cpu', 'i4'), ('nr_running', 'i4'), ('pad', 'i4')])
+
+
+class TraceWriter:
+    '''
+    Appends raw data_t records to a new trace file
+    '''
+    def __init__(self, path, cpumask):
+        self.f = open(path, "wb")
+        header = json.dumps({"cpumask": list(cpumask),
+                "dtype": RECORD_DTYPE.newbyteorder('=').descr,
+                "byteorder": sys.byteorder,
+                "clock": "CLOCK_MONOTONIC"}).encode()
+        prefix = len(MAGIC) + 4
+        header += b" " * (-(prefix + len(header)) % ALIGN)
+        self.f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        self.nr_records = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.nr_records += len(data) // RECORD_DTYPE.itemsize
+
+    def close(self):
+        self.f.close()
+
+
+def is_trace_file(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def load(path):
+    '''
+    (header, records) of a trace file, records being a read-only memory
+    mapped structured array. A record cut short at the end is left out.
+    '''
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a nrstatss.py trace" % path)
+        header_len, = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_len).decode())
+        offset = len(MAGIC) + 4 + header_len
+        f.seek(0, 2)
+        size = f.tell() - offset
+    dtype = np.dtype([(str(name), str(fmt)) for name, fmt in header["dtype"]])
+    count = size // dtype.itemsize
+    if count == 0:
+        return header, np.zeros(0, dtype=dtype)
+    return header, np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+def nr_running_ops(records):
+    '''
+    The nr_running updates of the records in replay order, grouped by CPU:
+    (cpu, event index, nr_running after the update) arrays
+    '''
+    n = len(records)
+    event_type = np.asarray(records['event_type'])
+    nr_running = np.asarray(records['nr_running'], dtype=np.int64)
+    events = np.arange(n)
+    # every event sets this_cpu, the exiting task being counted as dequeued
+    set_value = np.where(event_type == TASK_EXIT, nr_running - 1, nr_running)
+    has_inc = (event_type == WAKEUP) | (event_type == WAKEUP_NEW) | (event_type == MIGRATE_TASK)
+    nr_inc = int(has_inc.sum())
+
+    cpu = np.concatenate([np.asarray(records['this_cpu'], dtype=np.int64),
+        np.asarray(records['target_cpu'], dtype=np.int64)[has_inc]])
+    event = np.concatenate([events, events[has_inc]])
+    # the set of an event comes before its increment
+    is_set = np.concatenate([np.ones(n, dtype=bool), np.zeros(nr_inc, dtype=bool)])
+    value = np.concatenate([set_value, np.ones(nr_inc, dtype=np.int64)])
+    order = np.lexsort((~is_set, event, cpu))
+    cpu, event, value, is_set = cpu[order], event[order], value[order], is_set[order]
+
+    # the last set (or 0 before the first op of a CPU) plus the increments since
+    nr_ops = len(cpu)
+    first = np.ones(nr_ops, dtype=bool)
+    first[1:] = cpu[1:] != cpu[:-1]
+    base_pos = np.maximum.accumulate(np.where(is_set | first, np.arange(nr_ops), 0))
+    inc = np.where(is_set, 0, value)
+    cum_inc = np.cumsum(inc)
+    after = np.where(is_set[base_pos], value[base_pos], 0) + cum_inc - cum_inc[base_pos] + inc[base_pos]
+    return cpu, event, after
+
+def nr_running_at(records, cpus, events, ops=None):
+    '''
+    len(events) x len(cpus) int64 array of the nr_running of cpus after each
+    of the events (indices into records), 0 for CPUs without events yet.
+    ops, from nr_running_ops(records), can be passed to query the same
+    records repeatedly.
+    '''
+    cpu, event, after = ops if ops is not None else nr_running_ops(records)
+    events = np.asarray(events, dtype=np.int64)
+    cpus = np.asarray(cpus, dtype=np.int64)
+    if len(cpu) == 0:
+        return np.zeros((len(events), len(cpus)), dtype=np.int64)
+    # last op of every (cpu, event) query
+    stride = len(records) + 1
+    keys = cpu * stride + event
+    queries = cpus[None, :] * stride + events[:, None]
+    pos = np.searchsorted(keys, queries, side='right') - 1
+    valid = pos >= 0
+    pos = np.maximum(pos, 0)
+    valid &= cpu[pos] == cpus[None, :]
+    return np.where(valid, after[pos], 0)
+
+def changed_events(records, cpus, ops=None):
+    '''
+    Boolean array of the records which changed the nr_running of any of cpus
+    '''
+    cpu, event, after = ops if ops is not None else nr_running_ops(records)
+    changed = np.zeros(len(records), dtype=bool)
+    if len(cpu) == 0:
+        return changed
+    # ops of the same CPU and event, e.g. the set and increment of a wakeup
+    # on its own CPU, are compared as one
+    same = (cpu[1:] == cpu[:-1]) & (event[1:] == event[:-1])
+    last = np.ones(len(cpu), dtype=bool)
+    last[:-1] = ~same
+    first = np.ones(len(cpu), dtype=bool)
+    first[1:] = ~same
+    first_pos = np.nonzero(first)[0]
+    before = np.zeros(len(first_pos), dtype=after.dtype)
+    has_prev = first_pos > 0
+    has_prev[has_prev] = cpu[first_pos[has_prev] - 1] == cpu[first_pos[has_prev]]
+    before[has_prev] = after[first_pos[has_prev] - 1]
+    last_pos = np.nonzero(last)[0]
+    group_changed = (after[last_pos] != before) & np.isin(cpu[last_pos], cpus)
+    changed[event[last_pos[group_changed]]] = True
+    return changed
+
+def animation_events(records, cpumask, ops=None):
+    '''
+    Indices of the records which are frames of the animation of
+    general/nrstat_visualize.ipynb: events but SCHED_SWITCH which changed the
+    nr_running of a CPU of cpumask
+    '''
+    changed = changed_events(records, cpumask, ops)
+    return np.nonzero(changed & (np.asarray(records['event_type']) != SCHED_SWITCH))[0]
+
+def animation_trace(records, cpumask):
+    '''
+    Records as the trace lists of general/nrstat_visualize.ipynb, each frame
+    ending with the {cpu: nr_running} of the cpumask after it
+    '''
+    ops = nr_running_ops(records)
+    frames = animation_events(records, cpumask, ops)
+    nr = nr_running_at(records, cpumask, frames, ops)
+    trace = []
+    for frame, i in enumerate(frames.tolist()):
+        r = records[i]
+        et = int(r['event_type'])
+        snapshot = dict(zip(cpumask, nr[frame].tolist()))
+        if et == MIGRATE_TASK:
+            orig, target = int(r['orig_cpu']), int(r['target_cpu'])
+            orig_nr, target_nr = nr_running_at(records, [orig, target], [i], ops)[0].tolist()
+            trace.append([et, orig, target, orig_nr, target_nr, snapshot])
+        elif et == TASK_EXIT:
+            trace.append([et, int(r['this_cpu']), int(r['nr_running']), snapshot])
+        else:
+            trace.append([et, int(r['this_cpu']), int(r['nr_running']), int(r['target_cpu']), snapshot])
+    return trace
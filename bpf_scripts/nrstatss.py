@@ -10,16 +10,45 @@
 # The trace file generated can then be passed on to the 
 # general/nrstat_visualize.ipynb
 # to visualize the scheduler wakeup/migration pattern
+#
+# Events are read from a BPF ring buffer in batches, and the nr_running of
+# every CPU is kept in a flat list. Every event line ends with a dict of only
+# the CPUs of the mask whose nr_running it changed. Every --keyframe events,
+# a KEYFRAME line carries the nr_running of all the CPUs of the mask, so that
+# a reader can resync. Events the ring buffer had no room for are counted and
+# reported on stderr.
+#
+# With -o FILE, the raw records are instead appended to a binary trace file
+# as they come out of the ring buffer, one write per batch, and nothing is
+# held in memory. nrstat_trace.py maps such a file into NumPy arrays.
+#
+# Most events are SCHED_SWITCH with an unchanged nr_running, which the
+# notebook throws away. The last nr_running reported for every CPU is kept in
+# a BPF array, and SCHED_SWITCH and TASK_EXIT events are only submitted when
+# they change it. Wakeups and migrations are always submitted, and forget the
+# nr_running of their target CPU, which the reader increments. Suppressed
+# events are counted per event type and reported on stderr. -F submits every
+# event.
 
 from __future__ import print_function
 from bcc import BPF
+from bcc.utils import get_possible_cpus
 from time import sleep, strftime
 import argparse
 import ctypes
+import multiprocessing
+import struct
+import sys
+
+RINGBUF_PAGES = 256
+# last_nr of CPUs whose next event must be submitted
+NR_UNKNOWN = -(1 << 31)
+POLL_TIMEOUT_MS = 100
 
 cpu_nrstat = []
 cpumask = []
-per_cpu_nrstat = dict()
+# nr_running indexed by CPU
+per_cpu_nrstat = []
 
 examples = """examples
     ./nrstats.py -r 3-9# Stats for CPUs from 3 to 9
@@ -36,6 +65,12 @@ parser.add_argument("-t", "--time", default=5, help="add timer (default 5sec)")
 parser.add_argument("-c", "--cpu",  default=0, help="add CPU (default CPU-0)")
 parser.add_argument("-r", "--range",  nargs='?', default=0, help="add CPU range")
 parser.add_argument("-a", "--all", default=0, action="store_const", const=1, help="All CPUs")
+parser.add_argument("-k", "--keyframe", type=int, default=1000,
+        help="events between full nr_running snapshots (default 1000)")
+parser.add_argument("-o", "--output",
+        help="stream the events to this binary trace file (see nrstat_trace.py) instead of printing them")
+parser.add_argument("-F", "--no-filter", default=0, action="store_const", const=1,
+        help="submit every event, also those not changing nr_running")
 args = parser.parse_args()
 
 # define BPF program
@@ -49,10 +84,12 @@ enum event_type {
     WAKEUP_NEW,
     MIGRATE_TASK,
     TASK_EXIT,
-    SCHED_SWITCH
+    SCHED_SWITCH,
+    NR_EVENT_TYPES
 };
 
 struct data_t {
+    u64 ts;
     enum event_type et;
     int this_cpu;
     int orig_cpu;
@@ -60,7 +97,11 @@ struct data_t {
     int nr_running;
 };
 
-BPF_PERF_OUTPUT(events);
+BPF_RINGBUF_OUTPUT(events, RINGBUF_PAGES);
+BPF_ARRAY(lost, u64, 1);
+// nr_running last reported to userspace
+BPF_ARRAY(last_nr, int, NR_CPU_IDS);
+BPF_PERCPU_ARRAY(suppressed, u64, NR_EVENT_TYPES);
 
 struct rq_partial {
     raw_spinlock_t          lock;
@@ -83,6 +124,52 @@ static int get_nr_running ()
     return rq->nr_running;
 }
 
+/*
+ * Whether nr_running differs from the one last reported for cpu, which it
+ * then becomes
+ */
+static int nr_changed(int cpu, int nr_running)
+{
+    int *last = last_nr.lookup(&cpu);
+    if (!last)
+        return 1;
+    if (*last == nr_running)
+        return 0;
+    *last = nr_running;
+    return 1;
+}
+
+/*
+ * The target CPU of a wakeup or migration gets nr_running + 1 in userspace,
+ * so its next event is reported whatever its nr_running
+ */
+static void nr_unknown(int cpu)
+{
+    int *last = last_nr.lookup(&cpu);
+    if (last)
+        *last = NR_UNKNOWN;
+}
+
+static int suppress(enum event_type et)
+{
+    u32 key = et;
+    u64 *count = suppressed.lookup(&key);
+    if (count)
+        (*count)++;
+    return 0;
+}
+
+static void submit(struct data_t *event)
+{
+    event->ts = bpf_ktime_get_ns();
+    if (events.ringbuf_output(event, sizeof(*event), 0)) {
+        int zero = 0;
+        u64 *count = lost.lookup(&zero);
+        if (count)
+            __sync_fetch_and_add(count, 1);
+    }
+}
+
 TRACEPOINT_PROBE(sched, sched_wakeup)
 {
     int cpu = bpf_get_smp_processor_id();
@@ -98,7 +185,11 @@ TRACEPOINT_PROBE(sched, sched_wakeup)
     event.nr_running = get_nr_running();
     event.this_cpu = bpf_get_smp_processor_id();
 
-    events.perf_submit(args, &event, sizeof(event));
+    if (DELTA_FILTER) {
+        nr_changed(event.this_cpu, event.nr_running);
+        nr_unknown(event.target_cpu);
+    }
+    submit(&event);
 
     return 0;
 }
@@ -119,7 +210,11 @@ TRACEPOINT_PROBE(sched, sched_wakeup_new)
     event.nr_running = get_nr_running();
     event.this_cpu = bpf_get_smp_processor_id();
 
-    events.perf_submit(args, &event, sizeof(event));
+    if (DELTA_FILTER) {
+        nr_changed(event.this_cpu, event.nr_running);
+        nr_unknown(event.target_cpu);
+    }
+    submit(&event);
 
     return 0;
 }
@@ -144,7 +239,11 @@ TRACEPOINT_PROBE(sched, sched_migrate_task)
     event.nr_running = get_nr_running();
     event.this_cpu = bpf_get_smp_processor_id();
 
-    events.perf_submit(args, &event, sizeof(event));
+    if (DELTA_FILTER) {
+        nr_changed(event.this_cpu, event.nr_running);
+        nr_unknown(event.target_cpu);
+    }
+    submit(&event);
 
     return 0;
 }
@@ -161,7 +260,10 @@ TRACEPOINT_PROBE(sched, sched_process_exit)
     event.nr_running = get_nr_running();
     event.this_cpu = cpu;
 
-    events.perf_submit(args, &event, sizeof(event));
+    // userspace reports the exiting task as dequeued
+    if (DELTA_FILTER && !nr_changed(cpu, event.nr_running - 1))
+        return suppress(TASK_EXIT);
+    submit(&event);
 
     return 0;
 }
@@ -177,7 +279,9 @@ TRACEPOINT_PROBE(sched, sched_switch)
     event.nr_running = get_nr_running();
     event.this_cpu = cpu;
 
-    events.perf_submit(args, &event, sizeof(event));
+    if (DELTA_FILTER && !nr_changed(cpu, event.nr_running))
+        return suppress(SCHED_SWITCH);
+    submit(&event);
 
     return 0;
 }
@@ -187,6 +291,10 @@ fd = open("cur_linux_cfs_rq.h","r")
 header = fd.read()
 fd.close()
 bpf_text = bpf_text.replace('HEADERS', header)
+bpf_text = bpf_text.replace('RINGBUF_PAGES', str(RINGBUF_PAGES))
+bpf_text = bpf_text.replace('NR_CPU_IDS', str(max(get_possible_cpus()) + 1))
+bpf_text = bpf_text.replace('NR_UNKNOWN', '(%d)' % NR_UNKNOWN)
+bpf_text = bpf_text.replace('DELTA_FILTER', '0' if args.no_filter else '1')
 
 range_filter = False
 all_cpus = False
@@ -203,17 +311,20 @@ if(args.range):
     if (rstart <= rend):
         range_filter = True
         cpu_filter = 'cpu < '+str(rstart)+' || cpu > '+str(rend)
-        cpumask = range(rstart, rend+1)
+        cpumask = list(range(rstart, rend+1))
 
 if (args.all):
     cpu_filter = 'cpu < 0 || cpu > 1024'
     all_cpus = True
-    cpumask = range(0, 176)
+    cpumask = list(range(0, 176))
 
 bpf_text = bpf_text.replace('FILTER', cpu_filter)
 
 print (cpumask)
 b = BPF(text=bpf_text)
+last_nr = b["last_nr"]
+for i in range(len(last_nr)):
+    last_nr[ctypes.c_int(i)] = ctypes.c_int(NR_UNKNOWN)
 
 if(all_cpus):
     print("Tracing Runqueue Stats for all CPUs... Hit Ctrl-C to end.")
@@ -229,60 +340,132 @@ class EventType(object):
     MIGRATE_TASK = 2
     TASK_EXIT = 3
     SCHED_SWITCH = 4
-
-class Events(ctypes.Structure):
-    _fields_ = [('event_type', ctypes.c_int),
-            ('this_cpu', ctypes.c_int),
-            ('orig_cpu', ctypes.c_int),
-            ('target_cpu', ctypes.c_int),
-            ("nr_running", ctypes.c_int)]
-
-def get_per_cpu_nr(cpu):
-    if cpu in per_cpu_nrstat:
-        return per_cpu_nrstat[cpu]
-    return 0
-
-def set_per_cpu_nr(cpu, nr):
-    per_cpu_nrstat[cpu] = nr
+    KEYFRAME = 5
+
+# struct data_t: ts, event_type, this_cpu, orig_cpu, target_cpu, nr_running
+EVENT_FORMAT = struct.Struct("=Q5i4x")
+
+# CPUs of the mask, indexed by CPU
+in_cpumask = []
+events_since_keyframe = 0
+# submitted events per event type
+submitted = [0] * EventType.KEYFRAME
+
+def grow(cpu):
+    '''
+    Make room for cpu in the per-CPU lists
+    '''
+    if cpu >= len(per_cpu_nrstat):
+        nr_cpus = max(cpu + 1, 2 * len(per_cpu_nrstat))
+        per_cpu_nrstat.extend([0] * (nr_cpus - len(per_cpu_nrstat)))
+        in_cpumask.extend([False] * (nr_cpus - len(in_cpumask)))
 
 def get_masked_per_cpu_nr(cpumask):
+    return dict((i, per_cpu_nrstat[i]) for i in cpumask)
+
+def changes(cpu, old_nr, other_cpu, other_old_nr):
+    '''
+    {cpu: nr_running} of the CPUs of the mask an event changed
+    '''
     ret = dict()
-    for i in cpumask:
-        if i in per_cpu_nrstat.keys():
-            ret[i] = per_cpu_nrstat[i]
+    if in_cpumask[cpu] and per_cpu_nrstat[cpu] != old_nr:
+        ret[cpu] = per_cpu_nrstat[cpu]
+    if in_cpumask[other_cpu] and per_cpu_nrstat[other_cpu] != other_old_nr:
+        ret[other_cpu] = per_cpu_nrstat[other_cpu]
     return ret
 
-def print_event(cpu, data, size):
-    et = ctypes.cast(data, ctypes.POINTER(Events)).contents
-    if (et.event_type == EventType.WAKEUP or et.event_type == EventType.WAKEUP_NEW):
-        set_per_cpu_nr(et.this_cpu, et.nr_running)
-        set_per_cpu_nr(et.target_cpu, get_per_cpu_nr(et.target_cpu)+1)
-        cpu_nrstat.append([et.event_type, et.this_cpu, et.nr_running, et.target_cpu, get_masked_per_cpu_nr(cpumask)])
-
-    if (et.event_type == EventType.MIGRATE_TASK):
-        set_per_cpu_nr(et.this_cpu, et.nr_running)
-        set_per_cpu_nr(et.target_cpu, get_per_cpu_nr(et.target_cpu)+1)
-        cpu_nrstat.append([et.event_type, et.orig_cpu, et.target_cpu, get_per_cpu_nr(et.orig_cpu),get_per_cpu_nr(et.target_cpu), get_masked_per_cpu_nr(cpumask)])
-
-    if (et.event_type == EventType.TASK_EXIT):
-        set_per_cpu_nr(et.this_cpu, et.nr_running)
-        set_per_cpu_nr(et.this_cpu, get_per_cpu_nr(et.this_cpu)-1)
-        cpu_nrstat.append([et.event_type, et.this_cpu, et.nr_running, get_masked_per_cpu_nr(cpumask)])
-
-    if (et.event_type == EventType.SCHED_SWITCH):
-        set_per_cpu_nr(et.this_cpu, et.nr_running)
-        cpu_nrstat.append([et.event_type, et.this_cpu, et.nr_running, get_masked_per_cpu_nr(cpumask)])
-
-b["events"].open_perf_buffer(print_event)
+def process_events(data):
+    '''
+    Apply a batch of raw data_t records to per_cpu_nrstat
+    '''
+    global events_since_keyframe
+    nr = per_cpu_nrstat
+    for ts, event_type, this_cpu, orig_cpu, target_cpu, nr_running in EVENT_FORMAT.iter_unpack(data):
+        grow(max(this_cpu, orig_cpu, target_cpu))
+        submitted[event_type] += 1
+        if (event_type == EventType.WAKEUP or event_type == EventType.WAKEUP_NEW):
+            old_this, old_target = nr[this_cpu], nr[target_cpu]
+            nr[this_cpu] = nr_running
+            nr[target_cpu] += 1
+            cpu_nrstat.append([event_type, this_cpu, nr_running, target_cpu,
+                changes(this_cpu, old_this, target_cpu, old_target)])
+
+        elif (event_type == EventType.MIGRATE_TASK):
+            old_this, old_target = nr[this_cpu], nr[target_cpu]
+            nr[this_cpu] = nr_running
+            nr[target_cpu] += 1
+            cpu_nrstat.append([event_type, orig_cpu, target_cpu, nr[orig_cpu], nr[target_cpu],
+                changes(this_cpu, old_this, target_cpu, old_target)])
+
+        elif (event_type == EventType.TASK_EXIT):
+            old_this = nr[this_cpu]
+            nr[this_cpu] = nr_running - 1
+            cpu_nrstat.append([event_type, this_cpu, nr_running,
+                changes(this_cpu, old_this, this_cpu, old_this)])
+
+        elif (event_type == EventType.SCHED_SWITCH):
+            old_this = nr[this_cpu]
+            nr[this_cpu] = nr_running
+            cpu_nrstat.append([event_type, this_cpu, nr_running,
+                changes(this_cpu, old_this, this_cpu, old_this)])
+
+        events_since_keyframe += 1
+        if events_since_keyframe == args.keyframe:
+            cpu_nrstat.append([EventType.KEYFRAME, get_masked_per_cpu_nr(cpumask)])
+            events_since_keyframe = 0
+
+grow(max(cpumask + [multiprocessing.cpu_count() - 1]))
+for i in cpumask:
+    in_cpumask[i] = True
+
+batch = []
+
+def collect(ctx, data, size):
+    batch.append(ctypes.string_at(data, size))
+
+def write_events(data):
+    '''
+    Append a batch of raw data_t records to the trace file
+    '''
+    trace_out.write(data)
+    counts = np.bincount(np.frombuffer(data, dtype=nrstat_trace.RECORD_DTYPE)['event_type'],
+            minlength=len(submitted))
+    for event_type in range(len(submitted)):
+        submitted[event_type] += int(counts[event_type])
+
+trace_out = None
+if args.output:
+    import numpy as np
+    import nrstat_trace
+    trace_out = nrstat_trace.TraceWriter(args.output, cpumask)
+
+b["events"].open_ring_buffer(collect)
 import time
 start = time.time()
-while time.time()-start < args.time:
+while time.time()-start < float(args.time):
     try:
-        b.perf_buffer_poll()
+        b.ring_buffer_poll(POLL_TIMEOUT_MS)
     except KeyboardInterrupt:
-        exit()
-
-for i in cpu_nrstat:
-    print(i)
-
-print(per_cpu_nrstat)
+        if trace_out is None:
+            exit()
+        break
+    if trace_out is not None:
+        write_events(b"".join(batch))
+    else:
+        process_events(b"".join(batch))
+    del batch[:]
+
+if trace_out is not None:
+    trace_out.close()
+    print("%d events written to %s" % (trace_out.nr_records, args.output))
+else:
+    for i in cpu_nrstat:
+        print(i)
+
+    print(get_masked_per_cpu_nr(cpumask))
+print("%d events lost, ring buffer full" % b["lost"][ctypes.c_int(0)].value, file=sys.stderr)
+suppressed = b["suppressed"]
+for name in ("WAKEUP", "WAKEUP_NEW", "MIGRATE_TASK", "TASK_EXIT", "SCHED_SWITCH"):
+    event_type = getattr(EventType, name)
+    print("%-12s submitted = %d suppressed = %d" % (name, submitted[event_type],
+        suppressed.sum(suppressed.Key(event_type)).value), file=sys.stderr)
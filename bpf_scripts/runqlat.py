@@ -4,7 +4,9 @@
 # runqlat   Run queue (scheduler) latency as a histogram.
 #           For Linux, uses BCC, eBPF.
 #
-# USAGE: runqlat [-h] [-T] [-m] [-P] [-L] [-p PID] [interval] [count]
+# USAGE: runqlat [-h] [-T] [-m] [-P] [-L] [-C] [-S SUB_BUCKETS] [-j FILE]
+#                [--storage {auto,task,array,hash}] [--probe-cost]
+#                [-p PID] [interval] [count]
 #
 # This measures the time a task spends waiting on a run queue for a turn
 # on-CPU, and shows this time as a histogram. This time should be small, but a
@@ -19,6 +21,39 @@
 #    in the runnable state, to when it next executed. This is instrumented
 #    from finish_task_switch() alone.
 #
+# The histogram is kept in a per-CPU array, so that CPUs switching tasks don't
+# contend on the cache lines of shared counters, and is summed over CPUs when
+# printed. -C prints the histogram of every CPU instead. Per PID/TID/PID
+# namespace histograms are kept in a shared hash, as per-CPU copies of every
+# key would cost nr_cpus times the memory. runqlat_overhead.py measures the
+# probe overhead with the per-CPU and the shared (--shared-hist) histogram.
+#
+# log2 slots are too coarse for percentiles: 512-1023 us is a single slot.
+# -S also counts the nsec latencies in log-linear buckets, every power of two
+# being split in SUB_BUCKETS linear sub-buckets, which bounds the relative
+# error to 1/SUB_BUCKETS with (65 - log2(SUB_BUCKETS))*SUB_BUCKETS buckets.
+# Percentiles are then printed after every histogram, and with -j written as
+# one JSON object per interval.
+#
+# The enqueue timestamp of every task is kept until its switch in, by default
+# in the cheapest storage the kernel supports (--storage auto):
+# - task: BPF task local storage, next to the task_struct. It needs BTF task
+#   pointers: fentry probes (kfuncs) on try_to_wake_up() and
+#   wake_up_new_task() stamp the woken up tasks, the sched_switch raw
+#   tracepoint stamps the preempted current task, and a kprobe on
+#   finish_task_switch() counts the latency of the task switched in, all
+#   from bpf_get_current_task_btf(). Wakeups are stamped at the start of
+#   try_to_wake_up(), like sched_waking, so the latency also covers the
+#   wakeup itself, e.g. the IPI of a queued remote wakeup. Loads on Linux
+#   5.12+ built with BTF, where the task storage helpers are available to all
+#   tracing programs.
+# - array: an array indexed by pid and sized to kernel.pid_max. Its lookups
+#   are inlined by the verifier, at the cost of 8 bytes per possible pid.
+# - hash: the original BPF_HASH keyed by pid, an update on every wakeup and a
+#   lookup and delete on every switch.
+# --probe-cost enables kernel.bpf_stats_enabled and prints the events and
+# nsec per event of every probe each interval, to compare the modes.
+#
 # Copyright 2016 Netflix, Inc.
 # Licensed under the Apache License, Version 2.0 (the "License")
 #
@@ -26,8 +61,24 @@
 
 from __future__ import print_function
 from bcc import BPF
-from time import sleep, strftime
+from time import sleep, strftime, time
 import argparse
+import atexit
+import json
+import math
+import os
+import sys
+
+# bpf_log2l() slots of the per-CPU histogram
+MAX_SLOTS = 64
+# start timestamp storage modes, cheapest first
+STORAGE_MODES = ["task", "array", "hash"]
+PID_MAX_PATH = "/proc/sys/kernel/pid_max"
+# fentry targets of the task storage mode
+KFUNC_TARGETS = [b"try_to_wake_up", b"wake_up_new_task"]
+# kprobe target of the task storage mode, and its .isra clones
+FINISH_TASK_SWITCH_RE = br"^finish_task_switch$|^finish_task_switch\.isra\.\d+$"
+BPF_STATS_PATH = "/proc/sys/kernel/bpf_stats_enabled"
 
 # arguments
 examples = """examples:
@@ -36,6 +87,10 @@ examples = """examples:
     ./runqlat -mT 1      # 1s summaries, milliseconds, and timestamps
     ./runqlat -P         # show each PID separately
     ./runqlat -p 185     # trace PID 185 only
+    ./runqlat -C 1 1     # show each CPU separately, one 1 second summary
+    ./runqlat -S 16 1    # also print percentiles within 1/16 relative error
+    ./runqlat -S 16 -j - 1 # and print them as JSON lines
+    ./runqlat --storage hash --probe-cost 1 # nsec per probe with a pid hash
 """
 parser = argparse.ArgumentParser(
     description="Summarize run queue (scheduler) latency as a histogram",
@@ -53,6 +108,20 @@ parser.add_argument("--pidnss", action="store_true",
     help="print a histogram per PID namespace")
 parser.add_argument("-L", "--tids", action="store_true",
     help="print a histogram per thread ID")
+parser.add_argument("-C", "--cpus", action="store_true",
+    help="print a histogram per CPU")
+parser.add_argument("--shared-hist", action="store_true",
+    help="count in one histogram shared by all CPUs, to compare overheads")
+parser.add_argument("-S", "--sub-buckets", type=int, default=0,
+    help="log-linear sub-buckets per power of two for percentiles (e.g. 8, 16)")
+parser.add_argument("--percentiles", default="50,90,99,99.9",
+    help="comma separated percentiles printed with -S (default 50,90,99,99.9)")
+parser.add_argument("-j", "--json",
+    help="append the percentiles of every interval to this file as JSON lines, - for stdout")
+parser.add_argument("--storage", choices=["auto"] + STORAGE_MODES, default="auto",
+    help="storage of the enqueue timestamps (default: the first of task, array, hash supported)")
+parser.add_argument("--probe-cost", action="store_true",
+    help="print the events and nsec per event of every probe, from kernel.bpf_stats_enabled")
 parser.add_argument("-p", "--pid",
     help="trace this PID only")
 parser.add_argument("interval", nargs="?", default=99999999,
@@ -62,6 +131,14 @@ parser.add_argument("count", nargs="?", default=99999999,
 parser.add_argument("--ebpf", action="store_true",
     help=argparse.SUPPRESS)
 args = parser.parse_args()
+if args.cpus and (args.pids or args.tids or args.pidnss or args.shared_hist):
+    parser.error("-C only works with the per-CPU histogram")
+if args.sub_buckets and (args.sub_buckets < 2 or args.sub_buckets > 1024 or
+        args.sub_buckets & (args.sub_buckets - 1)):
+    parser.error("--sub-buckets must be a power of two from 2 to 1024")
+if args.json and not args.sub_buckets:
+    parser.error("-j needs -S")
+percentiles = [float(p) for p in args.percentiles.split(",")]
 countdown = int(args.count)
 debug = 0
 
@@ -82,18 +159,19 @@ typedef struct pidns_key {
     u64 slot;
 } pidns_key_t;
 
-BPF_HASH(start, u32);
+TS_MAP
 STORAGE
+LOGLIN_HIST
 
 struct rq;
 
 // record enqueue timestamp
-static int trace_enqueue(u32 tgid, u32 pid)
+static int trace_enqueue(struct task_struct *task, u32 tgid, u32 pid)
 {
     if (FILTER || pid == 0)
         return 0;
     u64 ts = bpf_ktime_get_ns();
-    start.update(&pid, &ts);
+    TS_UPDATE
     return 0;
 }
 """
@@ -101,13 +179,13 @@ static int trace_enqueue(u32 tgid, u32 pid)
 bpf_text_kprobe = """
 int trace_wake_up_new_task(struct pt_regs *ctx, struct task_struct *p)
 {
-    return trace_enqueue(p->tgid, p->pid);
+    return trace_enqueue(p, p->tgid, p->pid);
 }
 
 int trace_ttwu_do_wakeup(struct pt_regs *ctx, struct rq *rq, struct task_struct *p,
     int wake_flags)
 {
-    return trace_enqueue(p->tgid, p->pid);
+    return trace_enqueue(p, p->tgid, p->pid);
 }
 
 // calculate latency
@@ -116,12 +194,12 @@ int trace_run(struct pt_regs *ctx, struct task_struct *prev)
     u32 pid, tgid;
 
     // ivcsw: treat like an enqueue event and store timestamp
-    if (prev->state == TASK_RUNNING) {
+    if (prev->STATE_FIELD == TASK_RUNNING) {
         tgid = prev->tgid;
         pid = prev->pid;
         if (!(FILTER || pid == 0)) {
             u64 ts = bpf_ktime_get_ns();
-            start.update(&pid, &ts);
+            TS_UPDATE
         }
     }
 
@@ -132,17 +210,18 @@ int trace_run(struct pt_regs *ctx, struct task_struct *prev)
     u64 *tsp, delta;
 
     // fetch timestamp and calculate delta
-    tsp = start.lookup(&pid);
+    TS_LOOKUP
     if (tsp == 0) {
         return 0;   // missed enqueue
     }
     delta = bpf_ktime_get_ns() - *tsp;
+    LOGLIN_COUNT
     FACTOR
 
     // store as histogram
     STORE
 
-    start.delete(&pid);
+    TS_CLEAR
     return 0;
 }
 """
@@ -152,14 +231,14 @@ RAW_TRACEPOINT_PROBE(sched_wakeup)
 {
     // TP_PROTO(struct task_struct *p)
     struct task_struct *p = (struct task_struct *)ctx->args[0];
-    return trace_enqueue(p->tgid, p->pid);
+    return trace_enqueue(p, p->tgid, p->pid);
 }
 
 RAW_TRACEPOINT_PROBE(sched_wakeup_new)
 {
     // TP_PROTO(struct task_struct *p)
     struct task_struct *p = (struct task_struct *)ctx->args[0];
-    return trace_enqueue(p->tgid, p->pid);
+    return trace_enqueue(p, p->tgid, p->pid);
 }
 
 RAW_TRACEPOINT_PROBE(sched_switch)
@@ -170,12 +249,12 @@ RAW_TRACEPOINT_PROBE(sched_switch)
     u32 pid, tgid;
 
     // ivcsw: treat like an enqueue event and store timestamp
-    if (prev->state == TASK_RUNNING) {
+    if (prev->STATE_FIELD == TASK_RUNNING) {
         tgid = prev->tgid;
         pid = prev->pid;
         if (!(FILTER || pid == 0)) {
             u64 ts = bpf_ktime_get_ns();
-            start.update(&pid, &ts);
+            TS_UPDATE
         }
     }
 
@@ -186,28 +265,104 @@ RAW_TRACEPOINT_PROBE(sched_switch)
     u64 *tsp, delta;
 
     // fetch timestamp and calculate delta
-    tsp = start.lookup(&pid);
+    TS_LOOKUP
     if (tsp == 0) {
         return 0;   // missed enqueue
     }
     delta = bpf_ktime_get_ns() - *tsp;
+    LOGLIN_COUNT
     FACTOR
 
     // store as histogram
     STORE
 
-    start.delete(&pid);
+    TS_CLEAR
     return 0;
 }
 """
 
+# task local storage needs BTF task pointers: those of fentry probes for the
+# woken up tasks, and bpf_get_current_task_btf() at the switches. The
+# current task is prev at sched_switch, and next once finish_task_switch()
+# runs, which is kprobed as it is often an .isra clone without BTF.
+bpf_text_kfunc = """
+KFUNC_PROBE(wake_up_new_task, struct task_struct *p)
+{
+    return trace_enqueue(p, p->tgid, p->pid);
+}
+
+// ttwu_do_wakeup() is inlined on recent kernels, stamp at the start of the
+// wakeup instead, unless p is still queued (already runnable)
+KFUNC_PROBE(try_to_wake_up, struct task_struct *p, unsigned int state, int wake_flags)
+{
+    if (p->on_rq)
+        return 0;
+    return trace_enqueue(p, p->tgid, p->pid);
+}
+
+RAW_TRACEPOINT_PROBE(sched_switch)
+{
+    // current is prev
+    struct task_struct *task = bpf_get_current_task_btf();
+    u32 pid = task->pid, tgid = task->tgid;
+
+    // ivcsw: treat like an enqueue event and store timestamp
+    if (task->STATE_FIELD == TASK_RUNNING && !(FILTER || pid == 0)) {
+        u64 ts = bpf_ktime_get_ns();
+        TS_UPDATE
+    }
+    return 0;
+}
+
+// calculate latency, current is the task switched in
+int trace_run_task(struct pt_regs *ctx)
+{
+    struct task_struct *task = bpf_get_current_task_btf();
+    // --pidnss histograms key on the pid namespace of prev
+    struct task_struct *prev = task;
+    u32 pid = task->pid, tgid = task->tgid;
+    if (FILTER || pid == 0)
+        return 0;
+    u64 *tsp, delta;
+
+    // fetch timestamp and calculate delta
+    TS_LOOKUP
+    if (tsp == 0) {
+        return 0;   // missed enqueue
+    }
+    delta = bpf_ktime_get_ns() - *tsp;
+    LOGLIN_COUNT
+    FACTOR
+
+    // store as histogram
+    STORE
+
+    TS_CLEAR
+    return 0;
+}
+"""
+
+# the probes of every storage mode go through the substitutions below, and
+# are split apart when the program of a mode is loaded
+PROBES_SEPARATOR = "\n// probes\n"
 is_support_raw_tp = BPF.support_raw_tracepoint()
 if is_support_raw_tp:
-    bpf_text += bpf_text_raw_tp
+    bpf_text += PROBES_SEPARATOR + bpf_text_raw_tp
 else:
-    bpf_text += bpf_text_kprobe
+    bpf_text += PROBES_SEPARATOR + bpf_text_kprobe
+bpf_text += PROBES_SEPARATOR + bpf_text_kfunc
 
 # code substitutions
+def task_state_field():
+    '''
+    task_struct.state was renamed __state in Linux 5.14
+    '''
+    if hasattr(BPF, "kernel_struct_has_field"):
+        return "__state" if BPF.kernel_struct_has_field(b"task_struct", b"__state") == 1 else "state"
+    release = os.uname()[2].split("-")[0].split(".")
+    return "__state" if (int(release[0]), int(release[1])) >= (5, 14) else "state"
+
+bpf_text = bpf_text.replace('STATE_FIELD', task_state_field())
 if args.pid:
     # pid from userspace point of view is thread group from kernel pov
     bpf_text = bpf_text.replace('FILTER', 'tgid != %s' % args.pid)
@@ -237,28 +392,263 @@ elif args.pidnss:
     bpf_text = bpf_text.replace('STORE', 'pidns_key_t key = ' +
         '{.id = prev->nsproxy->pid_ns_for_children->ns.inum, ' +
         '.slot = bpf_log2l(delta)}; dist.increment(key);')
-else:
+elif args.shared_hist:
     section = ""
     bpf_text = bpf_text.replace('STORAGE', 'BPF_HISTOGRAM(dist);')
     bpf_text = bpf_text.replace('STORE',
         'dist.increment(bpf_log2l(delta));')
+else:
+    section = ""
+    bpf_text = bpf_text.replace('STORAGE',
+        'BPF_PERCPU_ARRAY(dist, u64, %d);' % MAX_SLOTS)
+    # the slot of this CPU is only written from this CPU, no atomics needed
+    bpf_text = bpf_text.replace('STORE',
+        'u32 slot = bpf_log2l(delta); ' +
+        'if (slot >= %d) slot = %d; ' % (MAX_SLOTS, MAX_SLOTS - 1) +
+        'u64 *count = dist.lookup(&slot); if (count) (*count)++;')
+if args.sub_buckets:
+    # bits of a value kept by its bucket, as in perf-trace/latency_sketch.py
+    loglin_bits = int(math.log(args.sub_buckets, 2)) + 1
+    loglin_slots = (64 - loglin_bits) * args.sub_buckets + 2 * args.sub_buckets
+    bpf_text = bpf_text.replace('LOGLIN_HIST',
+        'BPF_PERCPU_ARRAY(loglin, u64, %d);' % loglin_slots)
+    # below 2*SUB_BUCKETS nsec every value has its own bucket
+    bpf_text = bpf_text.replace('LOGLIN_COUNT',
+        'u32 shift = bpf_log2l(delta); ' +
+        'shift = shift > %d ? shift - %d : 0; ' % (loglin_bits, loglin_bits) +
+        'u32 bucket = shift * %d + (u32)(delta >> shift); ' % args.sub_buckets +
+        'if (bucket >= %d) bucket = %d; ' % (loglin_slots, loglin_slots - 1) +
+        'u64 *loglin_count = loglin.lookup(&bucket); if (loglin_count) (*loglin_count)++;')
+else:
+    bpf_text = bpf_text.replace('LOGLIN_HIST', '')
+    bpf_text = bpf_text.replace('LOGLIN_COUNT', '')
+bpf_common, bpf_tracing, bpf_kfunc = bpf_text.split(PROBES_SEPARATOR)
+
+def pid_max():
+    with open(PID_MAX_PATH) as f:
+        return int(f.read())
+
+def storage_text(mode):
+    '''
+    BPF program keeping the enqueue timestamps in the given storage mode
+    '''
+    if mode == "task":
+        text = bpf_common + bpf_kfunc
+        ts_map = 'BPF_TASK_STORAGE(start, u64);'
+        ts_update = ('u64 *enqueue_ts = start.task_storage_get(task, 0, ' +
+            'BPF_LOCAL_STORAGE_GET_F_CREATE); if (enqueue_ts) *enqueue_ts = ts;')
+        ts_lookup = 'tsp = start.task_storage_get(task, 0, 0);'
+    elif mode == "array":
+        text = bpf_common + bpf_tracing
+        ts_map = 'BPF_ARRAY(start, u64, %d);' % pid_max()
+        ts_update = 'u64 *enqueue_ts = start.lookup(&pid); if (enqueue_ts) *enqueue_ts = ts;'
+        ts_lookup = 'tsp = start.lookup(&pid);'
+    else:
+        text = bpf_common + bpf_tracing
+        ts_map = 'BPF_HASH(start, u32);'
+        ts_update = 'start.update(&pid, &ts);'
+        ts_lookup = 'tsp = start.lookup(&pid);'
+    if mode == "hash":
+        ts_clear = 'start.delete(&pid);'
+    else:
+        # task and array entries stay allocated, 0 marks them consumed
+        ts_lookup += ' if (tsp != 0 && *tsp == 0) tsp = 0;'
+        ts_clear = '*tsp = 0;'
+    text = text.replace('TS_MAP', ts_map)
+    text = text.replace('TS_UPDATE', ts_update)
+    text = text.replace('TS_LOOKUP', ts_lookup)
+    return text.replace('TS_CLEAR', ts_clear)
+
+def load(mode):
+    b = BPF(text=storage_text(mode))
+    if mode == "task":
+        b.attach_kprobe(event_re=FINISH_TASK_SWITCH_RE, fn_name="trace_run_task")
+    elif not is_support_raw_tp:
+        b.attach_kprobe(event="ttwu_do_wakeup", fn_name="trace_ttwu_do_wakeup")
+        b.attach_kprobe(event="wake_up_new_task", fn_name="trace_wake_up_new_task")
+        b.attach_kprobe(event="finish_task_switch", fn_name="trace_run")
+    return b
+
+def support_task_storage():
+    '''
+    Whether the fentry targets of the task mode exist under their own name,
+    not inlined nor only as .isra clones, and finish_task_switch() can be
+    kprobed
+    '''
+    return (BPF.support_kfunc() and all(BPF.ksymname(name) != -1 for name in KFUNC_TARGETS) and
+        len(BPF.get_kprobe_functions(FINISH_TASK_SWITCH_RE)) > 0)
+
+if args.storage == "auto":
+    storage_modes = STORAGE_MODES
+    if not support_task_storage():
+        storage_modes = [mode for mode in storage_modes if mode != "task"]
+else:
+    storage_modes = [args.storage]
 if debug or args.ebpf:
-    print(bpf_text)
+    print(storage_text(storage_modes[0]))
     if args.ebpf:
         exit()
 
-# load BPF program
-b = BPF(text=bpf_text)
-if not is_support_raw_tp:
-    b.attach_kprobe(event="ttwu_do_wakeup", fn_name="trace_ttwu_do_wakeup")
-    b.attach_kprobe(event="wake_up_new_task", fn_name="trace_wake_up_new_task")
-    b.attach_kprobe(event="finish_task_switch", fn_name="trace_run")
-
-print("Tracing run queue latency... Hit Ctrl-C to end.")
+# load BPF program, falling back to the next storage mode
+for storage in storage_modes:
+    try:
+        b = load(storage)
+        break
+    except Exception as e:
+        if storage == storage_modes[-1]:
+            raise
+        print("%s timestamp storage unavailable (%s), trying %s" % (storage, e,
+            storage_modes[storage_modes.index(storage) + 1]), file=sys.stderr)
+
+def stars(val, val_max, width):
+    if val_max == 0:
+        return ""
+    return "*" * int(width * val // val_max)
+
+def print_log2_hist(vals, val_type):
+    '''
+    Print bpf_log2l() slot counts like bcc's print_log2_hist
+    '''
+    idx_max = max([i for i, val in enumerate(vals) if val > 0] + [0])
+    val_max = max(vals)
+    if idx_max <= 32:
+        header = "     %-19s : count     distribution"
+        body = "%10d -> %-10d : %-8d |%-*s|"
+        width = 40
+    else:
+        header = "               %-29s : count     distribution"
+        body = "%20d -> %-20d : %-8d |%-*s|"
+        width = 20
+    if idx_max > 0:
+        print(header % val_type)
+    for i in range(1, idx_max + 1):
+        low = (1 << i) >> 1
+        high = (1 << i) - 1
+        if low == high:
+            low -= 1
+        print(body % (low, high, vals[i], width, stars(vals[i], val_max, width)))
+
+def read_percpu_array(table, slots):
+    '''
+    [slot][cpu] copy of a BPF_PERCPU_ARRAY, read with a single batched
+    lookup where the kernel supports it (5.6+), else slot by slot
+    '''
+    try:
+        per_cpu = [None] * slots
+        for key, value in table.items_lookup_batch():
+            per_cpu[key.value] = list(value)
+        if None not in per_cpu:
+            return per_cpu
+    except Exception:
+        pass
+    return [list(table.getvalue(table.Key(slot))) for slot in range(slots)]
+
+def print_percpu_hist(dist, label):
+    # per_cpu[slot][cpu]
+    per_cpu = read_percpu_array(dist, MAX_SLOTS)
+    if args.cpus:
+        for cpu in range(len(per_cpu[0])):
+            vals = [counts[cpu] for counts in per_cpu]
+            if any(vals):
+                print("\ncpu = %d" % cpu)
+                print_log2_hist(vals, label)
+    else:
+        print_log2_hist([sum(counts) for counts in per_cpu], label)
+
+def loglin_bucket_value(bucket):
+    '''
+    Midpoint of the nsec range counted by a log-linear bucket
+    '''
+    shift = max(bucket // args.sub_buckets - 1, 0)
+    low = (bucket - shift * args.sub_buckets) << shift
+    return low + ((1 << shift) - 1) / 2.0
+
+def loglin_percentiles(counts):
+    '''
+    (count, [value of every percentile in nsec]) of the log-linear histogram
+    counts, values being ranked as in perf-trace/latency_sketch.py
+    '''
+    total = sum(counts)
+    values = []
+    for p in percentiles:
+        rank = max(int(math.ceil(total * p / 100)), 1)
+        cumulative = 0
+        for bucket, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= rank:
+                break
+        values.append(loglin_bucket_value(bucket) if total else None)
+    return total, values
+
+def print_percentiles(loglin, label, json_out):
+    # one copy of the table per interval, summed over the CPUs
+    total, values = loglin_percentiles([sum(counts) for counts in
+        read_percpu_array(loglin, loglin_slots)])
+    unit = 1000000.0 if args.milliseconds else 1000.0
+    values = [None if value is None else value / unit for value in values]
+    print("percentiles (%s, +/-%.1f%%): " % (label, 100.0 / args.sub_buckets) +
+        "  ".join("p%g = %s" % (p, "-" if value is None else "%.3f" % value)
+            for p, value in zip(percentiles, values)))
+    if json_out is not None:
+        record = dict(time=time(), unit=label, count=total,
+            relative_error=1.0 / args.sub_buckets,
+            percentiles=dict(("p%g" % p, value) for p, value in zip(percentiles, values)))
+        json_out.write(json.dumps(record, sort_keys=True) + "\n")
+        json_out.flush()
+
+def enable_bpf_stats():
+    with open(BPF_STATS_PATH) as f:
+        enabled = f.read().strip()
+    with open(BPF_STATS_PATH, "w") as f:
+        f.write("1")
+    def restore():
+        with open(BPF_STATS_PATH, "w") as f:
+            f.write(enabled)
+    atexit.register(restore)
+
+def probe_stats():
+    '''
+    {probe: (run_cnt, run_time_ns)} of the loaded probes, from their fdinfo
+    '''
+    stats = {}
+    for name, fn in b.funcs.items():
+        fields = {}
+        with open("/proc/self/fdinfo/%d" % fn.fd) as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                fields[key] = value.strip()
+        name = name.decode() if isinstance(name, bytes) else name
+        stats[name] = (int(fields.get("run_cnt", 0)), int(fields.get("run_time_ns", 0)))
+    return stats
+
+def print_probe_cost(stats, prev_stats):
+    total_cnt = total_ns = 0
+    costs = []
+    for name in sorted(stats):
+        cnt = stats[name][0] - prev_stats.get(name, (0, 0))[0]
+        ns = stats[name][1] - prev_stats.get(name, (0, 0))[1]
+        total_cnt += cnt
+        total_ns += ns
+        costs.append("%s %d events %.1f ns/event" % (name, cnt, float(ns) / cnt if cnt else 0))
+    print("probe cost (%s timestamps): %s, all %.1f ns/event" % (storage,
+        ", ".join(costs), float(total_ns) / total_cnt if total_cnt else 0))
+
+prev_stats = {}
+if args.probe_cost:
+    enable_bpf_stats()
+    prev_stats = probe_stats()
+
+print("Tracing run queue latency (%s timestamps)... Hit Ctrl-C to end." % storage)
+# runqlat_overhead.py waits for this line through a pipe
+sys.stdout.flush()
 
 # output
 exiting = 0 if args.interval else 1
 dist = b.get_table("dist")
+loglin = b.get_table("loglin") if args.sub_buckets else None
+json_out = None
+if args.json:
+    json_out = sys.stdout if args.json == "-" else open(args.json, "a")
 while (1):
     try:
         sleep(int(args.interval))
@@ -269,8 +659,18 @@ while (1):
     if args.timestamp:
         print("%-8s\n" % strftime("%H:%M:%S"), end="")
 
-    dist.print_log2_hist(label, section, section_print_fn=int)
+    if args.pids or args.tids or args.pidnss or args.shared_hist:
+        dist.print_log2_hist(label, section, section_print_fn=int)
+    else:
+        print_percpu_hist(dist, label)
     dist.clear()
+    if loglin is not None:
+        print_percentiles(loglin, label, json_out)
+        loglin.clear()
+    if args.probe_cost:
+        stats = probe_stats()
+        print_probe_cost(stats, prev_stats)
+        prev_stats = stats
 
     countdown -= 1
     if exiting or countdown == 0:
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# Probe overhead of runqlat.py with its per-CPU histogram, compared to the
+# histogram shared by all CPUs (runqlat.py --shared-hist), and of its enqueue
+# timestamp storage modes (runqlat.py --storage).
+#
+# A context switch heavy workload is timed without tracing and under both
+# runqlat.py variants, runs of the configurations being interleaved. The
+# slowdown is reported as a percentage of the untraced runtime and as nsec
+# per context switch, counted from the ctxt line of /proc/stat. Needs root and
+# bcc, as runqlat.py does. Storage modes the kernel doesn't support are
+# skipped.
+#
+# Example:
+# ========
+# $> python runqlat_overhead.py -r 5
+# config              runtime(s)     stdev   ctxsw/s      overhead   ns/ctxsw
+# no tracing          ...
+# shared histogram    ...
+# per-CPU histogram   ...
+# task storage        ...
+# pid array           ...
+# pid hash            ...
+#
+# @author: parth@linux.ibm.com
+
+from __future__ import print_function
+import argparse
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+RUNQLAT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runqlat.py")
+# seconds for runqlat.py to compile and attach its BPF program
+START_TIMEOUT = 60
+CONFIGS = [("no tracing", None),
+        ("shared histogram", ["--shared-hist"]),
+        ("per-CPU histogram", []),
+        ("task storage", ["--storage", "task"]),
+        ("pid array", ["--storage", "array"]),
+        ("pid hash", ["--storage", "hash"])]
+
+examples = """examples
+    ./runqlat_overhead.py -r 10   # 10 runs of every configuration
+    ./runqlat_overhead.py -w "perf bench sched pipe -l 1000000"
+"""
+
+parser = argparse.ArgumentParser(
+        description="Measure the probe overhead of runqlat.py histograms and timestamp storage modes",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=examples)
+parser.add_argument("-r", "--runs", type=int, default=5, help="runs of every configuration (default 5)")
+parser.add_argument("-w", "--workload", default="perf bench sched messaging -g 40 -l 2000",
+        help="context switch heavy command to time (default: perf bench sched messaging -g 40 -l 2000)")
+args = parser.parse_args()
+
+def context_switches():
+    for line in open("/proc/stat"):
+        if line.startswith("ctxt"):
+            return int(line.split()[1])
+
+def start_tracer(tracer_args):
+    # unbuffered, or the Tracing line would wait in the pipe buffer
+    tracer = subprocess.Popen([sys.executable, "-u", RUNQLAT] + tracer_args,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    # a tracer stuck before tracing is killed, ending its stdout
+    timer = threading.Timer(START_TIMEOUT, tracer.kill)
+    timer.start()
+    try:
+        # the probes are attached once the BPF program is loaded
+        for line in tracer.stdout:
+            if line.startswith("Tracing"):
+                return tracer
+    finally:
+        timer.cancel()
+    tracer.kill()
+    tracer.wait()
+    raise RuntimeError("runqlat.py exited or timed out before tracing")
+
+def stop_tracer(tracer):
+    tracer.send_signal(signal.SIGINT)
+    tracer.communicate()
+
+def run_workload():
+    ctxt = context_switches()
+    start = time.monotonic()
+    subprocess.check_call(shlex.split(args.workload), stdout=subprocess.DEVNULL)
+    return time.monotonic() - start, context_switches() - ctxt
+
+runtimes = dict((name, []) for name, tracer_args in CONFIGS)
+switches = dict((name, []) for name, tracer_args in CONFIGS)
+configs = list(CONFIGS)
+for run in range(args.runs):
+    for name, tracer_args in list(configs):
+        try:
+            tracer = start_tracer(tracer_args) if tracer_args is not None else None
+        except RuntimeError:
+            print("%s unavailable, skipped" % name, file=sys.stderr)
+            configs.remove((name, tracer_args))
+            continue
+        try:
+            runtime, ctxt = run_workload()
+        finally:
+            if tracer is not None:
+                stop_tracer(tracer)
+        runtimes[name].append(runtime)
+        switches[name].append(ctxt)
+        print("run %d %-20s %8.3f s" % (run, name, runtime), file=sys.stderr)
+
+def mean(values):
+    return sum(values) / len(values)
+
+def stdev(values):
+    if len(values) < 2:
+        return 0.0
+    m = mean(values)
+    return (sum((v - m) ** 2 for v in values) / (len(values) - 1)) ** 0.5
+
+base = mean(runtimes[CONFIGS[0][0]])
+print("%-20s %10s %9s %9s %13s %10s" % ("config", "runtime(s)", "stdev", "ctxsw/s", "overhead", "ns/ctxsw"))
+for name, tracer_args in configs:
+    runtime = mean(runtimes[name])
+    ctxt = mean(switches[name])
+    line = "%-20s %10.3f %9.3f %9d" % (name, runtime, stdev(runtimes[name]), ctxt / runtime)
+    if tracer_args is not None:
+        line += " %11.2f %% %10.1f" % (100.0 * (runtime - base) / base, (runtime - base) * (10**9) / ctxt)
+    print(line)
@@ -0,0 +1,348 @@
+#!/usr/bin/python
+# BPF python script to log the wakeups waiting longer than a threshold on a
+# run queue, to find out who hit the tail of runqlat.py histograms.
+#
+# sched_switch emits a ring buffer record only for tasks which waited at
+# least min_us since their enqueue. A record carries the task, its CPU, the
+# task switched out for it and the waker, unknown (0) when the task was
+# preempted rather than woken up. The waker is taken at sched_waking, which
+# runs in its context, whereas sched_wakeup of a queued remote wakeup
+# (TTWU_QUEUE) runs on the target CPU in whatever task it interrupted; a new
+# task is woken up by its parent at sched_wakeup_new. Records are rate limited in-kernel by a
+# token bucket per CPU (--rate records/sec, bursts of --burst), so that
+# latency storms don't flood userspace. Records over the rate, or not fitting
+# in the ring buffer, are counted as drops and reported at exit.
+#
+# Records are consumed in batches, one per ring buffer poll. With -o every
+# batch is appended with a single write to a compact binary log of the raw
+# records, which --read prints back as text.
+#
+# Needs raw tracepoints and the BPF ring buffer, i.e. Linux 5.8+.
+#
+# @author: parth@linux.ibm.com
+#
+# Example:
+# ========
+# $> python runqslower.py 5000
+# Tracing run queue latency higher than 5000 us... Hit Ctrl-C to end.
+# TIME         COMM             TID     CPU  LAT(us) PREV COMM        PREV TID WAKER COMM       WAKER TID
+# 10:21:07.113 kworker/4:1      271       4     6133 stress-ng-cpu    9322     swapper/12       0
+# ...
+# 1 records, 0 rate limited, 0 ring buffer full
+
+from __future__ import print_function
+from bcc import BPF
+from datetime import datetime
+import argparse
+import ctypes
+import os
+import sys
+import time
+
+TASK_COMM_LEN = 16
+LOG_MAGIC = b"RUNQSLOWER1\n"
+POLL_TIMEOUT_MS = 100
+# indices of the drop counters
+DROP_RATE = 0
+DROP_RINGBUF = 1
+
+examples = """examples
+    ./runqslower.py              # log run queue latency higher than 10 ms
+    ./runqslower.py 1000         # log run queue latency higher than 1 ms
+    ./runqslower.py -p 185       # only for PID 185
+    ./runqslower.py --rate 100   # at most 100 records/sec per CPU
+    ./runqslower.py -o slow.log  # log to a binary file
+    ./runqslower.py --read slow.log
+"""
+
+parser = argparse.ArgumentParser(
+        description="Log run queue latency higher than a threshold",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=examples)
+parser.add_argument("min_us", nargs="?", default=10000, type=int,
+        help="minimum run queue latency to log, in us (default 10000)")
+parser.add_argument("-p", "--pid", type=int, help="trace this PID only")
+parser.add_argument("-L", "--tid", type=int, help="trace this TID only")
+parser.add_argument("--rate", type=int, default=1000,
+        help="records per second per CPU, over which records are dropped (default 1000)")
+parser.add_argument("--burst", type=int, default=100,
+        help="records per CPU emitted back to back within the rate (default 100)")
+parser.add_argument("--ringbuf-pages", type=int, default=64,
+        help="ring buffer size in pages, a power of two (default 64)")
+parser.add_argument("-d", "--duration", type=float, default=None,
+        help="seconds to trace for (default: until Ctrl-C)")
+parser.add_argument("-o", "--output", help="write the records to this binary log instead of printing them")
+parser.add_argument("--read", metavar="LOG", help="print the records of a binary log and exit")
+parser.add_argument("--ebpf", action="store_true", help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+class Event(ctypes.Structure):
+    _fields_ = [('ts', ctypes.c_ulonglong),
+            ('delta_ns', ctypes.c_ulonglong),
+            ('pid', ctypes.c_uint),
+            ('prev_pid', ctypes.c_uint),
+            ('waker_pid', ctypes.c_uint),
+            ('cpu', ctypes.c_uint),
+            ('comm', ctypes.c_char * TASK_COMM_LEN),
+            ('prev_comm', ctypes.c_char * TASK_COMM_LEN),
+            ('waker_comm', ctypes.c_char * TASK_COMM_LEN)]
+
+def print_header():
+    print("%-12s %-16s %-7s %3s %8s %-16s %-8s %-16s %-8s" % ("TIME", "COMM", "TID", "CPU",
+        "LAT(us)", "PREV COMM", "PREV TID", "WAKER COMM", "WAKER TID"))
+
+def print_records(records, wall_offset):
+    lines = []
+    for raw in records:
+        e = Event.from_buffer_copy(raw)
+        ts = datetime.fromtimestamp(e.ts / 1e9 + wall_offset).strftime("%H:%M:%S.%f")[:-3]
+        lines.append("%-12s %-16s %-7d %3d %8d %-16s %-8d %-16s %-8d\n" % (ts,
+            e.comm.decode(errors="replace"), e.pid, e.cpu, e.delta_ns // 1000,
+            e.prev_comm.decode(errors="replace"), e.prev_pid,
+            e.waker_comm.decode(errors="replace"), e.waker_pid))
+    sys.stdout.writelines(lines)
+
+if args.read:
+    with open(args.read, "rb") as f:
+        if f.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            sys.exit("%s is not a runqslower.py log" % args.read)
+        # ktime to wall clock offset of the tracing run
+        wall_offset = float(f.readline())
+        data = f.read()
+    size = ctypes.sizeof(Event)
+    print_header()
+    print_records([data[i:i + size] for i in range(0, len(data) - size + 1, size)], wall_offset)
+    sys.exit()
+
+# define BPF program
+bpf_text = """
+#include <uapi/linux/ptrace.h>
+#include <linux/sched.h>
+
+struct waker_t {
+    u32 pid;
+    char comm[TASK_COMM_LEN];
+};
+
+struct enqueue_t {
+    u64 ts;
+    struct waker_t waker;
+};
+
+struct event_t {
+    u64 ts;
+    u64 delta_ns;
+    u32 pid;
+    u32 prev_pid;
+    u32 waker_pid;
+    u32 cpu;
+    char comm[TASK_COMM_LEN];
+    char prev_comm[TASK_COMM_LEN];
+    char waker_comm[TASK_COMM_LEN];
+};
+
+// token bucket, in nsec of credit
+struct limit_t {
+    u64 credit;
+    u64 last;
+};
+
+BPF_HASH(start, u32, struct enqueue_t);
+BPF_HASH(waking, u32, struct waker_t);
+BPF_PERCPU_ARRAY(limit, struct limit_t, 1);
+BPF_PERCPU_ARRAY(drops, u64, 2);
+BPF_RINGBUF_OUTPUT(events, RINGBUF_PAGES);
+
+static void current_waker(struct waker_t *waker)
+{
+    waker->pid = bpf_get_current_pid_tgid();
+    bpf_get_current_comm(&waker->comm, sizeof(waker->comm));
+}
+
+// record enqueue timestamp, with the waker when woken up
+static int trace_enqueue(u32 tgid, u32 pid, struct waker_t *waker)
+{
+    if (FILTER || pid == 0)
+        return 0;
+    struct enqueue_t val = {};
+    val.ts = bpf_ktime_get_ns();
+    if (waker)
+        __builtin_memcpy(&val.waker, waker, sizeof(val.waker));
+    start.update(&pid, &val);
+    return 0;
+}
+
+static int drop(u32 reason)
+{
+    u64 *count = drops.lookup(&reason);
+    if (count)
+        (*count)++;
+    return 0;
+}
+
+RAW_TRACEPOINT_PROBE(sched_waking)
+{
+    // TP_PROTO(struct task_struct *p), in the context of the waker
+    struct task_struct *p = (struct task_struct *)ctx->args[0];
+    u32 tgid = p->tgid, pid = p->pid;
+    if (FILTER || pid == 0)
+        return 0;
+    struct waker_t waker = {};
+    current_waker(&waker);
+    waking.update(&pid, &waker);
+    return 0;
+}
+
+RAW_TRACEPOINT_PROBE(sched_wakeup)
+{
+    // TP_PROTO(struct task_struct *p), maybe on the target CPU
+    struct task_struct *p = (struct task_struct *)ctx->args[0];
+    u32 pid = p->pid;
+    struct waker_t *waker = waking.lookup(&pid);
+    trace_enqueue(p->tgid, pid, waker);
+    if (waker)
+        waking.delete(&pid);
+    return 0;
+}
+
+RAW_TRACEPOINT_PROBE(sched_wakeup_new)
+{
+    // TP_PROTO(struct task_struct *p), in the context of the parent
+    struct task_struct *p = (struct task_struct *)ctx->args[0];
+    struct waker_t waker = {};
+    current_waker(&waker);
+    return trace_enqueue(p->tgid, p->pid, &waker);
+}
+
+RAW_TRACEPOINT_PROBE(sched_switch)
+{
+    // TP_PROTO(bool preempt, struct task_struct *prev, struct task_struct *next)
+    struct task_struct *prev = (struct task_struct *)ctx->args[1];
+    struct task_struct *next = (struct task_struct *)ctx->args[2];
+    u32 pid, tgid;
+
+    // ivcsw: treat like an enqueue event, without waker
+    if (prev->STATE_FIELD == TASK_RUNNING)
+        trace_enqueue(prev->tgid, prev->pid, NULL);
+
+    tgid = next->tgid;
+    pid = next->pid;
+    if (FILTER || pid == 0)
+        return 0;
+
+    struct enqueue_t *enq = start.lookup(&pid);
+    if (enq == 0)
+        return 0;   // missed enqueue
+    u64 now = bpf_ktime_get_ns();
+    u64 delta = now - enq->ts;
+    if (delta < MIN_NS) {
+        start.delete(&pid);
+        return 0;
+    }
+
+    // a record costs 1/rate sec of credit, earned back with time up to burst records
+    u32 zero = 0;
+    struct limit_t *lim = limit.lookup(&zero);
+    if (lim == 0)
+        return 0;
+    lim->credit += now - lim->last;
+    lim->last = now;
+    if (lim->credit > BURST_NS)
+        lim->credit = BURST_NS;
+    if (lim->credit < COST_NS) {
+        start.delete(&pid);
+        return drop(DROP_RATE);
+    }
+    lim->credit -= COST_NS;
+
+    struct event_t *e = events.ringbuf_reserve(sizeof(struct event_t));
+    if (e == 0) {
+        start.delete(&pid);
+        return drop(DROP_RINGBUF);
+    }
+    e->ts = now;
+    e->delta_ns = delta;
+    e->pid = pid;
+    e->prev_pid = prev->pid;
+    e->waker_pid = enq->waker.pid;
+    e->cpu = bpf_get_smp_processor_id();
+    bpf_probe_read_kernel_str(&e->comm, sizeof(e->comm), next->comm);
+    bpf_probe_read_kernel_str(&e->prev_comm, sizeof(e->prev_comm), prev->comm);
+    __builtin_memcpy(&e->waker_comm, enq->waker.comm, sizeof(e->waker_comm));
+    events.ringbuf_submit(e, 0);
+
+    start.delete(&pid);
+    return 0;
+}
+"""
+
+def task_state_field():
+    '''
+    task_struct.state was renamed __state in Linux 5.14
+    '''
+    if hasattr(BPF, "kernel_struct_has_field"):
+        return "__state" if BPF.kernel_struct_has_field(b"task_struct", b"__state") == 1 else "state"
+    release = os.uname()[2].split("-")[0].split(".")
+    return "__state" if (int(release[0]), int(release[1])) >= (5, 14) else "state"
+
+bpf_text = bpf_text.replace('STATE_FIELD', task_state_field())
+if args.pid:
+    # pid from userspace point of view is thread group from kernel pov
+    bpf_text = bpf_text.replace('FILTER', 'tgid != %d' % args.pid)
+elif args.tid:
+    bpf_text = bpf_text.replace('FILTER', 'pid != %d' % args.tid)
+else:
+    bpf_text = bpf_text.replace('FILTER', '0')
+cost_ns = (10**9) // max(args.rate, 1)
+bpf_text = bpf_text.replace('MIN_NS', '%dULL' % (args.min_us * 1000))
+bpf_text = bpf_text.replace('COST_NS', '%dULL' % cost_ns)
+bpf_text = bpf_text.replace('BURST_NS', '%dULL' % (cost_ns * max(args.burst, 1)))
+bpf_text = bpf_text.replace('RINGBUF_PAGES', str(args.ringbuf_pages))
+bpf_text = bpf_text.replace('DROP_RATE', str(DROP_RATE))
+bpf_text = bpf_text.replace('DROP_RINGBUF', str(DROP_RINGBUF))
+if args.ebpf:
+    print(bpf_text)
+    exit()
+
+b = BPF(text=bpf_text)
+
+# bpf_ktime_get_ns() is CLOCK_MONOTONIC
+wall_offset = time.time() - time.monotonic()
+batch = []
+nr_records = 0
+
+def collect(ctx, data, size):
+    batch.append(ctypes.string_at(data, size))
+
+b["events"].open_ring_buffer(collect)
+
+out = None
+if args.output:
+    out = open(args.output, "wb")
+    out.write(LOG_MAGIC + b"%f\n" % wall_offset)
+
+print("Tracing run queue latency higher than %d us... Hit Ctrl-C to end." % args.min_us)
+if out is None:
+    print_header()
+
+start = time.time()
+try:
+    while args.duration is None or time.time() - start < args.duration:
+        b.ring_buffer_poll(POLL_TIMEOUT_MS)
+        if not batch:
+            continue
+        if out is not None:
+            out.write(b"".join(batch))
+        else:
+            print_records(batch, wall_offset)
+        nr_records += len(batch)
+        del batch[:]
+except KeyboardInterrupt:
+    pass
+
+if out is not None:
+    out.close()
+drops = b["drops"]
+print("%d records, %d rate limited, %d ring buffer full" % (nr_records,
+    drops.sum(drops.Key(DROP_RATE)).value, drops.sum(drops.Key(DROP_RINGBUF)).value),
+    file=sys.stderr)
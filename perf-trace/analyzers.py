@@ -0,0 +1,197 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Registry of analyzer plugins and a dispatcher which decodes each sched
+# event once and fans it out to every selected analyzer.
+#
+# An analyzer is any object with
+# - EVENTS: names of the tracepoints it handles ("sched_wakeup", ...)
+# - one handler per event, taking the event ktime in nsec and common_cpu,
+#   followed by the tracepoint fields as keyword arguments
+# - report(out): print the end-of-trace results
+#
+# Plugins are registered with @register(name, help) on a factory taking the
+# parsed command line options and the output file.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+import errant_analysis
+import heavy_hitters
+import latency_analysis
+import migration_analysis
+import wakeup_analysis
+from schedstat_parser import parse_cpulist
+
+ANALYZERS = dict() # name: (factory, help)
+
+def register(name, help):
+    def decorator(factory):
+        ANALYZERS[name] = (factory, help)
+        return factory
+    return decorator
+
+
+class RunqlenHistogram:
+    '''
+    Histogram of nr_running samples from sched_update_nr_running, overall
+    and per CPU
+    '''
+    EVENTS = ('sched_update_nr_running',)
+
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.hist = dict()
+        self.per_cpu_hist = dict()
+
+    def sched_update_nr_running(self, ts, common_cpu, cpu, nr_running, **fields):
+        self.hist[nr_running] = self.hist.get(nr_running, 0) + 1
+        cpu_hist = self.per_cpu_hist.setdefault(cpu, dict())
+        cpu_hist[nr_running] = cpu_hist.get(nr_running, 0) + 1
+
+    def report(self, out=None):
+        out = out or self.out
+        print("Histogram of {nr_running: sample} = ", dict(sorted(self.hist.items())), file=out)
+        for cpu in sorted(self.per_cpu_hist):
+            print("CPU", cpu, ":", dict(sorted(self.per_cpu_hist[cpu].items())), file=out)
+
+
+def load_topology(options):
+    import schedstat_parser
+    if options.topology:
+        return schedstat_parser.CpuTopology(options.topology)
+    if options.no_topology:
+        return None
+    try:
+        return schedstat_parser.CpuTopology()
+    except:
+        return None
+
+@register('sched-test', "wakeup accuracy from nr_running traces, SMT mode, wake affine and latencies (sched-test.py)")
+def sched_test(options, out):
+    return wakeup_analysis.WakeupAnalyzer(load_topology(options), nr_cpus=options.nr_cpus,
+            wakeup_scope_size=options.wakeup_scope_size,
+            latency_threshold_us=options.latency_threshold_us,
+            verbose_level=options.verbose_level, offline_cpus=options.offline_cpus,
+            whitelist_tasks=options.whitelist_tasks, latency_percentiles=options.percentiles,
+            latency_relative_error=options.relative_error,
+            pending_ttl_us=options.pending_ttl_us, top_k=options.top_k,
+            window_us=options.window_us, window_step_us=options.window_step_us,
+            extended_report=options.extended_report, out=out)
+
+@register('errant-wakeups', "wakeup accuracy with derived runqueue lengths (errant-wakeups.py)")
+def errant_wakeups(options, out):
+    return errant_analysis.ErrantWakeupAnalyzer(nr_cpus=options.nr_cpus,
+            wakeup_scope_size=options.wakeup_scope_size,
+            latency_threshold_us=options.latency_threshold_us,
+            verbose=options.verbose_level >= 2, offline_cpus=options.offline_cpus,
+            pending_ttl_us=options.pending_ttl_us, out=out)
+
+@register('oddeven', "errant-wakeups only suggesting CPUs of the waker's thread parity (errant_wakeup_oddeven.py)")
+def oddeven(options, out):
+    return errant_analysis.ErrantWakeupAnalyzer(nr_cpus=options.nr_cpus,
+            wakeup_scope_size=options.wakeup_scope_size,
+            latency_threshold_us=options.latency_threshold_us,
+            verbose=options.verbose_level >= 2, offline_cpus=options.offline_cpus,
+            odd_even=True, pending_ttl_us=options.pending_ttl_us, out=out)
+
+@register('latency', "scheduler decision latency, scheduling latency and pre-migration wait time")
+def latency(options, out):
+    return latency_analysis.LatencyAnalyzer(latency_threshold_us=options.latency_threshold_us,
+            verbose_level=options.verbose_level, latency_percentiles=options.percentiles,
+            latency_relative_error=options.relative_error,
+            pending_ttl_us=options.pending_ttl_us, window_us=options.window_us,
+            window_step_us=options.window_step_us, extended_report=options.extended_report,
+            out=out)
+
+@register('migrations', "NxN CPU migration matrix broken down by topology distance")
+def migrations(options, out):
+    return migration_analysis.MigrationAnalyzer(load_topology(options), nr_cpus=options.nr_cpus,
+            wakeup_scope_size=options.wakeup_scope_size, out=out)
+
+@register('top', "comms/pids with the highest total scheduling latency over the threshold")
+def top(options, out):
+    return heavy_hitters.AttributionAnalyzer(top_k=options.top_k or heavy_hitters.TOP_K,
+            latency_percentiles=options.percentiles,
+            latency_threshold_us=options.latency_threshold_us,
+            pending_ttl_us=options.pending_ttl_us, out=out)
+
+@register('runqlen', "histogram of nr_running from sched_update_nr_running")
+def runqlen(options, out):
+    return RunqlenHistogram(out=out)
+
+
+def add_arguments(parser):
+    parser.add_argument("-a", "--analyzers", type=analyzer_names, default=["sched-test"],
+        help="comma separated analyzers to run: " + ", ".join(sorted(ANALYZERS)))
+    parser.add_argument("--nr-cpus", type=int, default=wakeup_analysis.NR_CPUS)
+    parser.add_argument("--wakeup-scope-size", type=int, default=wakeup_analysis.WAKEUP_SCOPE_SIZE)
+    parser.add_argument("--latency-threshold-us", type=int, default=wakeup_analysis.LATENCY_THRESHOLD_US)
+    parser.add_argument("-v", "--verbose-level", type=int, default=wakeup_analysis.VERBOSE_LEVEL)
+    parser.add_argument("--offline-cpus", type=parse_cpulist, default=[],
+        help="cpulist of offline CPUs, e.g. 40-79")
+    parser.add_argument("--whitelist-tasks", type=lambda text: [i for i in text.split(',') if i],
+        default=[], help="comma separated comms to analyze exclusively")
+    parser.add_argument("-P", "--percentiles",
+        type=lambda text: [float(p) if '.' in p else int(p) for p in text.split(',')],
+        default=wakeup_analysis.LATENCY_PERCENTILES,
+        help="comma separated latency percentiles to report")
+    parser.add_argument("--relative-error", type=float, default=wakeup_analysis.LATENCY_RELATIVE_ERROR,
+        help="error bound of the reported latency percentiles")
+    parser.add_argument("--pending-ttl-us", type=int, default=wakeup_analysis.PENDING_WAKEUP_TTL_US,
+        help="drop wakeups not switched in within this many usec, 0 to keep them")
+    parser.add_argument("--top-k", type=int, default=wakeup_analysis.TOP_K,
+        help="comms/pids listed with the highest scheduling latency (default: none in sched-test, "
+        "%d in top)" % heavy_hitters.TOP_K)
+    parser.add_argument("--window-us", type=int, default=wakeup_analysis.WINDOW_US,
+        help="also report latency percentiles over sliding windows of this many usec, 0 to disable")
+    parser.add_argument("--window-step-us", type=int, default=wakeup_analysis.WINDOW_STEP_US,
+        help="usec between the sliding windows")
+    parser.add_argument("-x", "--extended-report", action="store_true",
+        help="also report min/max/mean, and the idle core, migration and dropped wakeup sections "
+        "in sched-test")
+    parser.add_argument("--topology",
+        help="topology saved by save-topology.py on the traced machine (default: this machine)")
+    parser.add_argument("--no-topology", action="store_true",
+        help="don't read the topology of this machine")
+
+def analyzer_names(text):
+    '''
+    argparse type of a comma separated list of registered analyzers
+    '''
+    names = [name for name in text.split(',') if name]
+    for name in names:
+        if name not in ANALYZERS:
+            raise argparse.ArgumentTypeError("unknown analyzer %s, choose from %s" %
+                    (name, ", ".join(sorted(ANALYZERS))))
+    if not names:
+        raise argparse.ArgumentTypeError("no analyzer given")
+    return names
+
+def create(options, out=sys.stdout):
+    return [(name, ANALYZERS[name][0](options, out)) for name in options.analyzers]
+
+
+class Dispatcher:
+    def __init__(self, analyzers, out=sys.stdout):
+        '''
+        @analyzers: list of (name, analyzer)
+        '''
+        self.analyzers = analyzers
+        self.out = out
+        self.handlers = dict()
+        for name, analyzer in analyzers:
+            for event_name in analyzer.EVENTS:
+                self.handlers.setdefault(event_name, []).append(getattr(analyzer, event_name))
+
+    def dispatch(self, event_name, ts, common_cpu, fields):
+        for handler in self.handlers.get(event_name, ()):
+            handler(ts, common_cpu, **fields)
+
+    def report(self):
+        for name, analyzer in self.analyzers:
+            print(("==================== %s " % name).ljust(76, "="), file=self.out)
+            analyzer.report(self.out)
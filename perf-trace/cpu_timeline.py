@@ -0,0 +1,141 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Per-CPU idle/busy/runnable timeline of a trace, indexed for point and range
+# queries after the fact.
+#
+# Every CPU keeps the ktimes at which its state changed and the state it
+# changed to, appended in arrays while the trace is read. Consecutive samples
+# of the same state are folded, so the arrays hold the intervals of the
+# timeline. The index built from them on the first query answers with
+# np.searchsorted:
+# - state_at(): state of CPUs at given ktimes
+# - idle_until(): end of the idle interval CPUs are in at given ktimes
+# - idle_time(): nsec CPUs spent idle between given ktimes, from prefix sums
+#   of the idle time at every change
+#
+# The state is taken from sched_update_nr_running when a CPU has it, and from
+# power:cpu_idle entry/exit otherwise. Before the first sample of a CPU its
+# state is UNKNOWN and never counts as idle.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from array import array
+
+import numpy as np
+
+# CPU states, RUNNABLE is a busy CPU with tasks waiting on its runqueue
+UNKNOWN = -1
+IDLE = 0
+BUSY = 1
+RUNNABLE = 2
+STATES = ('idle', 'busy', 'runnable')
+
+# power:cpu_idle states below this enter idle, PWR_EVENT_EXIT leaves it
+IDLE_STATE_MAX = 100
+
+
+class CpuTimeline:
+    def __init__(self):
+        self.ts = dict() # cpu: array of change ktimes
+        self.state = dict() # cpu: array of the states changed to
+        self.nr_running_cpus = set() # CPUs with sched_update_nr_running samples
+        self.last_ts = None
+        self.index = None
+
+    def update(self, ts, cpu, state):
+        if self.last_ts is None or ts > self.last_ts:
+            self.last_ts = ts
+        if cpu not in self.ts:
+            self.ts[cpu] = array('q')
+            self.state[cpu] = array('b')
+        elif self.state[cpu][-1] == state:
+            return
+        self.ts[cpu].append(ts)
+        self.state[cpu].append(state)
+        self.index = None
+
+    def sched_update_nr_running(self, ts, cpu, nr_running):
+        self.nr_running_cpus.add(cpu)
+        self.update(ts, cpu, min(nr_running, RUNNABLE))
+
+    def cpu_idle(self, ts, cpu_id, state):
+        if cpu_id in self.nr_running_cpus:
+            return
+        self.update(ts, cpu_id, IDLE if state < IDLE_STATE_MAX else BUSY)
+
+    def build_index(self):
+        '''
+        cpu: (ts, state, idle_ns) arrays, idle_ns being the nsec spent idle
+        before each change
+        '''
+        if self.index is not None:
+            return self.index
+        self.index = dict()
+        for cpu in self.ts:
+            ts = np.frombuffer(self.ts[cpu], dtype=np.int64)
+            state = np.frombuffer(self.state[cpu], dtype=np.int8)
+            idle_ns = np.zeros(len(ts), dtype=np.int64)
+            np.cumsum(np.diff(ts)*(state[:-1] == IDLE), out=idle_ns[1:])
+            self.index[cpu] = (ts, state, idle_ns)
+        return self.index
+
+    def lookup(self, cpus, ts):
+        '''
+        Position in its CPU's arrays of the interval each (cpu, ts) is in, -1
+        before the first change, with the arrays of every CPU queried
+        '''
+        index = self.build_index()
+        cpus = np.asarray(cpus, dtype=np.int64)
+        ts = np.asarray(ts, dtype=np.int64)
+        pos = np.full(len(ts), -1, dtype=np.int64)
+        arrays = dict()
+        for cpu in np.unique(cpus).tolist():
+            if cpu not in index:
+                continue
+            rows = np.nonzero(cpus == cpu)[0]
+            pos[rows] = np.searchsorted(index[cpu][0], ts[rows], side='right') - 1
+            arrays[cpu] = (rows, index[cpu])
+        return pos, arrays
+
+    def state_at(self, cpus, ts):
+        '''
+        State (IDLE, BUSY, RUNNABLE or UNKNOWN) of each CPU at each ktime
+        '''
+        pos, arrays = self.lookup(cpus, ts)
+        states = np.full(len(pos), UNKNOWN, dtype=np.int64)
+        for rows, (cpu_ts, cpu_state, idle_ns) in arrays.values():
+            known = rows[pos[rows] >= 0]
+            states[known] = cpu_state[pos[known]]
+        return states
+
+    def idle_until(self, cpus, ts):
+        '''
+        Ktime each CPU stays idle until after each ktime: ts itself if it is
+        not idle, last_ts if it is still idle at the end of the trace
+        '''
+        pos, arrays = self.lookup(cpus, ts)
+        ts = np.asarray(ts, dtype=np.int64)
+        until = ts.copy()
+        for rows, (cpu_ts, cpu_state, idle_ns) in arrays.values():
+            idle = rows[(pos[rows] >= 0) & (cpu_state[np.maximum(pos[rows], 0)] == IDLE)]
+            # the next change of an idle interval leaves idle
+            next_change = np.append(cpu_ts, max(self.last_ts, ts.max()))
+            until[idle] = np.maximum(next_change[pos[idle] + 1], ts[idle])
+        return until
+
+    def idle_ns_before(self, cpus, ts):
+        pos, arrays = self.lookup(cpus, ts)
+        ts = np.asarray(ts, dtype=np.int64)
+        idle = np.zeros(len(pos), dtype=np.int64)
+        for rows, (cpu_ts, cpu_state, idle_ns) in arrays.values():
+            known = rows[pos[rows] >= 0]
+            at = pos[known]
+            idle[known] = idle_ns[at] + (ts[known] - cpu_ts[at])*(cpu_state[at] == IDLE)
+        return idle
+
+    def idle_time(self, cpus, start, end):
+        '''
+        Nsec each CPU spent idle between each start and end ktime
+        '''
+        cpus = np.asarray(cpus, dtype=np.int64)
+        return np.maximum(self.idle_ns_before(cpus, end) - self.idle_ns_before(cpus, start), 0)
@@ -0,0 +1,309 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Errant wakeup detection used by errant-wakeups.py and
+# errant_wakeup_oddeven.py.
+#
+# struct rq->nr_running is derived from sched_wakeup/sched_switch/
+# sched_migrate_task and power:cpu_idle, or taken as is from
+# sched_update_nr_running when available. Handlers take the event ktime in
+# nsec and common_cpu, followed by the tracepoint fields as keyword arguments.
+#
+# The same events build a CpuTimeline of every CPU. Once the trace is over,
+# it tells how long the idle CPUs an errant wakeup passed over stayed idle,
+# and how much of that idle time was wasted while the woken task waited to be
+# switched in on its busy target CPU.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+from array import array
+import sys
+
+import numpy as np
+
+from cpu_timeline import CpuTimeline
+from event_store import PendingMarks
+
+# default tunables, see errant-wakeups.py
+NR_CPUS = 80
+WAKEUP_SCOPE_SIZE = 8
+LATENCY_THRESHOLD_US = (10**3)*10 # 10ms
+OFFLINE_CPUS = range(40, 80) # CPUs 40-79 are offline
+PENDING_WAKEUP_TTL_US = 0 # e.g. (10**6)*10 to drop wakeups not switched in within 10s, 0 keeps them pending
+WASTED_IDLE_PERCENTILES = [50, 90, 99]
+
+# Confidence flags, used for enumeration
+NO_CONFIDENCE = 0
+DERIVED_CONFIDENCE = 1
+ABSOLUTE_CONFIDENCE = 2
+
+# DECISION flags, used as enumeration
+CORRECT_DECISION_ON_IDLE_CPU = 1
+CORRECT_DECISION_ON_BUSY_CPU = 2
+INCORRECT_DECISION = 3
+
+# tracepoints handled by ErrantWakeupAnalyzer
+EVENTS = ('sched_wakeup', 'sched_switch', 'sched_migrate_task', 'cpu_idle',
+        'sched_update_nr_running', 'sched_process_exit')
+
+class Mark:
+    def __init__(self, sec, nsec, runqlen, errant=False, idle_cpus=()):
+        self.sec = sec
+        self.nsec = nsec
+        self.runqlen = runqlen
+        self.errant = errant
+        # idle CPUs the errant wakeup passed over
+        self.idle_cpus = idle_cpus
+
+
+def sd_mask(cpu, cpumask_size):
+    '''
+    Find domain cpumask for a given cpu
+    @cpu: cpu-id number
+    @cpumask_size: size of the cpumask for specific domain
+
+    For cpumask_size = 4, sd_mask return first and last cpu of small core
+    lly, for size = 8, this returns cpus of big core.
+    '''
+    first_cpu = (cpu//cpumask_size)*cpumask_size
+    return first_cpu,first_cpu+cpumask_size
+
+
+def print_parameters(nr_cpus=NR_CPUS, wakeup_scope_size=WAKEUP_SCOPE_SIZE,
+        offline_cpus=OFFLINE_CPUS, out=sys.stdout):
+    print("Perf-script for finding if wakeups happen on busy CPUs despite?", file=out)
+    print("Script parameters: ", file=out)
+    print("WAKEUP_SCOPE_SIZE : ", wakeup_scope_size, file=out)
+    print("OFFLINE_CPUS : ", offline_cpus, file=out)
+    print("NR_CPUS : ", nr_cpus, file=out)
+    print("===============================================================\n", file=out)
+
+
+class ErrantWakeupAnalyzer:
+    EVENTS = EVENTS
+
+    def __init__(self, nr_cpus=NR_CPUS, wakeup_scope_size=WAKEUP_SCOPE_SIZE,
+            latency_threshold_us=LATENCY_THRESHOLD_US, verbose=False,
+            offline_cpus=OFFLINE_CPUS, odd_even=False,
+            pending_ttl_us=PENDING_WAKEUP_TTL_US, out=sys.stdout):
+        '''
+        @odd_even: only suggest idle CPUs of the same parity as the waker
+        CPU, for sd_llc=4 machines where odd or even threads are offlined.
+        '''
+        self.nr_cpus = nr_cpus
+        self.wakeup_scope_size = wakeup_scope_size
+        self.latency_threshold_us = latency_threshold_us
+        self.verbose = verbose
+        self.offline_cpus = offline_cpus
+        self.odd_even = odd_even
+        self.out = out
+
+        self.runqlen = [0 for i in range(nr_cpus)]
+        self.confidence = [0 for i in range(nr_cpus)]
+        self.correct_decision_on_idle_cpu = 0
+        self.correct_decision_on_busy_cpu = 0
+        self.incorrect_decision = 0
+        self.wakeup_runqlen = dict()
+        # Store information like ktime, nr_running, etc. for each pid
+        self.wakeup_mark = PendingMarks(pending_ttl_us)
+        self.timeline = CpuTimeline()
+        # errant wakeups switched in: wakeup and switch ktimes, and one
+        # (errant_wakeup, idle_cpu) row per idle CPU passed over
+        self.errant_wakeup_ts = array('q')
+        self.errant_switch_ts = array('q')
+        self.errant_wakeup = array('i')
+        self.errant_idle_cpu = array('i')
+
+    def print_runqlen(self, rows, columns):
+        for i in range(rows):
+            print("CPU = "+ str(i*columns) +" --- " + str(columns*(i+1)-1)+": ", end="", file=self.out)
+            for j in range(columns):
+                if (i*columns + j >= self.nr_cpus):
+                    break
+                print(self.runqlen[i*columns + j], end="\t", file=self.out)
+            print(file=self.out)
+
+    def pr(self):
+        self.print_runqlen(20, self.nr_cpus//20+1)
+
+    def is_idle_cpu(self, cpu):
+        return self.runqlen[cpu]
+
+    def report(self, out=None):
+        out = out or self.out
+        print("Final runqlength output", file=out)
+        print("-----------------------", file=out)
+        print("Correct wakeup decision on idle rq = ", self.correct_decision_on_idle_cpu, file=out)
+        print("Correct wakeup decision in busy cpu = ", self.correct_decision_on_busy_cpu, file=out)
+        print("Incorrect wakeup decision =", self.incorrect_decision, file=out)
+        ratio = self.correct_decision_on_idle_cpu + self.correct_decision_on_busy_cpu
+        ratio = (ratio*100)/(self.incorrect_decision+ratio)
+        print("Accuracy = ", ratio, file=out)
+        print("Wakeups of exited tasks = ", self.wakeup_mark.evicted, file=out)
+        print("Orphaned wakeups (not switched in within TTL) = ", self.wakeup_mark.orphaned, file=out)
+        self.report_wasted_idle(out)
+        print("---------------------------------------------------------------\n", file=out)
+        print("Histogram of {nr_running: sample} = ",self.wakeup_runqlen, file=out)
+        self.pr()
+
+    def wasted_idle(self):
+        '''
+        Per errant wakeup switched in: (wakeup ktime, nsec the longest idle
+        of the CPUs passed over stayed idle for, nsec of it wasted before the
+        switch in, the CPU wasting most)
+        '''
+        start = np.frombuffer(self.errant_wakeup_ts, dtype=np.int64)
+        end = np.frombuffer(self.errant_switch_ts, dtype=np.int64)
+        rows = np.frombuffer(self.errant_wakeup, dtype=np.int32)
+        cpus = np.frombuffer(self.errant_idle_cpu, dtype=np.int32)
+        idle_for = np.zeros(len(start), dtype=np.int64)
+        wasted = np.zeros(len(start), dtype=np.int64)
+        best_cpu = np.full(len(start), -1, dtype=np.int64)
+        if len(rows):
+            np.maximum.at(idle_for, rows, self.timeline.idle_until(cpus, start[rows]) - start[rows])
+            cpu_wasted = self.timeline.idle_time(cpus, start[rows], end[rows])
+            np.maximum.at(wasted, rows, cpu_wasted)
+            # rows are in wakeup order, the first CPU wasting the most wins
+            order = np.lexsort((-cpu_wasted, rows))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = rows[order][1:] != rows[order][:-1]
+            best_cpu[rows[order][first]] = cpus[order][first]
+        return start, idle_for, wasted, best_cpu
+
+    def report_wasted_idle(self, out, percentiles=WASTED_IDLE_PERCENTILES):
+        start, idle_for, wasted, best_cpu = self.wasted_idle()
+        print("Errant wakeups switched in = ", len(start), file=out)
+        if not len(start):
+            return
+        if self.verbose:
+            for ts, cpu_wasted, cpu in zip(start.tolist(), wasted.tolist(), best_cpu.tolist()):
+                print("Errant wakeup at ktime=", ts//(10**9), ts%(10**9), "wasted",
+                        cpu_wasted/(10**3), "us of idle cpu=", cpu, file=out)
+        labels = "/".join("%s" % p for p in percentiles)
+        print("Idle time wasted by errant wakeups (in us) = ", round(wasted.sum()/(10**3), 3),
+                " per wakeup", labels + "%ile =",
+                [round(v/(10**3), 3) for v in np.percentile(wasted, percentiles).tolist()], file=out)
+        print("Idle CPUs passed over stayed idle for (in us)", labels + "%ile =",
+                [round(v/(10**3), 3) for v in np.percentile(idle_for, percentiles).tolist()], file=out)
+
+    def sched_migrate_task(self, ts, common_cpu, orig_cpu, dest_cpu, **fields):
+        confidence = self.confidence
+        # If we have nr_running traces of orig_cpu, we must have for
+        # dest_cpu as well.
+        if (confidence[orig_cpu] == ABSOLUTE_CONFIDENCE or confidence[dest_cpu] > ABSOLUTE_CONFIDENCE):
+            return
+
+        self.runqlen[orig_cpu] -= 1
+        self.runqlen[dest_cpu] += 1
+
+        if (confidence[orig_cpu] > NO_CONFIDENCE and self.runqlen[orig_cpu] < 0):
+            print("error with -ve runq at orig_cpu=", orig_cpu,
+                    str(ts//(10**9))+"."+str(ts%(10**9)), file=self.out)
+
+    def sched_switch(self, ts, common_cpu, prev_state, next_pid, **fields):
+        self.wakeup_mark.expire(ts)
+        if next_pid in self.wakeup_mark:
+            mark = self.wakeup_mark.pop(next_pid)
+            if mark.errant:
+                self.errant_wakeup_ts.append(mark.sec*(10**9) + mark.nsec)
+                self.errant_switch_ts.append(ts)
+                for cpu in mark.idle_cpus:
+                    self.errant_wakeup.append(len(self.errant_wakeup_ts) - 1)
+                    self.errant_idle_cpu.append(cpu)
+            tdiff = (ts//(10**9) - mark.sec)*(10**9)
+            tdiff += ts%(10**9) - mark.nsec
+            tdiff /= (10**3) # Convert to usec
+
+            if tdiff > (self.latency_threshold_us):
+                print("Higher latency observed for wakeup at ktime=", mark.sec, mark.nsec, file=self.out)
+                print(file=self.out)
+
+        if self.confidence[common_cpu] == ABSOLUTE_CONFIDENCE:
+            return
+        # TASK_INTERRUPTIBLE = 0x001 => "S"
+        # TASK_UNINTERRUPTIBLE = 0x002 => "D"
+        if (prev_state == 1 or prev_state == 2):
+            self.runqlen[common_cpu] -= 1
+
+    def sched_wakeup(self, ts, common_cpu, comm, pid, target_cpu, common_pid=-1, common_comm="", **fields):
+        common_secs, common_nsecs = ts//(10**9), ts%(10**9)
+        self.wakeup_mark.expire(ts)
+        decision = CORRECT_DECISION_ON_IDLE_CPU
+        confidence = self.confidence
+        runqlen = self.runqlen
+
+        if confidence[target_cpu] < ABSOLUTE_CONFIDENCE:
+            runqlen[target_cpu] += 1
+
+        # Taking sched trace in middle of workload screws the
+        # runqlength count for this script as it won't know the initial
+        # runqlength.
+        if (confidence[target_cpu] > NO_CONFIDENCE):
+            suggestion_str = ""
+            idle_cpus = []
+            if (runqlen[target_cpu] > 1):
+                decision = CORRECT_DECISION_ON_BUSY_CPU
+
+                print(str(common_comm) + " " + str(common_pid) + "\t" +
+                str(common_secs) + "." + str(common_nsecs) +
+                " problematic wakeup at cpu=" + str(common_cpu) +
+                " target_cpu="+str(target_cpu) +
+                " runqlen="+str(runqlen[target_cpu]) +
+                "\tcomm=" + comm + " " + str(pid), file=self.out)
+                if self.verbose:
+                    self.pr()
+
+                first_cpu,last_cpu = sd_mask(common_cpu, self.wakeup_scope_size)
+
+                for i in range(first_cpu, last_cpu):
+                    if i in self.offline_cpus:
+                        continue
+                    if self.odd_even and i%2 != common_cpu%2:
+                        continue
+                    if (self.is_idle_cpu(i)==0):
+                        if (suggestion_str == ""):
+                            suggestion_str = "It could have woken up on idle cpu="
+                        suggestion_str += str(i)+", "
+                        idle_cpus.append(i)
+                        decision = INCORRECT_DECISION
+
+                print(suggestion_str, file=self.out)
+
+            mark = Mark(common_secs, common_nsecs, runqlen[target_cpu], idle_cpus=idle_cpus)
+            if (suggestion_str == ""):
+                mark.errant = False
+            else:
+                mark.errant = True
+            self.wakeup_mark.add(pid, ts, mark)
+
+            if decision == CORRECT_DECISION_ON_IDLE_CPU:
+                self.correct_decision_on_idle_cpu += 1
+            elif decision == CORRECT_DECISION_ON_BUSY_CPU:
+                self.correct_decision_on_busy_cpu += 1
+            else:
+                self.incorrect_decision += 1
+
+    def cpu_idle(self, ts, common_cpu, state, cpu_id, **fields):
+        self.timeline.cpu_idle(ts, cpu_id, state)
+        if self.confidence[cpu_id] == 2:
+            return
+
+        if (state < 100):
+            if (self.confidence[cpu_id]==1 and self.runqlen[cpu_id]>0):
+                print("Runqueue not emptied before this", ts//(10**9), ts%(10**9), cpu_id, file=self.out)
+            self.runqlen[cpu_id] = 0
+            self.confidence[cpu_id] = DERIVED_CONFIDENCE
+
+    def sched_update_nr_running(self, ts, common_cpu, cpu, nr_running, **fields):
+        self.timeline.sched_update_nr_running(ts, cpu, nr_running)
+        self.runqlen[cpu] = nr_running
+        self.confidence[cpu] = ABSOLUTE_CONFIDENCE
+        if nr_running in self.wakeup_runqlen:
+            self.wakeup_runqlen[nr_running] += 1
+        else:
+            self.wakeup_runqlen[nr_running] = 1
+
+    def sched_process_exit(self, ts, common_cpu, pid, **fields):
+        self.wakeup_mark.expire(ts)
+        self.wakeup_mark.evict(pid)
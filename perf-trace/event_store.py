@@ -0,0 +1,236 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Columnar, array-backed store for the sched events marked by the perf-trace
+# scripts.
+#
+# Instead of allocating one object per sched_waking/sched_wakeup event, every
+# marked event is appended as one row to a set of preallocated NumPy columns
+# which grow geometrically when full. Latency metrics are then computed in
+# vectorized passes over the whole store at trace_end.
+#
+# PendingMarks keeps the pending wakeup mark of each pid, and bounds it by
+# evicting the marks of exiting tasks and expiring marks older than a TTL.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from collections import OrderedDict
+
+import numpy as np
+
+# type-of event marked
+WAKEUP = 1
+WAKING = 2
+SWITCH = 3
+MIGRATE = 4
+NR_RUNNING = 5
+DROPPED = 6 # pending mark evicted/expired, pairs with nothing
+
+# name, dtype of each column
+COLUMNS = (
+    ('ts', np.int64),           # ktime in nsec
+    ('cpu', np.int32),          # common_cpu of the event
+    ('pid', np.int32),
+    ('event_type', np.int8),
+    ('waker_cpu', np.int32),
+    ('prev_cpu', np.int32),
+    ('target_cpu', np.int32),
+)
+
+def ktime_ns(sec, nsec):
+    return sec*(10**9) + nsec
+
+class EventStore:
+    def __init__(self, capacity=1<<16):
+        self.size = 0
+        self.capacity = capacity
+        for name, dtype in COLUMNS:
+            setattr(self, '_' + name, np.empty(capacity, dtype=dtype))
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self):
+        self.capacity *= 2
+        for name, dtype in COLUMNS:
+            old = getattr(self, '_' + name)
+            new = np.empty(self.capacity, dtype=dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, '_' + name, new)
+
+    def append(self, ts, cpu, pid, event_type, waker_cpu=-1, prev_cpu=-1, target_cpu=-1):
+        '''
+        Append one event and return its row index
+        '''
+        if self.size == self.capacity:
+            self._grow()
+        row = self.size
+        self._ts[row] = ts
+        self._cpu[row] = cpu
+        self._pid[row] = pid
+        self._event_type[row] = event_type
+        self._waker_cpu[row] = waker_cpu
+        self._prev_cpu[row] = prev_cpu
+        self._target_cpu[row] = target_cpu
+        self.size += 1
+        return row
+
+    def get(self, name, row):
+        return int(getattr(self, '_' + name)[row])
+
+    def column(self, name):
+        '''
+        View (not a copy) of the filled part of a column
+        '''
+        return getattr(self, '_' + name)[:self.size]
+
+    def previous_mark(self):
+        '''
+        For every row, find the row of the previous WAKING/WAKEUP/SWITCH event
+        of the same pid, or -1 if there is none.
+
+        MIGRATE events do not change the pending mark of a pid, so they are
+        skipped while searching but still get their previous mark assigned.
+
+        Returns (order, prev) where order sorts the rows by (pid, time) and
+        prev[i] is the position in that order of the previous mark of order[i].
+        '''
+        n = self.size
+        pid = self.column('pid')
+        # rows are appended in time order, so a stable sort keeps time order
+        # within each pid
+        order = np.argsort(pid, kind='stable')
+        pid = pid[order]
+        event_type = self.column('event_type')[order]
+
+        idx = np.arange(n)
+        last_mark = np.where(event_type != MIGRATE, idx, -1)
+        np.maximum.accumulate(last_mark, out=last_mark)
+
+        prev = np.empty(n, dtype=np.int64)
+        if n == 0:
+            return order, prev
+        # A mark event looks at the mark before itself, a MIGRATE event at
+        # the latest mark including its own position.
+        prev[0] = -1
+        prev[1:] = last_mark[:-1]
+        is_migrate = event_type == MIGRATE
+        prev[is_migrate] = last_mark[is_migrate]
+
+        valid = prev >= 0
+        valid[valid] = pid[prev[valid]] == pid[valid]
+        prev[~valid] = -1
+        return order, prev
+
+    def latency_series(self, from_type, to_type):
+        '''
+        Returns (ts, latency): ktime of every to_type event and its time (in
+        us) since the pending from_type mark of the same pid, in the order
+        the to_type events were appended.
+        '''
+        order, prev = self.previous_mark()
+        event_type = self.column('event_type')[order]
+        ts = self.column('ts')[order]
+
+        hit = (event_type == to_type) & (prev >= 0)
+        hit[hit] = event_type[prev[hit]] == from_type
+        latency = (ts[hit] - ts[prev[hit]]) / (10**3)
+        appended = np.argsort(order[hit], kind='stable')
+        return ts[hit][appended], latency[appended]
+
+    def latency(self, from_type, to_type):
+        '''
+        Time (in us) between every to_type event and the pending from_type
+        mark of the same pid, in the order the to_type events were appended.
+        '''
+        return self.latency_series(from_type, to_type)[1]
+
+    def scheduler_decision_latency(self):
+        return self.latency(WAKING, WAKEUP)
+
+    def sched_latency(self):
+        return self.latency(WAKEUP, SWITCH)
+
+    def pre_migration_wait_time(self):
+        return self.latency(WAKEUP, MIGRATE)
+
+    def latency_samples(self):
+        '''
+        latency_series() of the scheduler decision latency, scheduling latency
+        and pre-migration wait time
+        '''
+        return [self.latency_series(WAKING, WAKEUP), self.latency_series(WAKEUP, SWITCH),
+                self.latency_series(WAKEUP, MIGRATE)]
+
+
+class PendingMarks:
+    '''
+    Pending wakeup mark of each pid, oldest first.
+
+    A mark is removed when its task gets switched in (pop), when the task
+    exits (evict), or once it is older than ttl_us (expire), e.g. when the
+    sched_switch was lost. evicted and orphaned count the marks removed by
+    the latter two. ttl_us = 0 keeps marks until they are popped or evicted.
+    '''
+    def __init__(self, ttl_us=0):
+        self.ttl = ttl_us*(10**3)
+        self.marks = OrderedDict() # pid: (ts, mark)
+        self.evicted = 0
+        self.orphaned = 0
+
+    def __len__(self):
+        return len(self.marks)
+
+    def __contains__(self, pid):
+        return pid in self.marks
+
+    def get(self, pid):
+        if pid in self.marks:
+            return self.marks[pid][1]
+        return None
+
+    def items(self):
+        '''
+        (pid, ts, mark) of every pending mark, oldest first
+        '''
+        return [(pid, ts, mark) for pid, (ts, mark) in self.marks.items()]
+
+    def add(self, pid, ts, mark):
+        '''
+        Set the mark of pid, at ktime ts which must not be older than the
+        previously added marks
+        '''
+        self.marks.pop(pid, None)
+        self.marks[pid] = (ts, mark)
+
+    def pop(self, pid):
+        return self.marks.pop(pid)[1]
+
+    def clear(self):
+        self.marks.clear()
+
+    def evict(self, pid):
+        '''
+        Returns True if pid had a mark
+        '''
+        if pid in self.marks:
+            del(self.marks[pid])
+            self.evicted += 1
+            return True
+        return False
+
+    def expire(self, ts):
+        '''
+        Drop the marks older than ttl at ktime ts, returns their pids
+        '''
+        expired = []
+        if not self.ttl:
+            return expired
+        marks = self.marks
+        while marks:
+            pid, (mark_ts, mark) = next(iter(marks.items()))
+            if ts - mark_ts <= self.ttl:
+                break
+            marks.popitem(last=False)
+            expired.append(pid)
+        self.orphaned += len(expired)
+        return expired
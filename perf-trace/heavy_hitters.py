@@ -0,0 +1,241 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Attribution of tail scheduling latency (sched_wakeup to sched_switch) to
+# the comms and pids suffering it, in fixed memory.
+#
+# Every latency sample is added to a SpaceSaving summary per comm and per
+# pid, weighted by its excess (in nsec) over the latency threshold, so that
+# a few long stalls outrank many short waits. Each tracked key carries a
+# small LatencySketch of its samples.
+#
+# Up to `capacity` keys every key is tracked from its first sample, and the
+# summary is exact: summaries of trace shards then merge into the same
+# tables as a sequential run. Past that, SpaceSaving takes over: a tail
+# sample of an untracked key takes over the key with the smallest weight and
+# inherits that weight as its error bound, so every key whose true excess
+# exceeds total/capacity is guaranteed to be tracked and the ranking of the
+# heaviest keys is exact up to the reported error. The tables then say they
+# are approximate, and flag rows whose error is larger than their guaranteed
+# weight (weight - error).
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import heapq
+import sys
+
+from event_store import PendingMarks
+from latency_analysis import LATENCY_PERCENTILES, LATENCY_THRESHOLD_US, PENDING_WAKEUP_TTL_US
+from latency_sketch import LatencySketch
+
+# default tunables
+TOP_K = 10 # rows of the ranked tables
+CAPACITY_FACTOR = 10 # keys tracked per reported row
+KEY_RELATIVE_ERROR = 0.05 # error bound of the per key percentiles
+
+# tracepoints handled by AttributionAnalyzer
+EVENTS = ('sched_waking', 'sched_wakeup', 'sched_switch', 'sched_process_exit')
+
+def heaviest(item):
+    '''
+    Sort key of (key, [weight, error, sketch]) items, ties broken by key so
+    that merged summaries rank like sequential ones
+    '''
+    return -item[1][0], item[0]
+
+
+class SpaceSaving:
+    def __init__(self, capacity, relative_error=KEY_RELATIVE_ERROR):
+        self.capacity = capacity
+        self.relative_error = relative_error
+        self.entries = dict() # key: [weight, error, sketch]
+        # (weight, key) of every update, entries whose weight moved on are
+        # skipped when looking for the minimum
+        self.heap = []
+        self.total = 0
+        # False once a key was evicted or a sample of an untracked key dropped
+        self.exact = True
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _push(self, key, weight):
+        heapq.heappush(self.heap, (weight, key))
+        if len(self.heap) > 4*self.capacity:
+            self.heap = [(entry[0], k) for k, entry in self.entries.items()]
+            heapq.heapify(self.heap)
+
+    def _pop_min(self):
+        while True:
+            weight, key = heapq.heappop(self.heap)
+            if key in self.entries and self.entries[key][0] == weight:
+                return key
+
+    def min_weight(self):
+        '''
+        Upper bound of the weight of an untracked key
+        '''
+        if self.exact or len(self.entries) < self.capacity:
+            return 0
+        while True:
+            weight, key = self.heap[0]
+            if key in self.entries and self.entries[key][0] == weight:
+                return weight
+            heapq.heappop(self.heap)
+
+    def add(self, key, weight, latency):
+        '''
+        Add a latency sample of key with weight. Once capacity keys are
+        tracked, a new key is only tracked for a positive weight
+        '''
+        self.total += weight
+        entry = self.entries.get(key)
+        if entry is None:
+            if len(self.entries) < self.capacity:
+                entry = [0, 0, LatencySketch(relative_error=self.relative_error)]
+            elif weight <= 0:
+                self.exact = False
+                return
+            else:
+                self.exact = False
+                victim = self._pop_min()
+                entry = self.entries.pop(victim)
+                entry[1] = entry[0]
+                # reuse the sketch of the evicted key
+                entry[2].clear()
+            self.entries[key] = entry
+        entry[0] += weight
+        entry[2].record(latency)
+        self._push(key, entry[0])
+
+    def merge(self, other):
+        '''
+        Keys missing from one summary get its minimum weight added to their
+        error, as they may have been evicted there
+        '''
+        self_min, other_min = self.min_weight(), other.min_weight()
+        entries = dict()
+        for key, (weight, error, sketch) in self.entries.items():
+            if key in other.entries:
+                other_weight, other_error, other_sketch = other.entries[key]
+                entries[key] = [weight + other_weight, error + other_error, sketch.merge(other_sketch)]
+            else:
+                entries[key] = [weight + other_min, error + other_min, sketch]
+        for key, (weight, error, sketch) in other.entries.items():
+            if key not in entries:
+                entries[key] = [weight + self_min, error + self_min, sketch]
+        self.exact = self.exact and other.exact and len(entries) <= self.capacity
+        self.entries = dict(sorted(entries.items(), key=heaviest)[:self.capacity])
+        self.heap = [(entry[0], k) for k, entry in self.entries.items()]
+        heapq.heapify(self.heap)
+        self.total += other.total
+        return self
+
+    def top(self, n):
+        '''
+        [(key, weight, error, sketch)] of the n heaviest keys
+        '''
+        top = sorted(self.entries.items(), key=heaviest)[:n]
+        return [(key, weight, error, sketch) for key, (weight, error, sketch) in top]
+
+
+def print_top(summary, title, top_k, percentiles, out=sys.stdout):
+    '''
+    Print the top_k heaviest keys of summary, weighted by their excess in nsec
+    '''
+    print(('------------------%s' % title).ljust(76, '-'), file=out)
+    if not summary.exact:
+        print("approximate: more than %d keys, excess is an upper bound within +/-, samples and "
+                "percentiles cover each key since it was last admitted" % summary.capacity, file=out)
+    print("%-24s %14s %12s %9s" % ("key", "excess", "+/-", "samples") +
+            "".join(" %12s" % ("%s%%ile" % p) for p in percentiles) + " %12s" % "max", file=out)
+    top = summary.top(top_k)
+    unreliable = 0
+    for key, weight, error, sketch in top:
+        # rows mostly made of the weight inherited at admission
+        flag = ""
+        if error > weight - error:
+            flag = " *"
+            unreliable += 1
+        print("%-24s %14.3f %12.3f %9d" % (key, weight/(10**3), error/(10**3), len(sketch)) +
+                "".join(" %12.3f" % value for value in sketch.percentiles(percentiles)) +
+                " %12.3f" % sketch.max + flag, file=out)
+    if unreliable:
+        print("* error over the guaranteed excess, may not be in the top %d" % top_k, file=out)
+    if summary.total:
+        print("Top %d share of total excess%s = %.2f %%" % (top_k,
+                "" if summary.exact else " (upper bound)",
+                100*sum(weight for key, weight, error, sketch in top)/summary.total), file=out)
+    else:
+        print("No latency over the threshold", file=out)
+
+
+class LatencyAttribution:
+    '''
+    Ranked tables of the comms and pids with the highest total scheduling
+    latency over latency_threshold_us (in us)
+    '''
+    def __init__(self, top_k=TOP_K, capacity=None, latency_threshold_us=LATENCY_THRESHOLD_US):
+        capacity = capacity or top_k*CAPACITY_FACTOR
+        self.top_k = top_k
+        self.latency_threshold_us = latency_threshold_us
+        self.by_comm = SpaceSaving(capacity)
+        self.by_pid = SpaceSaving(capacity)
+
+    def record(self, comm, pid, latency):
+        # in integer nsec, so that sums don't depend on the order of samples
+        excess = max(int(round(latency*(10**3))) - self.latency_threshold_us*(10**3), 0)
+        self.by_comm.add(comm, excess, latency)
+        self.by_pid.add("%s/%d" % (comm, pid), excess, latency)
+
+    def merge(self, other):
+        self.by_comm.merge(other.by_comm)
+        self.by_pid.merge(other.by_pid)
+        return self
+
+    def report(self, percentiles=LATENCY_PERCENTILES, out=sys.stdout):
+        print_top(self.by_comm, "Top scheduling latency over %d us by comm (in us)" %
+                self.latency_threshold_us, self.top_k, percentiles, out)
+        print_top(self.by_pid, "Top scheduling latency over %d us by comm/pid (in us)" %
+                self.latency_threshold_us, self.top_k, percentiles, out)
+
+
+class AttributionAnalyzer:
+    '''
+    LatencyAttribution of a trace, pairing sched_wakeup and sched_switch on
+    its own
+    '''
+    EVENTS = EVENTS
+
+    def __init__(self, top_k=TOP_K, latency_percentiles=LATENCY_PERCENTILES,
+            latency_threshold_us=LATENCY_THRESHOLD_US, pending_ttl_us=PENDING_WAKEUP_TTL_US,
+            out=sys.stdout):
+        self.latency_percentiles = latency_percentiles
+        self.out = out
+        # ktime of the pending sched_wakeup of each pid, None for a pending
+        # sched_waking
+        self.wakeup_ts = PendingMarks(pending_ttl_us)
+        self.attribution = LatencyAttribution(top_k, latency_threshold_us=latency_threshold_us)
+
+    def sched_waking(self, ts, common_cpu, pid, **fields):
+        self.wakeup_ts.expire(ts)
+        self.wakeup_ts.add(pid, ts, None)
+
+    def sched_wakeup(self, ts, common_cpu, pid, **fields):
+        self.wakeup_ts.expire(ts)
+        self.wakeup_ts.add(pid, ts, ts)
+
+    def sched_switch(self, ts, common_cpu, next_pid, next_comm, **fields):
+        self.wakeup_ts.expire(ts)
+        if next_pid in self.wakeup_ts:
+            wakeup_ts = self.wakeup_ts.pop(next_pid)
+            if wakeup_ts is not None:
+                self.attribution.record(next_comm, next_pid, (ts - wakeup_ts)/(10**3))
+
+    def sched_process_exit(self, ts, common_cpu, pid, **fields):
+        self.wakeup_ts.expire(ts)
+        self.wakeup_ts.evict(pid)
+
+    def report(self, out=None):
+        self.attribution.report(self.latency_percentiles, out or self.out)
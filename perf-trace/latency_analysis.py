@@ -0,0 +1,265 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Scheduler decision latency, scheduling latency and pre-migration wait time
+# of woken up tasks.
+#
+# sched_waking/sched_wakeup leave a pending mark for the woken pid, which is
+# consumed by the sched_switch to that pid. Marks and the switches/migrations
+# consuming them are kept in an EventStore and turned into latencies by
+# vectorized passes in finish(). Handlers take the event ktime in nsec and
+# common_cpu, followed by the tracepoint fields as keyword arguments.
+#
+# Memory stays bounded on long captures: pending marks of exiting tasks are
+# evicted on sched_process_exit, with pending_ttl_us set (off by default)
+# marks older than it are dropped as orphans, and every STORE_FLUSH_ROWS new
+# rows the event store is folded into the summary and restarted from the
+# pending marks.
+#
+# With window_us set, the latencies are also reported as a time series over
+# sliding windows, see latency_windows.py.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import sys
+
+from event_store import EventStore, PendingMarks, WAKEUP, WAKING, SWITCH, MIGRATE, DROPPED
+from latency_sketch import LatencySketch
+import latency_windows
+
+# default tunables
+LATENCY_THRESHOLD_US = (10**3)*10 # 10ms
+VERBOSE_LEVEL = 1 # 0-No extra info, 1-high latency wakeups
+LATENCY_PERCENTILES = [50, 90, 99, 99.99]
+LATENCY_RELATIVE_ERROR = 0.01 # error bound of the reported latency percentiles
+PENDING_WAKEUP_TTL_US = 0 # e.g. (10**6)*10 to drop wakeups not switched in within 10s, 0 keeps them pending
+WINDOW_US = latency_windows.WINDOW_US # 0 disables the windowed series
+WINDOW_STEP_US = latency_windows.WINDOW_STEP_US
+EXTENDED_REPORT = False # also print min/max/mean of every latency
+
+# New rows of the event store folded into the summary at once
+STORE_FLUSH_ROWS = 1<<20
+
+# Below this many migrations, the raw wait times are printed
+FEW_MIGRATIONS = 10
+
+# tracepoints handled by LatencyAnalyzer
+EVENTS = ('sched_waking', 'sched_wakeup', 'sched_switch', 'sched_migrate_task',
+        'sched_process_exit')
+
+def print_latency_hist(sketch, percentiles, out=sys.stdout, extended=EXTENDED_REPORT):
+    if sketch.count == 0:
+        print("No samples", file=out)
+        return
+    for p, value in zip(percentiles, sketch.percentiles(percentiles)):
+        label = '%s%%ile:' % p
+        print(label + '\t'*(2 - len(label)//8), round(value, 3), file=out)
+    if extended:
+        print('min/max/mean:\t', round(sketch.min, 3), round(sketch.max, 3), round(sketch.mean(), 3), file=out)
+
+
+class LatencySummary:
+    '''
+    Mergeable end-of-trace results of a LatencyAnalyzer
+    '''
+    def __init__(self, latency_relative_error=LATENCY_RELATIVE_ERROR, window_us=0,
+            window_step_us=WINDOW_STEP_US):
+        self.scheduler_decision_latency = LatencySketch(relative_error=latency_relative_error)
+        self.sched_latency = LatencySketch(relative_error=latency_relative_error)
+        self.pre_migration_wait_time = LatencySketch(relative_error=latency_relative_error)
+        # raw pre-migration wait times, only kept while there are few of them
+        self.few_migrations = []
+        # pending wakeups dropped on task exit / after pending_ttl_us
+        self.evicted_wakeups = 0
+        self.orphaned_wakeups = 0
+        # latencies over sliding windows, None if window_us = 0
+        self.series = latency_windows.LatencySeries(window_us, window_step_us) if window_us else None
+
+    def merge(self, other):
+        self.scheduler_decision_latency.merge(other.scheduler_decision_latency)
+        self.sched_latency.merge(other.sched_latency)
+        self.pre_migration_wait_time.merge(other.pre_migration_wait_time)
+        if len(self.pre_migration_wait_time) < FEW_MIGRATIONS:
+            self.few_migrations += other.few_migrations
+        else:
+            self.few_migrations = []
+        self.evicted_wakeups += other.evicted_wakeups
+        self.orphaned_wakeups += other.orphaned_wakeups
+        if self.series is not None and other.series is not None:
+            self.series.merge(other.series)
+        return self
+
+    def report_decision_latency(self, percentiles=LATENCY_PERCENTILES, out=sys.stdout,
+            extended=EXTENDED_REPORT):
+        print('------------------Scheduler decision latency(in us)-------------------------', file=out)
+        print_latency_hist(self.scheduler_decision_latency, percentiles, out, extended)
+
+    def report_sched_latency(self, percentiles=LATENCY_PERCENTILES, out=sys.stdout,
+            extended=EXTENDED_REPORT):
+        print('------------------Scheduling Latency (in us)--------------------------------', file=out)
+        print_latency_hist(self.sched_latency, percentiles, out, extended)
+
+    def report_pre_migration_wait_time(self, percentiles=LATENCY_PERCENTILES, out=sys.stdout,
+            extended=EXTENDED_REPORT):
+        print('------------------Pre-migration wait time (in us)---------------------------', file=out)
+        if (len(self.pre_migration_wait_time) < FEW_MIGRATIONS):
+            print("Very few migrations occured. Wait time = ", self.few_migrations, file=out)
+        else:
+            print_latency_hist(self.pre_migration_wait_time, percentiles, out, extended)
+
+    def report_dropped_wakeups(self, out=sys.stdout):
+        print('------------------Dropped pending wakeups----------------------------------', file=out)
+        print("Wakeups of exited tasks = ", self.evicted_wakeups, file=out)
+        print("Orphaned wakeups (not switched in within TTL) = ", self.orphaned_wakeups, file=out)
+
+    def report_series(self, out=sys.stdout):
+        if self.series is not None:
+            self.series.report(out)
+
+    def report(self, percentiles=LATENCY_PERCENTILES, out=sys.stdout, extended=EXTENDED_REPORT):
+        self.report_decision_latency(percentiles, out, extended)
+        self.report_sched_latency(percentiles, out, extended)
+        self.report_pre_migration_wait_time(percentiles, out, extended)
+        self.report_dropped_wakeups(out)
+        self.report_series(out)
+
+
+class LatencyAnalyzer:
+    EVENTS = EVENTS
+
+    def __init__(self, latency_threshold_us=LATENCY_THRESHOLD_US, verbose_level=VERBOSE_LEVEL,
+            latency_percentiles=LATENCY_PERCENTILES, latency_relative_error=LATENCY_RELATIVE_ERROR,
+            pending_ttl_us=PENDING_WAKEUP_TTL_US, window_us=WINDOW_US,
+            window_step_us=WINDOW_STEP_US, extended_report=EXTENDED_REPORT, out=sys.stdout):
+        self.latency_threshold_us = latency_threshold_us
+        self.verbose_level = verbose_level
+        self.latency_percentiles = latency_percentiles
+        self.latency_relative_error = latency_relative_error
+        self.extended_report = extended_report
+        self.out = out
+
+        # Columnar store of the marked events not yet folded into summary
+        self.event_store = EventStore()
+        # Row of the pending event_store mark for each pid
+        self.pid_timehist = PendingMarks(pending_ttl_us)
+        self.summary = LatencySummary(latency_relative_error, window_us, window_step_us)
+
+    def get_state(self):
+        '''
+        Pending wakeup marks, as pid: (ts, event_type, cpu, waker_cpu,
+        prev_cpu, target_cpu)
+        '''
+        store = self.event_store
+        pending = dict()
+        for pid, ts, row in self.pid_timehist.items():
+            pending[pid] = (store.get('ts', row), store.get('event_type', row),
+                    store.get('cpu', row), store.get('waker_cpu', row),
+                    store.get('prev_cpu', row), store.get('target_cpu', row))
+        return pending
+
+    def set_state(self, pending):
+        for pid, mark in sorted(pending.items(), key=lambda item: item[1][0]):
+            ts, event_type, cpu, waker_cpu, prev_cpu, target_cpu = mark
+            self.pid_timehist.add(pid, ts, self.event_store.append(ts, cpu, pid, event_type,
+                    waker_cpu=waker_cpu, prev_cpu=prev_cpu, target_cpu=target_cpu))
+
+    def begin_event(self, ts):
+        '''
+        Expire stale pending marks and fold a full event store, before
+        handling an event at ktime ts
+        '''
+        for pid in self.pid_timehist.expire(ts):
+            # so that a later event of pid doesn't pair with the dropped mark
+            self.event_store.append(ts, -1, pid, DROPPED)
+        if len(self.event_store) >= STORE_FLUSH_ROWS + len(self.pid_timehist):
+            self.flush()
+
+    def flush(self):
+        '''
+        Fold the latency series of the event store into the summary and
+        restart the store from the pending marks
+        '''
+        samples = self.event_store.latency_samples()
+        decision_latency, sched_latency, pre_migration_wait_time = [latency for ts, latency in samples]
+        summary = LatencySummary(self.latency_relative_error)
+        summary.scheduler_decision_latency.record_many(decision_latency)
+        summary.sched_latency.record_many(sched_latency)
+        summary.pre_migration_wait_time.record_many(pre_migration_wait_time)
+        if len(pre_migration_wait_time) < FEW_MIGRATIONS:
+            summary.few_migrations = pre_migration_wait_time.tolist()
+        self.summary.merge(summary)
+        if self.summary.series is not None:
+            self.summary.series.record_many(samples)
+
+        pending = self.get_state()
+        self.event_store = EventStore()
+        self.pid_timehist.clear()
+        self.set_state(pending)
+
+    def sched_migrate_task(self, ts, common_cpu, pid, orig_cpu, dest_cpu, **fields):
+        self.begin_event(ts)
+        # pre-migration wait time is computed from these at the end
+        if pid in self.pid_timehist:
+            self.event_store.append(ts, common_cpu, pid, MIGRATE, prev_cpu=orig_cpu, target_cpu=dest_cpu)
+
+    def sched_switch(self, ts, common_cpu, next_pid, **fields):
+        '''
+        Returns the scheduling latency (in us) of next_pid, None if it had
+        no pending sched_wakeup
+        '''
+        self.begin_event(ts)
+        latency = None
+        if next_pid in self.pid_timehist:
+            store = self.event_store
+            row = self.pid_timehist.pop(next_pid)
+            if store.get('event_type', row) == WAKEUP:
+                wakeup_ts = store.get('ts', row)
+                latency = (ts - wakeup_ts)/(10**3)
+                if self.verbose_level >= 1 and latency > (self.latency_threshold_us):
+                    print("Higher latency observed for wakeup at ktime=", wakeup_ts//(10**9), wakeup_ts%(10**9), file=self.out)
+                    print(file=self.out)
+
+            # scheduling latency is computed from these at the end
+            self.event_store.append(ts, common_cpu, next_pid, SWITCH)
+        return latency
+
+    def sched_waking(self, ts, common_cpu, pid, target_cpu, **fields):
+        self.begin_event(ts)
+        # target_cpu is treated as prev_cpu
+        row = self.event_store.append(ts, common_cpu, pid, WAKING, prev_cpu=target_cpu, waker_cpu=common_cpu)
+        self.pid_timehist.add(pid, ts, row)
+
+    def sched_wakeup(self, ts, common_cpu, pid, target_cpu, **fields):
+        '''
+        Returns (waker_cpu, prev_cpu) from the sched_waking of pid, -1 if unknown
+        '''
+        self.begin_event(ts)
+
+        # Track pid which gets consumed in sched_switch
+        prev_cpu = -1
+        waker_cpu = -1
+        store = self.event_store
+        waking_row = self.pid_timehist.get(pid)
+        if waking_row is not None and store.get('event_type', waking_row)==WAKING:
+            prev_cpu = store.get('prev_cpu', waking_row)
+            waker_cpu = store.get('waker_cpu', waking_row)
+
+        # scheduler decision latency is computed from these at the end
+        self.pid_timehist.add(pid, ts, store.append(ts, common_cpu, pid, WAKEUP,
+                prev_cpu=prev_cpu, waker_cpu=waker_cpu, target_cpu=target_cpu))
+        return waker_cpu, prev_cpu
+
+    def sched_process_exit(self, ts, common_cpu, pid, **fields):
+        self.begin_event(ts)
+        if self.pid_timehist.evict(pid):
+            self.event_store.append(ts, common_cpu, pid, DROPPED)
+
+    def finish(self):
+        self.flush()
+        self.summary.evicted_wakeups = self.pid_timehist.evicted
+        self.summary.orphaned_wakeups = self.pid_timehist.orphaned
+        return self.summary
+
+    def report(self, out=None):
+        self.finish().report(self.latency_percentiles, out or self.out, self.extended_report)
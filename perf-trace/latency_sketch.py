@@ -0,0 +1,117 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Bounded-memory, mergeable latency quantile sketch.
+#
+# Values are quantized to multiples of `resolution` and counted in HDR-style
+# log-linear buckets: every power-of-two range is split into 2^(bits-1) linear
+# sub-buckets, so any reported value is within `relative_error` of the exact
+# sample. The counts array is sized once from `highest` and never grows,
+# recording is O(1) per sample and two sketches with the same parameters can
+# be merged by adding their counts.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+import math
+
+import numpy as np
+
+DEFAULT_PERCENTILES = (50, 90, 99, 99.99)
+
+class LatencySketch:
+    def __init__(self, relative_error=0.01, resolution=0.001, highest=3600*(10**6)):
+        '''
+        @relative_error: upper bound on the relative error of reported values
+        @resolution: smallest distinguishable value (default 1ns for usec samples)
+        @highest: largest trackable value, bigger samples land in the last bucket
+        '''
+        self.relative_error = relative_error
+        self.resolution = resolution
+        self.highest = highest
+        self.bits = max(1, int(math.ceil(math.log(1.0/relative_error, 2)))) + 1
+        self.half = 1 << (self.bits - 1)
+        self.counts = np.zeros(self._index(int(highest/resolution)) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def _index(self, v):
+        e = max(v.bit_length() - self.bits, 0)
+        return e*self.half + (v >> e)
+
+    def _bucket_value(self, idx):
+        '''
+        Midpoint of the value range counted by bucket idx
+        '''
+        e = max(idx//self.half - 1, 0)
+        lo = (idx - e*self.half) << e
+        return (lo + ((1 << e) - 1)/2.0)*self.resolution
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.counts[:] = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def record(self, value):
+        v = int(value/self.resolution)
+        idx = self._index(v) if v > 0 else 0
+        self.counts[min(idx, len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def record_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        v = np.maximum(values/self.resolution, 0).astype(np.int64)
+        # frexp exponent of an integer is its bit_length
+        e = np.maximum(np.frexp(v.astype(np.float64))[1] - self.bits, 0)
+        idx = np.minimum(e*self.half + (v >> e), len(self.counts) - 1)
+        self.counts += np.bincount(idx, minlength=len(self.counts))
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        if (other.bits, other.resolution, len(other.counts)) != \
+                (self.bits, self.resolution, len(self.counts)):
+            raise ValueError("Cannot merge sketches with different parameters")
+        self.counts += other.counts
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def mean(self):
+        '''
+        Mean of the samples, nan without samples
+        '''
+        return self.total/self.count if self.count else float('nan')
+
+    def percentile(self, percentile):
+        '''
+        Value of the sample at rank ceil(count*percentile/100)
+        '''
+        return self.percentiles([percentile])[0]
+
+    def percentiles(self, percentiles):
+        if self.count == 0:
+            raise ValueError("No samples recorded")
+        cumulative = np.cumsum(self.counts)
+        ret = []
+        for p in percentiles:
+            rank = max(int(math.ceil((self.count * p) / 100)), 1)
+            idx = int(np.searchsorted(cumulative, rank))
+            ret.append(min(max(self._bucket_value(idx), self.min), self.max))
+        return ret
@@ -0,0 +1,204 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Time series of the scheduler decision latency, scheduling latency and
+# pre-migration wait time over sliding windows of a trace.
+#
+# Latency samples are counted, by the ktime of the event completing them, in
+# slots of step_us. A ring buffer holds LatencySketches of the last
+# window_us/step_us slots, and whenever a slot is complete the percentiles of
+# the window ending with it are computed by merging the ring. Windows whose
+# 99%ile is SPIKE_FACTOR times the median window 99%ile are flagged as spikes.
+#
+# Slots are aligned to ktime 0, so the series of consecutive shards of a
+# trace merge into the series of the whole trace: besides the ring, the first
+# window of slots is kept for the windows straddling the previous shard.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import sys
+
+import numpy as np
+
+from latency_sketch import LatencySketch
+
+# default tunables
+WINDOW_US = 0 # 0 disables the series
+WINDOW_STEP_US = (10**3)*100 # 100ms
+WINDOW_PERCENTILES = [50, 99, 99.99]
+WINDOW_RELATIVE_ERROR = 0.05 # error bound of the per window percentiles
+SPIKE_FACTOR = 4 # spike: window 99%ile above SPIKE_FACTOR x median window 99%ile
+SPIKE_MIN_US = 100 # and above this
+
+METRICS = ('Scheduler decision latency', 'Scheduling latency', 'Pre-migration wait time')
+
+class LatencySeries:
+    def __init__(self, window_us, step_us=WINDOW_STEP_US, relative_error=WINDOW_RELATIVE_ERROR):
+        if step_us <= 0 or window_us < step_us:
+            raise ValueError("Window of %d us needs a step between 1 and %d us" % (window_us, window_us))
+        self.window_us = window_us
+        self.step_us = step_us
+        self.step = int(step_us*(10**3))
+        self.nr_slots = -(-window_us//step_us)
+        self.relative_error = relative_error
+        # slots holding samples are first..last, last being still filled
+        self.first = None
+        self.last = None
+        # sketches of slot k, per METRICS, at ring[k % nr_slots]
+        self.ring = [None]*self.nr_slots
+        self.ring_slot = [None]*self.nr_slots
+        # sketches of the slots first..first+nr_slots-1 evicted from the ring
+        self.head = dict()
+        # window ending with slot k: [(count, percentiles) or None, per METRICS]
+        self.rows = dict()
+
+    def new_slot(self):
+        return [LatencySketch(relative_error=self.relative_error) for metric in METRICS]
+
+    def slot(self, k):
+        pos = k % self.nr_slots
+        if self.ring_slot[pos] == k:
+            return self.ring[pos]
+        return self.head.get(k)
+
+    def window(self, k, slot):
+        '''
+        Row of the window ending with slot k, None if it has no samples
+        '''
+        sketches = self.new_slot()
+        for j in range(k - self.nr_slots + 1, k + 1):
+            sketch = slot(j)
+            if sketch is not None:
+                for merged, other in zip(sketches, sketch):
+                    merged.merge(other)
+        if not any(len(sketch) for sketch in sketches):
+            return None
+        return [(len(sketch), sketch.percentiles(WINDOW_PERCENTILES)) if len(sketch) else None
+                for sketch in sketches]
+
+    def add_rows(self, windows, slot, rows):
+        for k in windows:
+            row = self.window(k, slot)
+            if row is not None:
+                rows[k] = row
+
+    def advance(self, k):
+        '''
+        Complete the slots before k and start filling slot k
+        '''
+        if self.first is None:
+            self.first, self.last = k, k - 1
+        if k <= self.last and self.ring_slot[k % self.nr_slots] == k:
+            return
+        # windows of the previous shard may still add to the first window
+        self.add_rows(range(max(self.last, self.first + self.nr_slots),
+                min(k, self.last + self.nr_slots)), self.slot, self.rows)
+        for j in range(max(self.last + 1, k - self.nr_slots + 1), k + 1):
+            pos = j % self.nr_slots
+            old = self.ring_slot[pos]
+            if self.ring[pos] is None or (old is not None and old < self.first + self.nr_slots):
+                if old is not None:
+                    self.head[old] = self.ring[pos]
+                self.ring[pos] = self.new_slot()
+            else:
+                for sketch in self.ring[pos]:
+                    sketch.clear()
+            self.ring_slot[pos] = j
+        self.last = max(self.last, k)
+
+    def record_many(self, samples):
+        '''
+        @samples: (ts, latency) arrays per METRICS, in time order and later
+        than the samples recorded before
+        '''
+        slots = [ts//self.step for ts, latency in samples]
+        for k in np.unique(np.concatenate(slots)):
+            k = int(k)
+            self.advance(k)
+            sketches = self.slot(k)
+            for sketch, slot, (ts, latency) in zip(sketches, slots, samples):
+                lo, hi = np.searchsorted(slot, k), np.searchsorted(slot, k, 'right')
+                if hi > lo:
+                    sketch.record_many(latency[lo:hi])
+
+    def slots(self):
+        '''
+        {k: sketches} of the slots kept, first and last window
+        '''
+        slots = dict(self.head)
+        for k, sketches in zip(self.ring_slot, self.ring):
+            if k is not None:
+                slots[k] = sketches
+        return slots
+
+    def merge(self, other):
+        '''
+        Append the series of the trace following this one
+        '''
+        if other.first is None:
+            return self
+        if self.first is None:
+            self.__dict__.update(other.__dict__)
+            return self
+        slots = self.slots()
+        for k, sketches in other.slots().items():
+            if k in slots:
+                for merged, sketch in zip(slots[k], sketches):
+                    merged.merge(sketch)
+            else:
+                slots[k] = sketches
+
+        # windows straddling both series
+        lo = max(self.last, self.first + self.nr_slots)
+        hi = min(other.first + self.nr_slots, other.last)
+        windows = set()
+        for j in slots:
+            windows.update(range(max(j, lo), min(j + self.nr_slots, hi)))
+        self.add_rows(sorted(windows), slots.get, self.rows)
+        self.rows.update(other.rows)
+
+        self.last = other.last
+        self.head = dict((k, sketches) for k, sketches in slots.items()
+                if k < self.first + self.nr_slots and k <= self.last - self.nr_slots)
+        self.ring = [None]*self.nr_slots
+        self.ring_slot = [None]*self.nr_slots
+        for k in range(self.last - self.nr_slots + 1, self.last + 1):
+            if k in slots:
+                self.ring[k % self.nr_slots] = slots[k]
+                self.ring_slot[k % self.nr_slots] = k
+        return self
+
+    def series(self):
+        '''
+        {k: row} of every window ending with slot k with samples, including
+        the first windows and the one of the slot still filled
+        '''
+        rows = dict(self.rows)
+        if self.first is not None:
+            windows = list(range(self.first, min(self.first + self.nr_slots, self.last)))
+            self.add_rows(windows + [self.last], self.slot, rows)
+        return rows
+
+    def report(self, out=sys.stdout):
+        rows = sorted(self.series().items())
+        for m, metric in enumerate(METRICS):
+            title = '%s over %d us windows every %d us (in us)' % (metric, self.window_us, self.step_us)
+            print(('------------------%s' % title).ljust(76, '-'), file=out)
+            series = [(k, row[m]) for k, row in rows if row[m] is not None]
+            if not series:
+                print("No samples", file=out)
+                continue
+            p99 = [values[WINDOW_PERCENTILES.index(99)] for k, (count, values) in series]
+            threshold = max(SPIKE_FACTOR*float(np.median(p99)), SPIKE_MIN_US)
+            print("%-18s %9s" % ("window end (s)", "samples") +
+                    "".join(" %12s" % ("%s%%ile" % p) for p in WINDOW_PERCENTILES), file=out)
+            spikes = 0
+            for k, (count, values) in series:
+                spike = values[WINDOW_PERCENTILES.index(99)] > threshold
+                spikes += spike
+                end = (k + 1)*self.step
+                print("%11d.%06d %9d" % (end//(10**9), (end%(10**9))//(10**3), count) +
+                        "".join(" %12.3f" % value for value in values) +
+                        ("  <== spike" if spike else ""), file=out)
+            print("Spike windows (99%%ile > %.3f us) = %d of %d" % (threshold, spikes, len(series)), file=out)
@@ -0,0 +1,226 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Task migrations between CPUs, from sched_migrate_task.
+#
+# Every migration is counted in an orig_cpu x dest_cpu matrix, a dense NumPy
+# array while CPU ids stay below DENSE_MAX_CPUS and a dict of CPU pairs
+# beyond. Events are buffered and added to the matrix in batches. The
+# migrations are then broken down by the topology distance they cross: within
+# an SMT core, within an LLC, across LLCs or across NUMA nodes, with their
+# rate per second of trace.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+from array import array
+import sys
+
+import numpy as np
+
+# default tunables
+NR_CPUS = 176
+WAKEUP_SCOPE_SIZE = 8 # LLC size when the topology is unknown
+SMT_SIZE = 4 # SMT core size when the topology is unknown
+TOP_PAIRS = 10 # busiest orig -> dest CPU pairs reported
+
+DENSE_MAX_CPUS = 1024
+BATCH = 1<<16 # migrations buffered before adding them to the matrix
+
+# topology distance of a migration
+SAME_CORE = 0
+SAME_LLC = 1
+CROSS_LLC = 2
+CROSS_NODE = 3
+UNKNOWN = 4
+LEVELS = ('same SMT core', 'same LLC', 'cross LLC', 'cross NUMA node', 'unknown CPU')
+
+# tracepoints handled by MigrationAnalyzer
+EVENTS = ('sched_migrate_task',)
+
+def node_ids(cpu_topology, nr_cpus):
+    '''
+    NUMA node of the first nr_cpus CPUs, None when unknown
+    '''
+    if cpu_topology is None:
+        return [None for cpu in range(nr_cpus)]
+    return [cpu_topology.node_id[cpu] if cpu < cpu_topology.nr_cpu_ids else None
+            for cpu in range(nr_cpus)]
+
+def topology_ids(cpu_topology, nr_cpus, wakeup_scope_size=WAKEUP_SCOPE_SIZE, smt_size=SMT_SIZE):
+    '''
+    (core_id, llc_id, node_id) lists of the first nr_cpus CPUs, from
+    CpuTopology when it knows the CPU and from the scope sizes otherwise.
+    node_id entries are None when unknown.
+    '''
+    core_id, llc_id = [], []
+    for cpu in range(nr_cpus):
+        known = cpu_topology is not None and cpu < cpu_topology.nr_cpu_ids
+        if known and cpu_topology.core_id[cpu] is not None:
+            core_id.append(cpu_topology.core_id[cpu])
+        else:
+            core_id.append((cpu//smt_size)*smt_size)
+        if known and cpu_topology.llc_id[cpu] is not None:
+            llc_id.append(cpu_topology.llc_id[cpu])
+        else:
+            llc_id.append((cpu//wakeup_scope_size)*wakeup_scope_size)
+    return core_id, llc_id, node_ids(cpu_topology, nr_cpus)
+
+
+class MigrationMatrix:
+    def __init__(self):
+        self.counts = np.zeros((0, 0), dtype=np.int64)
+        self.sparse = dict() # (orig, dest): count, once a CPU id is >= DENSE_MAX_CPUS
+        self.orig = array('i')
+        self.dest = array('i')
+
+    def record(self, orig_cpu, dest_cpu):
+        self.orig.append(orig_cpu)
+        self.dest.append(dest_cpu)
+        if len(self.orig) >= BATCH:
+            self.flush()
+
+    def flush(self):
+        if not self.orig:
+            return
+        orig = np.frombuffer(self.orig, dtype=np.int32).astype(np.int64)
+        dest = np.frombuffer(self.dest, dtype=np.int32).astype(np.int64)
+        self.orig, self.dest = array('i'), array('i')
+        nr_cpus = int(max(orig.max(), dest.max())) + 1
+        if nr_cpus > DENSE_MAX_CPUS or self.sparse:
+            self.add_sparse(orig, dest, np.ones(len(orig), dtype=np.int64))
+            return
+        if nr_cpus > len(self.counts):
+            counts = np.zeros((nr_cpus, nr_cpus), dtype=np.int64)
+            counts[:len(self.counts), :len(self.counts)] = self.counts
+            self.counts = counts
+        n = len(self.counts)
+        self.counts += np.bincount(orig*n + dest, minlength=n*n).reshape(n, n)
+
+    def add_sparse(self, orig, dest, counts):
+        if not self.sparse and len(self.counts):
+            # switch over from the dense matrix
+            dense_orig, dense_dest = np.nonzero(self.counts)
+            for pair, count in zip(zip(dense_orig.tolist(), dense_dest.tolist()),
+                    self.counts[dense_orig, dense_dest].tolist()):
+                self.sparse[pair] = count
+            self.counts = np.zeros((0, 0), dtype=np.int64)
+        for pair, count in zip(zip(orig.tolist(), dest.tolist()), counts.tolist()):
+            self.sparse[pair] = self.sparse.get(pair, 0) + count
+
+    def pairs(self):
+        '''
+        (orig, dest, count) arrays of the CPU pairs with migrations
+        '''
+        self.flush()
+        if self.sparse:
+            keys = list(self.sparse)
+            return (np.array([orig for orig, dest in keys], dtype=np.int64),
+                    np.array([dest for orig, dest in keys], dtype=np.int64),
+                    np.array([self.sparse[key] for key in keys], dtype=np.int64))
+        orig, dest = np.nonzero(self.counts)
+        return orig, dest, self.counts[orig, dest]
+
+    def merge(self, other):
+        self.flush()
+        orig, dest, counts = other.pairs()
+        if not len(orig):
+            return self
+        nr_cpus = int(max(orig.max(), dest.max())) + 1
+        if nr_cpus > DENSE_MAX_CPUS or self.sparse:
+            self.add_sparse(orig, dest, counts)
+        else:
+            if nr_cpus > len(self.counts):
+                grown = np.zeros((nr_cpus, nr_cpus), dtype=np.int64)
+                grown[:len(self.counts), :len(self.counts)] = self.counts
+                self.counts = grown
+            self.counts[orig, dest] += counts
+        return self
+
+
+class MigrationSummary:
+    '''
+    Mergeable migration matrix of a trace, with the topology to break it
+    down by
+    '''
+    def __init__(self, core_id, llc_id, node_id, top_pairs=TOP_PAIRS):
+        self.core_id = core_id
+        self.llc_id = llc_id
+        self.node_id = node_id
+        self.top_pairs = top_pairs
+        self.matrix = MigrationMatrix()
+        # ktime of the first and last migration
+        self.first_ts = None
+        self.last_ts = None
+
+    def record(self, ts, orig_cpu, dest_cpu):
+        if self.first_ts is None:
+            self.first_ts = ts
+        self.last_ts = ts
+        self.matrix.record(orig_cpu, dest_cpu)
+
+    def merge(self, other):
+        self.matrix.merge(other.matrix)
+        if other.first_ts is not None:
+            if self.first_ts is None or other.first_ts < self.first_ts:
+                self.first_ts = other.first_ts
+            if self.last_ts is None or other.last_ts > self.last_ts:
+                self.last_ts = other.last_ts
+        return self
+
+    def levels(self, orig, dest):
+        '''
+        Topology distance (SAME_CORE, ...) of each orig -> dest migration
+        '''
+        nr_cpus = len(self.core_id)
+        known = (orig < nr_cpus) & (dest < nr_cpus)
+        levels = np.full(len(orig), UNKNOWN, dtype=np.int64)
+        core_id = np.array(self.core_id + [-1], dtype=np.int64)
+        llc_id = np.array(self.llc_id + [-1], dtype=np.int64)
+        node_id = np.array([-1 if node is None else node for node in self.node_id] + [-1], dtype=np.int64)
+        orig = np.where(known, orig, nr_cpus)
+        dest = np.where(known, dest, nr_cpus)
+        cross_node = (node_id[orig] != node_id[dest]) & (node_id[orig] >= 0) & (node_id[dest] >= 0)
+        levels[known] = np.where(cross_node, CROSS_NODE,
+                np.where(llc_id[orig] != llc_id[dest], CROSS_LLC,
+                np.where(core_id[orig] != core_id[dest], SAME_LLC, SAME_CORE)))[known]
+        return levels
+
+    def report(self, out=sys.stdout):
+        orig, dest, counts = self.matrix.pairs()
+        total = int(counts.sum())
+        duration = 0 if self.first_ts is None else (self.last_ts - self.first_ts)/(10**9)
+        per_level = np.bincount(self.levels(orig, dest), weights=counts, minlength=len(LEVELS))
+        print('------------------Task migrations by topology distance----------------------', file=out)
+        print("%-20s %12s %8s %12s" % ("distance", "migrations", "%", "per sec"), file=out)
+        for level, name in enumerate(LEVELS):
+            if level == UNKNOWN and not per_level[level]:
+                continue
+            count = int(per_level[level])
+            print("%-20s %12d %8.2f %12.1f" % (name, count, 100.0*count/total if total else 0,
+                    count/duration if duration else 0), file=out)
+        print("Total migrations = ", total, " over ", round(duration, 3), "s", file=out)
+        if total:
+            print("Busiest orig -> dest CPU pairs =", ", ".join("%d->%d: %d" % pair for pair in
+                    zip(*[column[np.argsort(-counts, kind='stable')[:self.top_pairs]].tolist()
+                        for column in (orig, dest, counts)])), file=out)
+
+
+class MigrationAnalyzer:
+    EVENTS = EVENTS
+
+    def __init__(self, cpu_topology=None, nr_cpus=NR_CPUS,
+            wakeup_scope_size=WAKEUP_SCOPE_SIZE, top_pairs=TOP_PAIRS, out=sys.stdout):
+        self.out = out
+        self.summary = MigrationSummary(*topology_ids(cpu_topology, nr_cpus, wakeup_scope_size),
+                top_pairs=top_pairs)
+
+    def sched_migrate_task(self, ts, common_cpu, orig_cpu, dest_cpu, **fields):
+        self.summary.record(ts, orig_cpu, dest_cpu)
+
+    def finish(self):
+        self.summary.matrix.flush()
+        return self.summary
+
+    def report(self, out=None):
+        self.finish().report(out or self.out)
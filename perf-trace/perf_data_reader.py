@@ -0,0 +1,443 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Reader for the perf.data files written by `perf record`, which lets the
+# analyzers run on machines without perf or perf's embedded Python.
+#
+# perf record -e sched:sched_wakeup,sched:sched_switch,sched:sched_waking,sched:sched_migrate_task,sched:sched_process_exit -aR
+# ./sched-analyze.py --trace perf.data -a latency
+#
+# The file header, the event attributes and the tracepoint formats of the
+# tracing data header feature are parsed once. The data section is walked
+# record by record for the record offsets only; the sample fields and raw
+# tracepoint payloads are then gathered in bulk with NumPy, one column per
+# field, for chunks of CHUNK samples in time order.
+#
+# Events are returned as (ktime_ns, event_name, common_cpu, fields) like
+# perf_script_reader.read_events, where fields holds the tracepoint fields
+# (as passed to the sched__sched_wakeup() etc. handlers of perf script),
+# common_pid and the common_comm known from the COMM/FORK records.
+#
+# Pipe mode (perf record -o -) and compressed (perf record -z) files are not
+# supported.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+import mmap
+import re
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b'PERFILE2'
+MAGIC_SWAPPED = b'2ELIFREP' # written on a machine of the other endianness
+FILE_HEADER = '8sQQQQQQQQ4Q' # magic, header size, attr size, attrs, data, event types, features
+FILE_SECTION = 'QQ' # offset, size
+HEADER_TRACING_DATA = 1 # feature bit of the tracepoint formats
+
+# perf_event_header.type
+PERF_RECORD_COMM = 3
+PERF_RECORD_FORK = 7
+PERF_RECORD_SAMPLE = 9
+PERF_RECORD_AUXTRACE = 71
+PERF_RECORD_COMPRESSED = 81
+
+# perf_event_attr.sample_type, in the order of their PERF_RECORD_SAMPLE fields
+PERF_SAMPLE_IDENTIFIER = 1 << 16
+PERF_SAMPLE_IP = 1 << 0
+PERF_SAMPLE_TID = 1 << 1
+PERF_SAMPLE_TIME = 1 << 2
+PERF_SAMPLE_ADDR = 1 << 3
+PERF_SAMPLE_ID = 1 << 6
+PERF_SAMPLE_STREAM_ID = 1 << 9
+PERF_SAMPLE_CPU = 1 << 7
+PERF_SAMPLE_PERIOD = 1 << 8
+PERF_SAMPLE_READ = 1 << 4
+PERF_SAMPLE_CALLCHAIN = 1 << 5
+PERF_SAMPLE_RAW = 1 << 10
+
+# perf_event_attr.read_format
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+PERF_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+PERF_FORMAT_ID = 1 << 2
+PERF_FORMAT_GROUP = 1 << 3
+PERF_FORMAT_LOST = 1 << 4
+
+# samples decoded at once
+CHUNK = 1<<16
+
+# field:unsigned char comm[16];	offset:8;	size:16;	signed:0;
+FIELD_RE = re.compile(r'field:(.*?);\s*offset:(\d+);\s*size:(\d+);\s*signed:(\d+);')
+
+class TracepointFormat:
+    '''
+    Layout of the raw payload of one tracepoint, from its format file
+    '''
+    def __init__(self, system, text):
+        self.system = system
+        self.name = re.search(r'^name:\s*(\S+)', text, re.M).group(1)
+        self.id = int(re.search(r'^ID:\s*(\d+)', text, re.M).group(1))
+        # (name, offset, size, signed, kind), kind being 'int', 'str',
+        # 'array' or 'data_loc'/'rel_loc' for dynamic arrays
+        self.fields = []
+        for decl, offset, size, signed in FIELD_RE.findall(text):
+            match = re.match(r'(.*?)(\w+)\s*(\[(\w*)\])?\s*$', decl)
+            if match is None:
+                continue
+            kind = 'int'
+            if decl.startswith('__data_loc'):
+                kind = 'data_loc'
+            elif decl.startswith('__rel_loc'):
+                kind = 'rel_loc'
+            elif match.group(3):
+                kind = 'str' if match.group(1).strip() in ('char', 'unsigned char') else 'array'
+            self.fields.append((match.group(2), int(offset), int(size), signed == '1', kind))
+
+
+class TracingData:
+    '''
+    Parser of the HEADER_TRACING_DATA feature: the tracefs header and event
+    format files saved by perf record
+    '''
+    def __init__(self, buf):
+        self.buf = buf
+        if buf[:10] != b'\x17\x08\x44tracing':
+            raise ValueError("Bad tracing data magic")
+        self.offset = 10
+        version = self.string()
+        self.endian = '>' if buf[self.offset] else '<'
+        self.offset += 2 # big endian flag, long size
+        self.read('I') # page size
+
+        for name in ('header_page', 'header_event'):
+            if self.string() != name:
+                raise ValueError("Bad tracing data %s" % name)
+            self.skip(self.read('Q'))
+        for i in range(self.read('I')): # ftrace formats
+            self.skip(self.read('Q'))
+        self.formats = dict() # id: TracepointFormat
+        for i in range(self.read('I')):
+            system = self.string()
+            for j in range(self.read('I')):
+                size = self.read('Q')
+                text = bytes(buf[self.offset:self.offset + size]).decode(errors='replace')
+                self.offset += size
+                event = TracepointFormat(system, text)
+                self.formats[event.id] = event
+
+    def read(self, fmt):
+        value, = struct.unpack_from(self.endian + fmt, self.buf, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return value
+
+    def skip(self, size):
+        self.offset += size
+
+    def string(self):
+        end = bytes(self.buf[self.offset:self.offset + 4096]).index(b'\0')
+        value = bytes(self.buf[self.offset:self.offset + end]).decode()
+        self.offset += end + 1
+        return value
+
+
+def _gather(data, pos, dtype):
+    '''
+    Values of dtype at the byte offsets pos of the uint8 array data
+    '''
+    dtype = np.dtype(dtype)
+    return data[pos[:, None] + np.arange(dtype.itemsize)].view(dtype).ravel()
+
+def _cstring(value):
+    return value.split(b'\0', 1)[0].decode(errors='replace')
+
+
+class PerfData:
+    '''
+    Read-only mmap of a perf.data file, with the tracepoint samples indexed
+    in time order
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fd:
+            self.mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self.mm[:8]
+        if magic not in (MAGIC, MAGIC_SWAPPED):
+            raise ValueError("%s is not a perf.data file" % path)
+        self.endian = '<' if magic == MAGIC else '>'
+        header = struct.unpack_from(self.endian + FILE_HEADER, self.mm)
+        header_size, attr_size = header[1], header[2]
+        if header_size < struct.calcsize(FILE_HEADER):
+            raise ValueError("%s: pipe mode perf.data is not supported" % path)
+        attrs_offset, attrs_size, data_offset, data_size = header[3:7]
+        features = header[9:13]
+
+        # tracepoint formats, from the first feature section
+        self.formats = dict()
+        nr_features = 0
+        feature_offset = data_offset + data_size
+        for bit in range(256):
+            if not features[bit//64] & (1 << (bit % 64)):
+                continue
+            if bit == HEADER_TRACING_DATA:
+                offset, size = struct.unpack_from(self.endian + FILE_SECTION, self.mm,
+                        feature_offset + nr_features*struct.calcsize(FILE_SECTION))
+                self.formats = TracingData(memoryview(self.mm)[offset:offset + size]).formats
+            nr_features += 1
+        if not self.formats:
+            raise ValueError("%s has no tracepoint formats" % path)
+
+        # sample layout of each event, and the sample ids telling them apart
+        layouts = []
+        ids = dict()
+        for i in range(attrs_size//attr_size):
+            offset = attrs_offset + i*attr_size
+            sample_type, read_format = struct.unpack_from(self.endian + 'QQ', self.mm, offset + 24)
+            layouts.append((sample_type, read_format))
+            ids_offset, ids_size = struct.unpack_from(self.endian + FILE_SECTION, self.mm,
+                    offset + attr_size - struct.calcsize(FILE_SECTION))
+            for event_id in struct.unpack_from(self.endian + '%dQ' % (ids_size//8), self.mm, ids_offset):
+                ids[event_id] = len(layouts) - 1
+
+        self.data = np.frombuffer(self.mm, np.uint8, data_size, data_offset)
+        offsets, types = self._walk(data_offset, data_size)
+
+        samples = offsets[types == PERF_RECORD_SAMPLE]
+        if len(set(layouts)) == 1:
+            attr = np.zeros(len(samples), dtype=np.int64)
+        elif all(sample_type & PERF_SAMPLE_IDENTIFIER for sample_type, read_format in layouts):
+            sample_ids = _gather(self.data, samples + 8, self.endian + 'u8')
+            attr = np.array([ids.get(event_id, -1) for event_id in sample_ids.tolist()], dtype=np.int64)
+        else:
+            raise ValueError("%s: events with different sample types need PERF_SAMPLE_IDENTIFIER" % path)
+
+        ts = np.empty(len(samples), dtype=np.int64)
+        cpu = np.full(len(samples), -1, dtype=np.int32)
+        raw = np.full(len(samples), -1, dtype=np.int64)
+        for i, layout in enumerate(layouts):
+            mask = attr == i
+            if np.any(mask):
+                ts[mask], cpu[mask], raw[mask] = self._sample_fields(samples[mask], *layout)
+        keep = raw >= 0
+        common_type = np.full(len(samples), -1, dtype=np.int64)
+        common_type[keep] = _gather(self.data, raw[keep], self.endian + 'u2')
+        keep &= np.isin(common_type, list(self.formats))
+
+        # time order, file order for equal timestamps
+        order = np.argsort(ts[keep], kind='stable')
+        self.ts = ts[keep][order]
+        self.cpu = cpu[keep][order]
+        self.raw = raw[keep][order]
+        self.common_type = common_type[keep][order]
+        self.common_pid = _gather(self.data, self.raw + 4, self.endian + 'i4')
+        sample_records = np.nonzero(types == PERF_RECORD_SAMPLE)[0]
+        self.comm_id = self._comms(offsets, types, sample_records[keep][order])
+
+    def __len__(self):
+        return len(self.ts)
+
+    def _walk(self, data_offset, data_size):
+        '''
+        Offsets (from the start of the data section) and types of all records
+        '''
+        if self.endian == ('<' if sys.byteorder == 'little' else '>'):
+            # perf_event_header.size of the record at offset is sizes[offset/2 + 3]
+            sizes = memoryview(self.mm)[data_offset:data_offset + data_size - data_size % 2].cast('H')
+            offsets = []
+            append = offsets.append
+            offset = 0
+            while offset < data_size:
+                append(offset)
+                size = sizes[(offset >> 1) + 3]
+                if size == 0:
+                    break
+                offset += size
+            del(sizes)
+            offsets = np.array(offsets, dtype=np.int64)
+            types = _gather(self.data, offsets, self.endian + 'u4').astype(np.int64)
+            # AUXTRACE data is not counted in the record size
+            if offset == data_size and not np.any(np.isin(types,
+                    (PERF_RECORD_AUXTRACE, PERF_RECORD_COMPRESSED))):
+                return offsets, types
+
+        header = struct.Struct(self.endian + 'IHH')
+        mm = self.mm
+        offsets = []
+        types = []
+        offset = data_offset
+        end = data_offset + data_size
+        while offset < end:
+            record_type, misc, size = header.unpack_from(mm, offset)
+            if record_type == PERF_RECORD_COMPRESSED:
+                raise ValueError("%s: compressed perf.data is not supported" % self.path)
+            if size == 0:
+                raise ValueError("%s: corrupted record at offset %d" % (self.path, offset))
+            offsets.append(offset - data_offset)
+            types.append(record_type)
+            if record_type == PERF_RECORD_AUXTRACE:
+                size += struct.unpack_from(self.endian + 'Q', mm, offset + 8)[0]
+            offset += size
+        return np.array(offsets, dtype=np.int64), np.array(types, dtype=np.int64)
+
+    def _sample_fields(self, pos, sample_type, read_format):
+        '''
+        (ts, cpu, raw payload offset) of the samples at pos
+        '''
+        if not sample_type & PERF_SAMPLE_TIME:
+            raise ValueError("%s: samples have no timestamp, record with perf record -T" % self.path)
+        if not sample_type & PERF_SAMPLE_RAW:
+            return np.zeros(len(pos), dtype=np.int64), -1, -1
+        u64 = self.endian + 'u8'
+        pos = pos + 8 # perf_event_header
+        for bit in (PERF_SAMPLE_IDENTIFIER, PERF_SAMPLE_IP, PERF_SAMPLE_TID):
+            if sample_type & bit:
+                pos = pos + 8
+        ts = _gather(self.data, pos, self.endian + 'i8')
+        pos = pos + 8
+        for bit in (PERF_SAMPLE_ADDR, PERF_SAMPLE_ID, PERF_SAMPLE_STREAM_ID):
+            if sample_type & bit:
+                pos = pos + 8
+        cpu = -1
+        if sample_type & PERF_SAMPLE_CPU:
+            cpu = _gather(self.data, pos, self.endian + 'u4')
+            pos = pos + 8
+        if sample_type & PERF_SAMPLE_PERIOD:
+            pos = pos + 8
+        if sample_type & PERF_SAMPLE_READ:
+            times = 8*bin(read_format & (PERF_FORMAT_TOTAL_TIME_ENABLED |
+                    PERF_FORMAT_TOTAL_TIME_RUNNING)).count('1')
+            value = 8 + 8*bin(read_format & (PERF_FORMAT_ID | PERF_FORMAT_LOST)).count('1')
+            if read_format & PERF_FORMAT_GROUP:
+                pos = pos + 8 + times + value*_gather(self.data, pos, u64).astype(np.int64)
+            else:
+                pos = pos + value + times
+        if sample_type & PERF_SAMPLE_CALLCHAIN:
+            pos = pos + 8 + 8*_gather(self.data, pos, u64).astype(np.int64)
+        # u32 size, then the payload
+        return ts, cpu, pos + 4
+
+    def _comms(self, offsets, types, sample_records):
+        '''
+        Index in self.comms of the comm of each sample's common_pid, as left
+        by the COMM/FORK records before it, -1 if unknown
+        '''
+        self.comms = []
+        comm_ids = dict()
+        comm_of = dict() # tid: comm id
+        update_record, update_tid, update_comm = [], [], []
+        for record in np.nonzero((types == PERF_RECORD_COMM) | (types == PERF_RECORD_FORK))[0].tolist():
+            offset = int(offsets[record]) + 8
+            if types[record] == PERF_RECORD_COMM:
+                pid, tid = struct.unpack_from(self.endian + 'II', self.data, offset)
+                comm = _cstring(self.data[offset + 8:offset + 8 + 16].tobytes())
+                if comm not in comm_ids:
+                    comm_ids[comm] = len(self.comms)
+                    self.comms.append(comm)
+                comm_of[tid] = comm_ids[comm]
+            else:
+                pid, ppid, tid, ptid = struct.unpack_from(self.endian + 'IIII', self.data, offset)
+                if ptid not in comm_of:
+                    continue
+                comm_of[tid] = comm_of[ptid]
+            update_record.append(record)
+            update_tid.append(tid)
+            update_comm.append(comm_of[tid])
+
+        # forward fill the updates of each tid over its samples, in record order
+        n = len(update_record)
+        record = np.concatenate([np.array(update_record, dtype=np.int64), sample_records])
+        tid = np.concatenate([np.array(update_tid, dtype=np.int64), self.common_pid.astype(np.int64)])
+        order = np.lexsort((record, tid))
+        last = np.where(order < n, np.arange(len(order)), -1)
+        np.maximum.accumulate(last, out=last)
+        valid = last >= 0
+        valid[valid] = tid[order][last[valid]] == tid[order][valid]
+        comm = np.full(len(order), -1, dtype=np.int64)
+        comm[valid] = np.array(update_comm + [-1], dtype=np.int64)[order[last[valid]]]
+        comm_id = np.empty(len(order), dtype=np.int64)
+        comm_id[order] = comm
+        return comm_id[n:]
+
+    def _decode(self, event, raw):
+        '''
+        Columns of the fields of event from the raw payloads at raw
+        '''
+        columns = []
+        for name, offset, size, signed, kind in event.fields:
+            if name.startswith('common_'):
+                continue
+            if kind == 'str':
+                # drop what follows the terminating NUL, and decode each
+                # distinct string once
+                chars = self.data[(raw + offset)[:, None] + np.arange(size)]
+                chars[np.cumsum(chars == 0, axis=1) > 0] = 0
+                strings, index = np.unique(chars.view('S%d' % size).ravel(), return_inverse=True)
+                strings = [value.decode(errors='replace') for value in strings.tolist()]
+                values = [strings[i] for i in index.tolist()]
+            elif kind in ('data_loc', 'rel_loc'):
+                loc = _gather(self.data, raw + offset, self.endian + 'u4').astype(np.int64)
+                start = raw + (loc & 0xffff) + (offset + size if kind == 'rel_loc' else 0)
+                values = [_cstring(self.data[i:i + length].tobytes())
+                        for i, length in zip(start.tolist(), (loc >> 16).tolist())]
+            elif kind == 'array' or size not in (1, 2, 4, 8):
+                values = [bytes(value) for value in _gather(self.data, raw + offset, 'V%d' % size).tolist()]
+            else:
+                values = _gather(self.data, raw + offset,
+                        self.endian + ('i' if signed else 'u') + str(size)).tolist()
+            columns.append((name, values))
+        return columns
+
+    def time_range(self, start_ts=None, end_ts=None):
+        '''
+        Event numbers [start, end) of the events in ktime [start_ts, end_ts)
+        '''
+        start = 0 if start_ts is None else int(np.searchsorted(self.ts, start_ts, side='left'))
+        end = len(self) if end_ts is None else int(np.searchsorted(self.ts, end_ts, side='left'))
+        return start, max(start, end)
+
+    def events(self, start=0, end=None):
+        '''
+        Events [start, end) in time order, as (ktime_ns, event_name,
+        common_cpu, fields) like perf_script_reader.read_events
+        '''
+        end = len(self) if end is None else min(end, len(self))
+        for chunk in range(start, end, CHUNK):
+            chunk_end = min(chunk + CHUNK, end)
+            common_type = self.common_type[chunk:chunk_end]
+            raw = self.raw[chunk:chunk_end]
+            rows = dict()
+            for event_id in np.unique(common_type).tolist():
+                columns = self._decode(self.formats[event_id], raw[common_type == event_id])
+                names = [name for name, values in columns]
+                rows[event_id] = iter([dict(zip(names, row)) for row in
+                        zip(*[values for name, values in columns])])
+            comms = self.comms
+            for ts, cpu, event_id, pid, comm_id in zip(self.ts[chunk:chunk_end].tolist(),
+                    self.cpu[chunk:chunk_end].tolist(), common_type.tolist(),
+                    self.common_pid[chunk:chunk_end].tolist(), self.comm_id[chunk:chunk_end].tolist()):
+                fields = next(rows[event_id])
+                fields['common_pid'] = pid
+                if comm_id >= 0:
+                    fields['common_comm'] = comms[comm_id]
+                else:
+                    fields['common_comm'] = 'swapper' if pid == 0 else ':%d' % pid
+                yield ts, self.formats[event_id].name, cpu, fields
+
+
+def is_perf_data(path):
+    with open(path, 'rb') as fd:
+        return fd.read(len(MAGIC)) in (MAGIC, MAGIC_SWAPPED)
+
+def read_events(path, start=0, end=None):
+    '''
+    Events [start, end) of the perf.data file at path
+    '''
+    return PerfData(path).events(start, end)
+
+def split(path, nr_shards):
+    '''
+    Split the events of path into at most nr_shards ranges of similar size,
+    each a time shard.
+    '''
+    nr_events = len(PerfData(path))
+    offsets = sorted(set(nr_events*i//nr_shards for i in range(nr_shards)))
+    return list(zip(offsets, offsets[1:] + [nr_events]))
@@ -0,0 +1,86 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Reader for the text output of `perf script`, used to replay sched:* traces
+# outside of perf's embedded interpreter.
+#
+# Record the trace as usual and dump it once with nsec timestamps:
+# perf script --ns -F comm,pid,cpu,time,event,trace > trace.txt
+#
+# Every event is returned as (ktime_ns, event_name, common_cpu, fields) where
+# event_name drops the subsystem ("sched_wakeup", "cpu_idle", ...) and fields
+# holds common_pid, common_comm and the tracepoint fields, with numeric values
+# converted to int.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+import os
+import re
+
+# <comm> <pid> [<cpu>] <secs>.<fraction>: <subsystem>:<event>: <fields>
+EVENT_RE = re.compile(br'^\s*(.*?)\s+(\d+)(?:/\d+)?\s+\[(\d+)\]\s+(\d+)\.(\d+):\s+(?:\d+\s+)?'
+        br'\w+:(\w+):\s*(.*)$')
+FIELD_RE = re.compile(br'(\w+)=(.*?)(?=\s+\w+=|\s+==>|\s*$)')
+
+# prev_state letters printed by sched_switch, as the values seen by perf
+# script handlers: TASK_RUNNING, TASK_INTERRUPTIBLE, TASK_UNINTERRUPTIBLE, ...
+TASK_STATE = {'R': 0, 'R+': 0, 'S': 1, 'D': 2, 'T': 4, 't': 8, 'X': 16, 'Z': 32,
+        'P': 64, 'I': 1026}
+
+def parse_fields(text):
+    fields = dict()
+    for key, value in FIELD_RE.findall(text):
+        key = key.decode()
+        try:
+            fields[key] = int(value)
+        except ValueError:
+            fields[key] = value.decode(errors='replace')
+    if 'prev_state' in fields and not isinstance(fields['prev_state'], int):
+        fields['prev_state'] = TASK_STATE.get(fields['prev_state'], -1)
+    return fields
+
+def parse_line(line):
+    '''
+    Parse one line of perf script output, None if it is not an event
+    '''
+    match = EVENT_RE.match(line)
+    if match is None:
+        return None
+    comm, pid, cpu, secs, fraction, event_name, fields = match.groups()
+    ts = int(secs)*(10**9) + int(fraction.ljust(9, b'0')[:9])
+    fields = parse_fields(fields)
+    fields['common_pid'] = int(pid)
+    fields['common_comm'] = comm.decode(errors='replace')
+    return ts, event_name.decode(), int(cpu), fields
+
+def read_events(path, start=0, end=None):
+    '''
+    Events of the lines starting in the byte range [start, end) of path.
+    start must be at the beginning of a line.
+    '''
+    with open(path, 'rb') as fd:
+        fd.seek(start)
+        offset = start
+        for line in fd:
+            if end is not None and offset >= end:
+                break
+            offset += len(line)
+            event = parse_line(line)
+            if event is not None:
+                yield event
+
+def split(path, nr_shards):
+    '''
+    Split path into at most nr_shards line aligned byte ranges of similar size.
+    perf script output is sorted by time, so each range is a time shard.
+    '''
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, 'rb') as fd:
+        for i in range(1, nr_shards):
+            fd.seek(max(size*i//nr_shards - 1, offsets[-1]))
+            if fd.tell() > 0:
+                fd.readline()
+            if fd.tell() > offsets[-1] and fd.tell() < size:
+                offsets.append(fd.tell())
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# Licensed under the terms of the GNU GPL License version 2
+#
+# CPU x time heatmap of the run queue length, as a multi-resolution pyramid
+# of PNG tiles and a JSON index, see runqlen_heatmap.py.
+#
+# The trace can be a perf.data file, a `perf script --ns` text dump or a
+# sched-convert.py trace file with sched_update_nr_running events:
+# perf record -e sched:sched_update_nr_running -aR
+# ./runqlen-heatmap.py perf.data -o heatmap
+#
+# or a binary trace of bpf_scripts/nrstatss.py -o:
+# ./runqlen-heatmap.py trace.nrstat -o heatmap
+#
+# Tiles of a window of the trace, at the coarsest level showing it in at
+# least --width buckets, are then listed with:
+# ./runqlen-heatmap.py --window 1200 1201 heatmap
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+import perf_data_reader
+import perf_script_reader
+import runqlen_heatmap
+import trace_store
+from schedstat_parser import parse_cpulist
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../bpf_scripts'))
+import nrstat_trace
+
+def read_series(path, cpus=None):
+    if nrstat_trace.is_trace_file(path):
+        header, records = nrstat_trace.load(path)
+        cpu, event, after = nrstat_trace.nr_running_ops(records)
+        # the nr_running of a CPU after the last op of each event
+        last = np.ones(len(cpu), dtype=bool)
+        last[:-1] = (cpu[1:] != cpu[:-1]) | (event[1:] != event[:-1])
+        ts = np.asarray(records['ts'], dtype=np.int64)[event[last]]
+        return runqlen_heatmap.RunqlenSeries(cpu[last], ts, after[last],
+                cpus if cpus is not None else header['cpumask'])
+    if trace_store.is_trace_file(path):
+        records = trace_store.TraceFile(path).sections['sched_update_nr_running']
+        return runqlen_heatmap.RunqlenSeries(records['cpu'], records['ts'], records['nr_running'], cpus)
+    reader = perf_data_reader if perf_data_reader.is_perf_data(path) else perf_script_reader
+    cpu, ts, nr_running = [], [], []
+    for event_ts, event_name, common_cpu, fields in reader.read_events(path):
+        if event_name == 'sched_update_nr_running':
+            cpu.append(fields['cpu'])
+            ts.append(event_ts)
+            nr_running.append(fields['nr_running'])
+    return runqlen_heatmap.RunqlenSeries(cpu, ts, nr_running, cpus)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build a multi-resolution CPU x time heatmap of the run queue length")
+    parser.add_argument("trace", help="perf.data file, `perf script --ns` text dump, sched-convert.py "
+        "trace file or nrstatss.py -o trace; the output directory with --window")
+    parser.add_argument("-o", "--output", default="heatmap", help="output directory (default heatmap)")
+    parser.add_argument("-b", "--bucket-us", type=float, default=runqlen_heatmap.BASE_BUCKET_NS/1e3,
+        help="bucket width of the finest level in us (default %(default)g)")
+    parser.add_argument("-f", "--factor", type=int, default=runqlen_heatmap.FACTOR,
+        help="bucket width ratio of consecutive levels (default %(default)d)")
+    parser.add_argument("-w", "--tile-width", type=int, default=runqlen_heatmap.TILE_WIDTH,
+        help="buckets per tile (default %(default)d)")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+        help="building processes (default: one per CPU)")
+    parser.add_argument("--vmax", type=int, default=None,
+        help="run queue length of the top color (default: the max of the trace)")
+    parser.add_argument("-c", "--cpus", type=parse_cpulist, default=None,
+        help="cpulist of the rows, e.g. 0-7 (default: the CPUs of the trace)")
+    parser.add_argument("--window", nargs=2, type=float, metavar=("START_MS", "END_MS"),
+        help="list the tiles of a window of an output directory, in ms from the trace start")
+    parser.add_argument("--width", type=int, default=1024,
+        help="minimum buckets across the window (default %(default)d)")
+    parser.add_argument("--stat", choices=runqlen_heatmap.STATS, default='mean')
+    args = parser.parse_args()
+
+    if args.window:
+        index = runqlen_heatmap.load_index(args.trace)
+        level, tiles = runqlen_heatmap.window_tiles(index, int(args.window[0]*1e6),
+                int(args.window[1]*1e6), args.width, args.stat)
+        json.dump({'level': level, 'bucket_ns': index['levels'][level]['bucket_ns'],
+            'tiles': [{'path': path, 'columns': [first, end]} for path, first, end in tiles]},
+            sys.stdout, indent=1)
+        print()
+        return
+
+    if args.factor < 2:
+        parser.error("the factor must be at least 2")
+    series = read_series(args.trace, args.cpus)
+    if len(series) == 0:
+        parser.error("%s has no nr_running updates" % args.trace)
+    pyramid = runqlen_heatmap.HeatmapPyramid(series, args.output, max(int(args.bucket_us*1e3), 1),
+            args.factor, args.tile_width, args.vmax)
+    index = pyramid.build(args.jobs)
+    print("%d updates of %d CPUs over %.3f ms: %d levels, %d tiles written to %s" % (len(series),
+        len(series.cpus), index['duration_ns']/1e6, len(index['levels']), pyramid.nr_written*len(index['stats']),
+        args.output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Multi-resolution heatmap of the run queue length of every CPU over time,
+# as a pyramid of PNG tiles with a JSON index, viewable offline.
+#
+# The input is the nr_running step function of every CPU, from
+# sched_update_nr_running events or from a nrstatss.py -o trace. Level 0
+# aggregates it into buckets of BASE_BUCKET_NS; every level above has
+# buckets FACTOR times wider, up to a level whose single tile covers the
+# whole trace. A tile is TILE_WIDTH buckets wide, with one row per CPU, and
+# is drawn twice: with the time weighted mean and with the max run queue
+# length of every bucket.
+#
+# Level 0 tiles are computed from the step functions directly: means from
+# their integral at the bucket edges, maxima with np.maximum.reduceat over
+# the steps within each bucket. A tile of level L+1 is reduced with
+# np.add.reduceat/np.maximum.reduceat from the FACTOR tiles of level L it
+# covers, built depth first, so that memory stays at a few tiles per level
+# whatever the trace length. Subtrees can be built by a pool of processes.
+# Zooming into a window then only reads the tiles of the level whose bucket
+# fits the window, see window_tiles().
+#
+# Tiles are written by a small PNG encoder, without image libraries.
+#
+# Buckets after the end of the trace are transparent.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import json
+import multiprocessing
+import os
+import struct
+import zlib
+
+import numpy as np
+
+# default tunables
+BASE_BUCKET_NS = 10*(10**3)
+FACTOR = 4
+TILE_WIDTH = 512
+INDEX_VERSION = 1
+STATS = ('mean', 'max')
+# colormap anchors, from run queue length 0 to vmax
+COLORMAP = np.array([(0, 0, 4), (87, 16, 110), (188, 55, 84), (249, 142, 9), (252, 255, 164)],
+        dtype=np.float64)
+# tiles are mostly noise to deflate, favour speed
+PNG_COMPRESSION = 1
+# subtrees per process when building in parallel
+SUBTREES_PER_JOB = 4
+# RGBA of 255 steps from 0 to vmax, then of NaN
+PALETTE = np.zeros((257, 4), dtype=np.uint8)
+for channel in range(3):
+    PALETTE[:256, channel] = np.interp(np.linspace(0, len(COLORMAP) - 1, 256),
+            np.arange(len(COLORMAP)), COLORMAP[:, channel]).round()
+PALETTE[:256, 3] = 255
+
+def write_png(path, rgba):
+    '''
+    Write a height x width x 4 uint8 array as an RGBA PNG
+    '''
+    height, width = rgba.shape[:2]
+    # filter type 0 (None) in front of every row
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8),
+            rgba.reshape(height, width*4)], axis=1).tobytes()
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + \
+                struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    with open(path, 'wb') as fd:
+        fd.write(b'\x89PNG\r\n\x1a\n' +
+                chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)) +
+                chunk(b'IDAT', zlib.compress(raw, PNG_COMPRESSION)) + chunk(b'IEND', b''))
+
+def colorize(values, vmax):
+    '''
+    RGBA of values scaled to [0, vmax] on COLORMAP, NaN being transparent
+    '''
+    with np.errstate(invalid='ignore'):
+        steps = np.clip(values*(255.0/max(vmax, 1)), 0, 255).round()
+    return PALETTE[np.where(np.isnan(values), 256, steps).astype(np.intp)]
+
+
+class RunqlenSeries:
+    '''
+    nr_running step functions of CPUs: nr_running[i] from ts[i] on cpu[i],
+    0 before the first step of a CPU
+    '''
+    def __init__(self, cpu, ts, nr_running, cpus=None):
+        cpu = np.asarray(cpu, dtype=np.int64)
+        ts = np.asarray(ts, dtype=np.int64)
+        nr_running = np.asarray(nr_running, dtype=np.int64)
+        self.cpus = sorted(set(cpu.tolist())) if cpus is None else list(cpus)
+        self.t0 = int(ts.min()) if len(ts) else 0
+        self.t_end = int(ts.max()) + 1 if len(ts) else 1
+        row = np.full(max(self.cpus + cpu.tolist() + [0]) + 1, -1, dtype=np.int64)
+        row[self.cpus] = np.arange(len(self.cpus))
+        row = row[cpu]
+        keep = row >= 0
+        row, rel, nr_running = row[keep], ts[keep] - self.t0, nr_running[keep]
+
+        # a step of 0 at rel -1 opens every row, and one more step closes
+        # the last row for reduceat
+        nr_rows = len(self.cpus)
+        row = np.concatenate([np.arange(nr_rows), row, [nr_rows]])
+        rel = np.concatenate([np.full(nr_rows, -1), rel, [-1]])
+        nr_running = np.concatenate([np.zeros(nr_rows, dtype=np.int64), nr_running, [0]])
+        order = np.lexsort((rel, row))
+        self.rel = rel[order]
+        self.value = nr_running[order]
+        self.stride = self.t_end - self.t0 + 2
+        self.keys = np.asarray(row[order], dtype=np.int64)*self.stride + self.rel + 1
+
+        # integral of the step function of a row from rel -1 to each step
+        dt = np.diff(self.rel)
+        same_row = np.diff(row[order]) == 0
+        area = np.where(same_row, self.value[:-1]*dt, 0).astype(np.float64)
+        self.integral = np.zeros(len(self.rel))
+        self.integral[1:] = np.cumsum(area)
+        # the cumsum runs across rows, buckets() subtracts it at the opening
+        # step of each row
+        row_start = np.searchsorted(self.keys, np.arange(nr_rows)*self.stride)
+        self.row_base = self.integral[row_start]
+
+    def __len__(self):
+        return len(self.rel) - len(self.cpus) - 1
+
+    def max_value(self):
+        return int(self.value.max()) if len(self.value) else 0
+
+    def buckets(self, start, bucket_ns, count):
+        '''
+        (mean, max) len(cpus) x count float arrays of the buckets
+        [start + i*bucket_ns, start + (i+1)*bucket_ns), start being relative
+        to t0. Buckets from the end of the trace on are NaN.
+        '''
+        nr_rows = len(self.cpus)
+        edges = start + bucket_ns*np.arange(count + 1, dtype=np.int64)
+        # edges past the last step are clamped within their row
+        queries = np.arange(nr_rows, dtype=np.int64)[:, None]*self.stride + \
+                np.minimum(edges, self.stride - 2)[None, :] + 1
+        # last step at or before every edge, in effect from it on
+        at = np.searchsorted(self.keys, queries, side='right') - 1
+        row_base = self.row_base[:, None]
+        # the last step holds until the end of the last bucket
+        area = self.integral[at] - row_base + self.value[at]*(edges[None, :] - self.rel[at])
+        mean = np.diff(area, axis=1)/float(bucket_ns)
+
+        # steps of a bucket: from the first one at its start, or else the one
+        # in effect at its start, up to the first one at or after its end,
+        # reduced over alternate index pairs
+        first = np.searchsorted(self.keys, queries, side='left')
+        first = np.where(self.keys[first] == queries, first, first - 1)
+        pairs = np.empty((nr_rows, count*2), dtype=np.int64)
+        pairs[:, 0::2] = first[:, :-1]
+        pairs[:, 1::2] = first[:, 1:] + (self.keys[first[:, 1:]] != queries[:, 1:])
+        maximum = np.maximum.reduceat(self.value, pairs.ravel())[0::2].reshape(nr_rows, count)
+        maximum = maximum.astype(np.float64)
+
+        past_end = edges[:-1] >= self.t_end - self.t0
+        mean[:, past_end] = np.nan
+        maximum[:, past_end] = np.nan
+        return mean, maximum
+
+
+def reduce_tile(mean, maximum, factor):
+    '''
+    Buckets factor times wider of a (mean, max) tile, ignoring NaN buckets
+    '''
+    starts = np.arange(0, mean.shape[1], factor)
+    valid = ~np.isnan(mean)
+    counts = np.add.reduceat(valid, starts, axis=1)
+    sums = np.add.reduceat(np.where(valid, mean, 0), starts, axis=1)
+    maxima = np.maximum.reduceat(np.where(valid, maximum, -np.inf), starts, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums/counts, np.nan), np.where(counts > 0, maxima, np.nan)
+
+
+class HeatmapPyramid:
+    '''
+    Builds the tiles and index of a RunqlenSeries into out_dir
+    '''
+    def __init__(self, series, out_dir, base_bucket_ns=BASE_BUCKET_NS, factor=FACTOR,
+            tile_width=TILE_WIDTH, vmax=None):
+        self.series = series
+        self.out_dir = out_dir
+        self.base_bucket_ns = base_bucket_ns
+        self.factor = factor
+        self.tile_width = tile_width
+        self.vmax = vmax if vmax is not None else max(series.max_value(), 1)
+        duration = series.t_end - series.t0
+        self.nr_levels = 1
+        while self.tile_ns(self.nr_levels - 1) < duration:
+            self.nr_levels += 1
+        self.nr_tiles = [-(-duration//self.tile_ns(level)) for level in range(self.nr_levels)]
+        self.nr_written = 0
+        # (mean, max) of tiles built by other processes
+        self.done = {}
+
+    def bucket_ns(self, level):
+        return self.base_bucket_ns*self.factor**level
+
+    def tile_ns(self, level):
+        return self.bucket_ns(level)*self.tile_width
+
+    def tile_path(self, stat, level, tile):
+        return os.path.join(stat, str(level), "%d.png" % tile)
+
+    def tile(self, level, tile):
+        '''
+        (mean, max) of a tile, written out with the tiles below it
+        '''
+        if (level, tile) in self.done:
+            return self.done.pop((level, tile))
+        if level == 0:
+            mean, maximum = self.series.buckets(tile*self.tile_ns(0), self.bucket_ns(0), self.tile_width)
+        else:
+            children = [self.tile(level - 1, child) for child in
+                    range(tile*self.factor, min((tile + 1)*self.factor, self.nr_tiles[level - 1]))]
+            width = self.tile_width*self.factor
+            mean = np.full((len(self.series.cpus), width), np.nan)
+            maximum = np.full((len(self.series.cpus), width), np.nan)
+            for i, (child_mean, child_max) in enumerate(children):
+                mean[:, i*self.tile_width:(i + 1)*self.tile_width] = child_mean
+                maximum[:, i*self.tile_width:(i + 1)*self.tile_width] = child_max
+            mean, maximum = reduce_tile(mean, maximum, self.factor)
+        for stat, values in zip(STATS, (mean, maximum)):
+            write_png(os.path.join(self.out_dir, self.tile_path(stat, level, tile)),
+                    colorize(values, self.vmax))
+        self.nr_written += 1
+        return mean, maximum
+
+    def build(self, jobs=1):
+        '''
+        Write the tiles and index.json. With jobs > 1, the subtrees of the
+        highest level with SUBTREES_PER_JOB tiles per job are built by as
+        many processes, and the levels above them by this one.
+        '''
+        global pyramid
+        for stat in STATS:
+            for level in range(self.nr_levels):
+                directory = os.path.join(self.out_dir, stat, str(level))
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+        top = self.nr_levels - 1
+        split = [level for level in range(top) if self.nr_tiles[level] >= jobs*SUBTREES_PER_JOB]
+        if jobs > 1 and split:
+            work = [(split[-1], tile) for tile in range(self.nr_tiles[split[-1]])]
+            # shared with the workers by fork
+            pyramid = self
+            pool = multiprocessing.Pool(jobs)
+            for (level, tile), (mean, maximum, nr_written) in zip(work,
+                    pool.imap(build_subtree, work)):
+                self.done[(level, tile)] = mean, maximum
+                self.nr_written += nr_written
+            pool.close()
+            pool.join()
+            pyramid = None
+        for tile in range(self.nr_tiles[top]):
+            self.tile(top, tile)
+        index = self.index()
+        with open(os.path.join(self.out_dir, 'index.json'), 'w') as fd:
+            json.dump(index, fd, indent=1)
+        return index
+
+    def index(self):
+        return {
+            'version': INDEX_VERSION,
+            'cpus': self.series.cpus,
+            't0_ns': self.series.t0,
+            'duration_ns': self.series.t_end - self.series.t0,
+            'tile_width': self.tile_width,
+            'factor': self.factor,
+            'vmax': self.vmax,
+            'colormap': COLORMAP.astype(int).tolist(),
+            'stats': list(STATS),
+            'path': os.path.join('{stat}', '{level}', '{tile}.png'),
+            'levels': [{'level': level, 'bucket_ns': self.bucket_ns(level),
+                'tile_ns': self.tile_ns(level), 'tiles': self.nr_tiles[level]}
+                for level in range(self.nr_levels)],
+        }
+
+
+# set by HeatmapPyramid.build() before its pool forks
+pyramid = None
+
+def build_subtree(work):
+    level, tile = work
+    pyramid.nr_written = 0
+    mean, maximum = pyramid.tile(level, tile)
+    return mean, maximum, pyramid.nr_written
+
+def load_index(out_dir):
+    with open(os.path.join(out_dir, 'index.json')) as fd:
+        return json.load(fd)
+
+def window_tiles(index, start_ns, end_ns, width=1024, stat='mean'):
+    '''
+    Tiles showing [start_ns, end_ns) (relative to t0_ns) in at least width
+    buckets, from the coarsest such level: (level, [(path, first bucket,
+    end bucket)]), the buckets being the columns of each tile in the window
+    '''
+    span = max(end_ns - start_ns, 1)
+    levels = index['levels']
+    level = levels[0]
+    for candidate in levels:
+        if span//candidate['bucket_ns'] >= width:
+            level = candidate
+    tiles = []
+    first = max(start_ns, 0)//level['tile_ns']
+    last = min((end_ns - 1)//level['tile_ns'], level['tiles'] - 1)
+    for tile in range(first, last + 1):
+        tile_start = tile*level['tile_ns']
+        columns = (max(start_ns - tile_start, 0)//level['bucket_ns'],
+                min(-(-(end_ns - tile_start)//level['bucket_ns']), index['tile_width']))
+        tiles.append((index['path'].format(stat=stat, level=level['level'], tile=tile),) + columns)
+    return level['level'], tiles
@@ -0,0 +1,45 @@
+#!/usr/bin/python
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Save the CPU topology of this machine, to analyze its traces elsewhere:
+# ./save-topology.py topology.json
+# ./sched-replay.py --topology topology.json trace.txt
+#
+# Without a file, the topology is only printed (and cached, see
+# topology_snapshot.py).
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import argparse
+
+import topology_snapshot
+from topology_snapshot import mask_to_cpulist
+
+def print_topology(topology):
+    print("CPUs online =", len(mask_to_cpulist(topology.online_mask)),
+            "present =", len(mask_to_cpulist(topology.present_mask)),
+            "possible =", len(mask_to_cpulist(topology.possible_mask)))
+    for level in topology_snapshot.LEVELS:
+        groups = sorted(set(mask for mask in topology.masks[level] if mask))
+        sizes = sorted(set(bin(mask).count('1') for mask in groups))
+        print("%-5s %5d groups of %s CPUs" % (level, len(groups), "/".join(str(size) for size in sizes)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Save the CPU topology of this machine")
+    parser.add_argument("output", nargs="?", help="snapshot file to write")
+    parser.add_argument("--sysfs", default=topology_snapshot.SYSFS,
+        help="sysfs mount point (default %s)" % topology_snapshot.SYSFS)
+    args = parser.parse_args()
+
+    if args.sysfs == topology_snapshot.SYSFS:
+        topology = topology_snapshot.cached()
+    else:
+        topology = topology_snapshot.Topology.from_sysfs(args.sysfs)
+    print_topology(topology)
+    if args.output:
+        topology.save(args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# Licensed under the terms of the GNU GPL License version 2
+# See the perf-script-python Documentation for the list of available functions.
+#
+# Run several sched analyzers over one decode of the trace. Each event is
+# decoded once and handed to every selected analyzer plugin (see
+# analyzers.py for the list).
+#
+# perf record -e sched:sched_wakeup,sched:sched_switch,sched:sched_waking,sched:sched_migrate_task,sched:sched_update_nr_running,sched:sched_process_exit,power:cpu_idle -aR
+# perf script -s sched-analyze.py -- -a sched-test,oddeven,runqlen --nr-cpus 80
+#
+# It can also run without perf on a text dump of the trace:
+# perf script --ns -F comm,pid,cpu,time,event,trace > trace.txt
+# ./sched-analyze.py trace.txt -a latency,runqlen
+#
+# or on a trace file written by sched-convert.py, optionally limited to a
+# time range which is seeked to directly:
+# ./sched-analyze.py trace.sched --start 1234.5 --end 1240 -a latency
+#
+# or directly on the perf.data file, without perf installed:
+# ./sched-analyze.py perf.data -a sched-test,runqlen
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+if 'PERF_EXEC_PATH' in os.environ:
+    sys.path.append(os.environ['PERF_EXEC_PATH'] + \
+        '/scripts/python/Perf-Trace-Util/lib/Perf/Trace')
+
+    from perf_trace_context import *
+    from Core import *
+
+import analyzers
+from event_store import ktime_ns
+
+dispatcher = None
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run sched analyzers in a single pass")
+    parser.add_argument("trace", nargs="?", help="analyze this perf.data file, `perf script --ns` "
+        "text dump or sched-convert.py trace file instead of running under perf")
+    parser.add_argument("--trace", dest="trace_option", metavar="TRACE", help="same as trace")
+    parser.add_argument("--start", type=float, help="skip events before this time (in sec) of --trace")
+    parser.add_argument("--end", type=float, help="skip events from this time (in sec) of --trace")
+    analyzers.add_arguments(parser)
+    args, unknown = parser.parse_known_args(argv)
+    args.trace = args.trace or args.trace_option
+    return args
+
+def trace_begin():
+    global dispatcher
+    args = parse_args(sys.argv[1:])
+    dispatcher = analyzers.Dispatcher(analyzers.create(args))
+
+def trace_end():
+    dispatcher.report()
+
+
+def sched__sched_waking(event_name, context, common_cpu,
+        common_secs, common_nsecs, common_pid, common_comm,
+        common_callchain, comm, pid, prio, success,
+        target_cpu, perf_sample_dict):
+    dispatcher.dispatch('sched_waking', ktime_ns(common_secs, common_nsecs), common_cpu,
+            dict(common_pid=common_pid, common_comm=common_comm, comm=comm, pid=pid,
+                prio=prio, target_cpu=target_cpu))
+
+def sched__sched_wakeup(event_name, context, common_cpu,
+        common_secs, common_nsecs, common_pid, common_comm,
+        common_callchain, comm, pid, prio, success,
+        target_cpu, perf_sample_dict):
+    dispatcher.dispatch('sched_wakeup', ktime_ns(common_secs, common_nsecs), common_cpu,
+            dict(common_pid=common_pid, common_comm=common_comm, comm=comm, pid=pid,
+                prio=prio, target_cpu=target_cpu))
+
+def sched__sched_switch(event_name, context, common_cpu,
+        common_secs, common_nsecs, common_pid, common_comm,
+        common_callchain, prev_comm, prev_pid, prev_prio, prev_state,
+        next_comm, next_pid, next_prio, perf_sample_dict):
+    dispatcher.dispatch('sched_switch', ktime_ns(common_secs, common_nsecs), common_cpu,
+            dict(common_pid=common_pid, common_comm=common_comm, prev_comm=prev_comm,
+                prev_pid=prev_pid, prev_prio=prev_prio, prev_state=prev_state,
+                next_comm=next_comm, next_pid=next_pid, next_prio=next_prio))
+
+def sched__sched_migrate_task(event_name, context, common_cpu,
+        common_secs, common_nsecs, common_pid, common_comm,
+        common_callchain, comm, pid, prio, orig_cpu,
+        dest_cpu, perf_sample_dict):
+    dispatcher.dispatch('sched_migrate_task', ktime_ns(common_secs, common_nsecs), common_cpu,
+            dict(common_pid=common_pid, common_comm=common_comm, comm=comm, pid=pid,
+                prio=prio, orig_cpu=orig_cpu, dest_cpu=dest_cpu))
+
+def sched__sched_process_exit(event_name, context, common_cpu,
+        common_secs, common_nsecs, common_pid, common_comm,
+        common_callchain, comm, pid, prio, *args):
+    # *args: group_dead on newer kernels, and perf_sample_dict
+    dispatcher.dispatch('sched_process_exit', ktime_ns(common_secs, common_nsecs), common_cpu,
+            dict(common_pid=common_pid, common_comm=common_comm, comm=comm, pid=pid,
+                prio=prio))
+
+def power__cpu_idle(event_name, context, common_cpu,
+        common_secs, common_nsecs, common_pid, common_comm,
+        common_callchain, state, cpu_id, perf_sample_dict):
+    dispatcher.dispatch('cpu_idle', ktime_ns(common_secs, common_nsecs), common_cpu,
+            dict(common_pid=common_pid, common_comm=common_comm, state=state, cpu_id=cpu_id))
+
+def sched__sched_update_nr_running(event_name, context, common_cpu,
+        common_secs, common_nsecs, common_pid, common_comm,
+        common_callchain, cpu, change, nr_running, perf_sample_dict):
+    dispatcher.dispatch('sched_update_nr_running', ktime_ns(common_secs, common_nsecs), common_cpu,
+            dict(common_pid=common_pid, common_comm=common_comm, cpu=cpu, change=change,
+                nr_running=nr_running))
+
+def trace_unhandled(event_name, context, event_fields_dict, perf_sample_dict):
+    pass
+
+
+if __name__ == '__main__' and 'PERF_EXEC_PATH' not in os.environ:
+    import perf_data_reader
+    import perf_script_reader
+    import trace_store
+
+    args = parse_args(sys.argv[1:])
+    if args.trace is None:
+        print("a trace is needed when not running under perf script", file=sys.stderr)
+        sys.exit(1)
+    start_ts = None if args.start is None else int(round(args.start*(10**9)))
+    end_ts = None if args.end is None else int(round(args.end*(10**9)))
+
+    dispatcher = analyzers.Dispatcher(analyzers.create(args))
+    if trace_store.is_trace_file(args.trace):
+        trace = trace_store.TraceFile(args.trace)
+        events = trace.events(*trace.time_range(start_ts, end_ts))
+    elif perf_data_reader.is_perf_data(args.trace):
+        trace = perf_data_reader.PerfData(args.trace)
+        events = trace.events(*trace.time_range(start_ts, end_ts))
+    else:
+        events = perf_script_reader.read_events(args.trace)
+    for ts, event_name, common_cpu, fields in events:
+        if start_ts is not None and ts < start_ts:
+            continue
+        if end_ts is not None and ts >= end_ts:
+            break
+        dispatcher.dispatch(event_name, ts, common_cpu, fields)
+    dispatcher.report()
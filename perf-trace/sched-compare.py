@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# Licensed under the terms of the GNU GPL License version 2
+#
+# A/B comparison of sched-test.py results on traces of two or more kernels.
+#
+# Record the same benchmark on the baseline and the patched kernels as for
+# sched-test.py, then compare the traces to the first one:
+# ./sched-compare.py baseline.data patched.data
+#
+# Every trace can be a perf.data file, a `perf script --ns` text dump or a
+# sched-convert.py trace file, and is analyzed in its own process. Deltas of
+# accuracy, SMT mode at wakeup, wake affine pulls and latency percentiles are
+# reported with bootstrap confidence intervals, see wakeup_comparison.py.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import argparse
+import io
+import multiprocessing
+
+import perf_data_reader
+import perf_script_reader
+import trace_store
+import wakeup_analysis
+import wakeup_comparison
+from schedstat_parser import parse_cpulist
+
+def trace_reader(path):
+    if trace_store.is_trace_file(path):
+        return trace_store
+    if perf_data_reader.is_perf_data(path):
+        return perf_data_reader
+    return perf_script_reader
+
+def analyze_trace(work):
+    path, config = work
+    analyzer = wakeup_analysis.WakeupAnalyzer(out=io.StringIO(), **config)
+    handlers = dict((name, getattr(analyzer, name)) for name in wakeup_analysis.EVENTS)
+    for ts, event_name, common_cpu, fields in trace_reader(path).read_events(path):
+        if event_name in handlers:
+            handlers[event_name](ts, common_cpu, **fields)
+    return analyzer.finish()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare sched-test.py results of traces to the first one")
+    parser.add_argument("traces", nargs="+", help="baseline trace followed by the traces to compare, "
+        "each a perf.data file, `perf script --ns` text dump or sched-convert.py trace file")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+        help="number of worker processes (default: one per trace)")
+    parser.add_argument("--nr-cpus", type=int, default=wakeup_analysis.NR_CPUS)
+    parser.add_argument("--wakeup-scope-size", type=int, default=wakeup_analysis.WAKEUP_SCOPE_SIZE)
+    parser.add_argument("--offline-cpus", type=parse_cpulist, default=wakeup_analysis.OFFLINE_CPUS,
+        help="cpulist of offline CPUs, e.g. 40-79")
+    parser.add_argument("--whitelist-tasks", default="",
+        help="comma separated comms to analyze exclusively")
+    parser.add_argument("-P", "--percentiles", default=",".join(str(p) for p in wakeup_comparison.LATENCY_PERCENTILES),
+        help="comma separated latency percentiles to compare")
+    parser.add_argument("--relative-error", type=float, default=wakeup_analysis.LATENCY_RELATIVE_ERROR,
+        help="error bound of the latency percentiles")
+    parser.add_argument("--pending-ttl-us", type=int, default=wakeup_analysis.PENDING_WAKEUP_TTL_US,
+        help="drop wakeups not switched in within this many usec, 0 to keep them")
+    parser.add_argument("-B", "--resamples", type=int, default=wakeup_comparison.BOOTSTRAP_RESAMPLES,
+        help="bootstrap resamples of every metric")
+    parser.add_argument("--confidence", type=float, default=wakeup_comparison.CONFIDENCE,
+        help="%% confidence of the reported intervals")
+    parser.add_argument("--seed", type=int, default=None,
+        help="seed of the bootstrap resampling, for reproducible intervals")
+    parser.add_argument("--topology",
+        help="topology saved by save-topology.py on the traced machine (default: this machine)")
+    parser.add_argument("--no-topology", action="store_true",
+        help="don't read the topology of this machine")
+    args = parser.parse_args()
+    if len(args.traces) < 2:
+        parser.error("at least two traces are needed")
+
+    cpu_topology = None
+    if args.topology:
+        import schedstat_parser
+        cpu_topology = schedstat_parser.CpuTopology(args.topology)
+    elif not args.no_topology:
+        import schedstat_parser
+        try:
+            cpu_topology = schedstat_parser.CpuTopology()
+        except:
+            pass
+
+    config = dict(cpu_topology=cpu_topology, nr_cpus=args.nr_cpus,
+            wakeup_scope_size=args.wakeup_scope_size, verbose_level=0,
+            offline_cpus=args.offline_cpus,
+            whitelist_tasks=[i for i in args.whitelist_tasks.split(',') if i],
+            latency_relative_error=args.relative_error, pending_ttl_us=args.pending_ttl_us,
+            top_k=0)
+
+    pool = multiprocessing.Pool(args.jobs or len(args.traces))
+    summaries = pool.map(analyze_trace, [(path, config) for path in args.traces])
+    pool.close()
+    pool.join()
+
+    wakeup_comparison.report(args.traces, summaries,
+            [float(p) if '.' in p else int(p) for p in args.percentiles.split(',')],
+            resamples=args.resamples, confidence=args.confidence, seed=args.seed)
+
+if __name__ == '__main__':
+    main()
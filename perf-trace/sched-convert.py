@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Convert sched/power events of a capture once into the binary trace format
+# of trace_store.py, which sched-analyze.py and sched-replay.py can mmap
+# instead of going through perf script for every analysis.
+#
+# perf record -e sched:sched_wakeup,sched:sched_switch,sched:sched_waking,sched:sched_migrate_task,sched:sched_update_nr_running,sched:sched_process_exit,power:cpu_idle -aR
+# perf script -s sched-convert.py -- -o trace.sched
+#
+# or from a text dump of the trace:
+# perf script --ns -F comm,pid,cpu,time,event,trace > trace.txt
+# ./sched-convert.py --trace trace.txt -o trace.sched
+#
+# or from the perf.data file, without perf installed:
+# ./sched-convert.py --trace perf.data -o trace.sched
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+if 'PERF_EXEC_PATH' in os.environ:
+    sys.path.append(os.environ['PERF_EXEC_PATH'] + \
+        '/scripts/python/Perf-Trace-Util/lib/Perf/Trace')
+
+    from perf_trace_context import *
+    from Core import *
+
+from event_store import ktime_ns
+import trace_store
+
+writer = None
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Convert sched events to the binary trace format")
+    parser.add_argument("--trace", help="convert this perf.data file or `perf script --ns` text dump "
+        "instead of running under perf")
+    parser.add_argument("-o", "--output", default="trace.sched", help="trace file to write (default: trace.sched)")
+    args, unknown = parser.parse_known_args(argv)
+    return args
+
+def trace_begin():
+    global writer
+    writer = trace_store.TraceWriter(parse_args(sys.argv[1:]).output)
+
+def trace_end():
+    writer.close()
+    print("Wrote", writer.nr_events, "events to", writer.path)
+
+
+def sched__sched_waking(event_name, context, common_cpu,
+        common_secs, common_nsecs, common_pid, common_comm,
+        common_callchain, comm, pid, prio, success,
+        target_cpu, perf_sample_dict):
+    writer.write('sched_waking', ktime_ns(common_secs, common_nsecs), common_cpu,
+            dict(common_pid=common_pid, common_comm=common_comm, comm=comm, pid=pid,
+                prio=prio, target_cpu=target_cpu))
+
+def sched__sched_wakeup(event_name, context, common_cpu,
+        common_secs, common_nsecs, common_pid, common_comm,
+        common_callchain, comm, pid, prio, success,
+        target_cpu, perf_sample_dict):
+    writer.write('sched_wakeup', ktime_ns(common_secs, common_nsecs), common_cpu,
+            dict(common_pid=common_pid, common_comm=common_comm, comm=comm, pid=pid,
+                prio=prio, target_cpu=target_cpu))
+
+def sched__sched_switch(event_name, context, common_cpu,
+        common_secs, common_nsecs, common_pid, common_comm,
+        common_callchain, prev_comm, prev_pid, prev_prio, prev_state,
+        next_comm, next_pid, next_prio, perf_sample_dict):
+    writer.write('sched_switch', ktime_ns(common_secs, common_nsecs), common_cpu,
+            dict(common_pid=common_pid, common_comm=common_comm, prev_comm=prev_comm,
+                prev_pid=prev_pid, prev_prio=prev_prio, prev_state=prev_state,
+                next_comm=next_comm, next_pid=next_pid, next_prio=next_prio))
+
+def sched__sched_migrate_task(event_name, context, common_cpu,
+        common_secs, common_nsecs, common_pid, common_comm,
+        common_callchain, comm, pid, prio, orig_cpu,
+        dest_cpu, perf_sample_dict):
+    writer.write('sched_migrate_task', ktime_ns(common_secs, common_nsecs), common_cpu,
+            dict(common_pid=common_pid, common_comm=common_comm, comm=comm, pid=pid,
+                prio=prio, orig_cpu=orig_cpu, dest_cpu=dest_cpu))
+
+def sched__sched_process_exit(event_name, context, common_cpu,
+        common_secs, common_nsecs, common_pid, common_comm,
+        common_callchain, comm, pid, prio, *args):
+    # *args: group_dead on newer kernels, and perf_sample_dict
+    writer.write('sched_process_exit', ktime_ns(common_secs, common_nsecs), common_cpu,
+            dict(common_pid=common_pid, common_comm=common_comm, comm=comm, pid=pid,
+                prio=prio))
+
+def power__cpu_idle(event_name, context, common_cpu,
+        common_secs, common_nsecs, common_pid, common_comm,
+        common_callchain, state, cpu_id, perf_sample_dict):
+    writer.write('cpu_idle', ktime_ns(common_secs, common_nsecs), common_cpu,
+            dict(common_pid=common_pid, common_comm=common_comm, state=state, cpu_id=cpu_id))
+
+def sched__sched_update_nr_running(event_name, context, common_cpu,
+        common_secs, common_nsecs, common_pid, common_comm,
+        common_callchain, cpu, change, nr_running, perf_sample_dict):
+    writer.write('sched_update_nr_running', ktime_ns(common_secs, common_nsecs), common_cpu,
+            dict(common_pid=common_pid, common_comm=common_comm, cpu=cpu, change=change,
+                nr_running=nr_running))
+
+def trace_unhandled(event_name, context, event_fields_dict, perf_sample_dict):
+    pass
+
+
+if __name__ == '__main__' and 'PERF_EXEC_PATH' not in os.environ:
+    import perf_data_reader
+    import perf_script_reader
+
+    args = parse_args(sys.argv[1:])
+    if args.trace is None:
+        print("--trace is needed when not running under perf script", file=sys.stderr)
+        sys.exit(1)
+    reader = perf_data_reader if perf_data_reader.is_perf_data(args.trace) else perf_script_reader
+    writer = trace_store.TraceWriter(args.output)
+    for ts, event_name, common_cpu, fields in reader.read_events(args.trace):
+        writer.write(event_name, ts, common_cpu, fields)
+    trace_end()
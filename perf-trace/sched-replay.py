@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Parallel offline replay of sched-test.py on a text dump of perf.data.
+#
+# perf record -e sched:sched_wakeup,sched:sched_wakeup_new,sched:sched_switch,sched:sched_waking,sched:sched_migrate_task,sched:sched_update_nr_running,sched:sched_process_exit -aR
+# perf script --ns -F comm,pid,cpu,time,event,trace > trace.txt
+# ./sched-replay.py -j 64 trace.txt
+#
+# A trace file written by sched-convert.py can be given in place of the text
+# dump, its shards are then mmapped instead of parsed. So can the perf.data
+# file itself, which every worker indexes before decoding its shard.
+#
+# The dump is split into time shards which are analyzed in a process pool:
+# 1. every shard is scanned for the runqueue lengths and pending wakeups it
+#    leaves behind,
+# 2. those are chained to find the state each shard starts from,
+# 3. every shard is analyzed from its starting state.
+# Per-shard counters and latency sketches are then merged into the same
+# report as the sequential trace_end of sched-test.py.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import argparse
+import io
+import multiprocessing
+import os
+
+import perf_data_reader
+import perf_script_reader
+import trace_store
+import wakeup_analysis
+from schedstat_parser import parse_cpulist
+
+def trace_reader(path):
+    if trace_store.is_trace_file(path):
+        return trace_store
+    if perf_data_reader.is_perf_data(path):
+        return perf_data_reader
+    return perf_script_reader
+
+def scan_shard(shard):
+    path, start, end, pending_ttl_us = shard
+    return wakeup_analysis.scan_boundary(trace_reader(path).read_events(path, start, end),
+            pending_ttl_us)
+
+def analyze_shard(work):
+    path, start, end, pending_ttl_us, state, config = work
+    out = io.StringIO()
+    analyzer = wakeup_analysis.WakeupAnalyzer(out=out, **config)
+    analyzer.set_state(*state)
+    handlers = dict((name, getattr(analyzer, name)) for name in wakeup_analysis.EVENTS)
+    for ts, event_name, common_cpu, fields in trace_reader(path).read_events(path, start, end):
+        if event_name in handlers:
+            handlers[event_name](ts, common_cpu, **fields)
+    return out.getvalue(), analyzer.finish()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay sched-test.py analysis on `perf script` output in parallel")
+    parser.add_argument("trace", help="output of perf script --ns -F comm,pid,cpu,time,event,trace, "
+        "a sched-convert.py trace file or a perf.data file")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+        help="number of worker processes (default: all CPUs)")
+    parser.add_argument("-s", "--shards", type=int, default=None,
+        help="number of time shards (default: jobs)")
+    parser.add_argument("--nr-cpus", type=int, default=wakeup_analysis.NR_CPUS)
+    parser.add_argument("--wakeup-scope-size", type=int, default=wakeup_analysis.WAKEUP_SCOPE_SIZE)
+    parser.add_argument("--latency-threshold-us", type=int, default=wakeup_analysis.LATENCY_THRESHOLD_US)
+    parser.add_argument("-v", "--verbose-level", type=int, default=wakeup_analysis.VERBOSE_LEVEL)
+    parser.add_argument("--offline-cpus", type=parse_cpulist, default=wakeup_analysis.OFFLINE_CPUS,
+        help="cpulist of offline CPUs, e.g. 40-79")
+    parser.add_argument("--whitelist-tasks", default="",
+        help="comma separated comms to analyze exclusively")
+    parser.add_argument("-P", "--percentiles", default=",".join(str(p) for p in wakeup_analysis.LATENCY_PERCENTILES),
+        help="comma separated latency percentiles to report")
+    parser.add_argument("--relative-error", type=float, default=wakeup_analysis.LATENCY_RELATIVE_ERROR,
+        help="error bound of the reported latency percentiles")
+    parser.add_argument("--pending-ttl-us", type=int, default=wakeup_analysis.PENDING_WAKEUP_TTL_US,
+        help="drop wakeups not switched in within this many usec, 0 to keep them")
+    parser.add_argument("--top-k", type=int, default=wakeup_analysis.TOP_K,
+        help="comms/pids listed with the highest scheduling latency, 0 to disable")
+    parser.add_argument("--window-us", type=int, default=wakeup_analysis.WINDOW_US,
+        help="also report latency percentiles over sliding windows of this many usec, 0 to disable")
+    parser.add_argument("--window-step-us", type=int, default=wakeup_analysis.WINDOW_STEP_US,
+        help="usec between the sliding windows")
+    parser.add_argument("-x", "--extended-report", action="store_true",
+        help="also report min/max/mean, the idle core, migration and dropped wakeup sections")
+    parser.add_argument("--topology",
+        help="topology saved by save-topology.py on the traced machine (default: this machine)")
+    parser.add_argument("--no-topology", action="store_true",
+        help="don't read the topology of this machine")
+    args = parser.parse_args()
+
+    cpu_topology = None
+    if args.topology:
+        import schedstat_parser
+        cpu_topology = schedstat_parser.CpuTopology(args.topology)
+    elif not args.no_topology:
+        import schedstat_parser
+        try:
+            cpu_topology = schedstat_parser.CpuTopology()
+        except:
+            pass
+
+    config = dict(cpu_topology=cpu_topology, nr_cpus=args.nr_cpus,
+            wakeup_scope_size=args.wakeup_scope_size,
+            latency_threshold_us=args.latency_threshold_us,
+            verbose_level=args.verbose_level, offline_cpus=args.offline_cpus,
+            whitelist_tasks=[i for i in args.whitelist_tasks.split(',') if i],
+            latency_relative_error=args.relative_error, pending_ttl_us=args.pending_ttl_us,
+            top_k=args.top_k, window_us=args.window_us, window_step_us=args.window_step_us,
+            extended_report=args.extended_report)
+    wakeup_analysis.print_parameters(cpu_topology, nr_cpus=args.nr_cpus,
+            wakeup_scope_size=args.wakeup_scope_size, offline_cpus=args.offline_cpus,
+            latency_relative_error=args.relative_error, extended_report=args.extended_report)
+
+    shards = [(args.trace, start, end, args.pending_ttl_us) for start, end in
+            trace_reader(args.trace).split(args.trace, args.shards or args.jobs)]
+    pool = multiprocessing.Pool(args.jobs)
+    boundaries = pool.map(scan_shard, shards)
+
+    states = [([0 for i in range(args.nr_cpus)], dict())]
+    for boundary in boundaries[:-1]:
+        states.append(wakeup_analysis.chain_state(states[-1], boundary, args.pending_ttl_us))
+
+    work = [shard + (state, config) for shard, state in zip(shards, states)]
+    summary = None
+    for out, shard_summary in pool.imap(analyze_shard, work):
+        print(out, end="")
+        if summary is None:
+            summary = shard_summary
+        else:
+            summary.merge(shard_summary)
+    pool.close()
+    pool.join()
+
+    summary.report([float(p) if '.' in p else int(p) for p in args.percentiles.split(',')])
+
+if __name__ == '__main__':
+    main()
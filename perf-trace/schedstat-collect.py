@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Scheduler telemetry from /proc/schedstat, without perf or BPF.
+#
+# Needs CONFIG_SCHEDSTATS with schedstats enabled:
+# sysctl kernel.sched_schedstats=1
+# ./schedstat-collect.py -f 50 -t 10
+#
+# Every counter of /proc/schedstat is sampled at the given rate (see
+# schedstat_sampler.py), and one line of deltas is printed per interval:
+# run_delay summed over CPUs, with the CPU waiting the most, wakeups and
+# the lb_failed of every sched domain level. -p also prints the run_delay of
+# every CPU and the lb_failed of every domain of every CPU.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import argparse
+
+import schedstat_sampler
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sample /proc/schedstat and print the counter deltas of every interval")
+    parser.add_argument("-f", "--frequency", type=int, default=10,
+        help="samples per second (default 10)")
+    parser.add_argument("-t", "--time", type=float, default=None,
+        help="seconds to sample for (default: until Ctrl-C)")
+    parser.add_argument("-p", "--percpu", default=0, action="store_const", const=1,
+        help="also print the run_delay and lb_failed of every CPU")
+    parser.add_argument("--path", default=schedstat_sampler.SCHEDSTAT_PATH,
+        help="schedstat file to sample (default %s)" % schedstat_sampler.SCHEDSTAT_PATH)
+    args = parser.parse_args()
+
+    sampler = schedstat_sampler.SchedstatSampler(args.path)
+    start = None
+    layout = None
+    try:
+        for ts in sampler.samples(args.frequency, args.time):
+            if sampler.layout is not layout:
+                layout = sampler.layout
+                print("schedstat version", layout.version, "with", len(layout.cpus), "CPUs and domains",
+                        ", ".join(layout.level_names))
+                run_delay = layout.cpu_column('run_delay')
+                ttwu_count = layout.cpu_column('ttwu_count')
+                ttwu_local = layout.cpu_column('ttwu_local')
+                lb_failed = layout.domain_columns('lb_failed')
+            if start is None:
+                start = ts - sampler.delta_ns
+            cpu_delay = sampler.cpu_delta[:, run_delay]
+            busiest = int(cpu_delay.argmax()) if len(cpu_delay) else 0
+            domain_failed = sampler.domain_delta[:, :, lb_failed].sum(axis=2)
+            print("%10.3f run_delay(us) = %d max = %d on cpu%d  ttwu = %d local = %d  lb_failed %s" % (
+                    (ts - start)/(10**9), cpu_delay.sum()//(10**3),
+                    cpu_delay[busiest]//(10**3) if len(cpu_delay) else 0,
+                    layout.cpus[busiest] if layout.cpus else -1,
+                    sampler.cpu_delta[:, ttwu_count].sum(), sampler.cpu_delta[:, ttwu_local].sum(),
+                    " ".join("%s = %d" % (name, failed) for name, failed in
+                        zip(layout.level_names, domain_failed.sum(axis=0).tolist()))))
+            if args.percpu:
+                for i, cpu in enumerate(layout.cpus):
+                    print("\tCPU = %d run_delay(us) = %d lb_failed = %s" % (cpu, cpu_delay[i]//(10**3),
+                            domain_failed[i][layout.domain_valid[i]].tolist()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sampler.close()
+
+if __name__ == '__main__':
+    main()
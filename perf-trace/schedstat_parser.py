@@ -1,45 +1,49 @@
-def cpumask_to_cpulist(cpumask):
-    n = int(cpumask, 16)
-    cpulist = []
-    iterator = 0
-
-    while n!=0:
-        if n%2 == 1:
-            cpulist.append(iterator)
-        n //= 2
-        iterator += 1
+import topology_snapshot
+from topology_snapshot import mask_to_cpulist, parse_cpulist
 
-    return cpulist
+def cpumask_to_cpulist(cpumask):
+    return mask_to_cpulist(int(cpumask, 16))
 
 class CpuTopology:
-    def __init__(self):
-        self.topology = dict()
-        self.get_cpu_topology()
-        self.llc_sd_id = self.get_llc_sd()
+    '''
+    Flat per-CPU topology tables indexed by cpu-id, built once so that
+    topology lookups in event handlers are plain indexing. llc_id/core_id is
+    the first CPU of the LLC/SMT core. Entries are None for CPUs whose
+    topology is unknown, e.g. offline CPUs.
+
+    The tables come from a topology_snapshot.Topology: the cached one of this
+    machine, or the one saved in snapshot_path.
+    '''
+    def __init__(self, snapshot_path=None):
+        self.snapshot = topology_snapshot.load(snapshot_path)
+        self.build_lookup_tables()
 
-    def get_cpu_topology(self):
-        cpuid = -1
-        domain_id = -1
-        for line in open("/proc/schedstat"):
-            if line.startswith("domain"):
-                domain_id = int(line.split()[0][6:])
-                cpumask = line.split()[1]
-                cpumask = "0x"+cpumask
-                cpumask = cpumask.replace(",", "")
-                self.topology[cpuid][domain_id] = cpumask_to_cpulist(cpumask)
-               # print(cpumask, "sdsd", cpumask_to_cpulist(cpumask))
-            if line.startswith("cpu"):
-                cpuid = int(line.split()[0][3:])
-                self.topology[cpuid] = dict()
+    def build_lookup_tables(self):
+        snapshot = self.snapshot
+        self.nr_cpu_ids = snapshot.nr_cpu_ids
+        self.online_mask = snapshot.online_mask
+        self.llc_id = [None for i in range(self.nr_cpu_ids)]
+        self.llc_siblings = [None for i in range(self.nr_cpu_ids)]
+        self.llc_cpumask = [None for i in range(self.nr_cpu_ids)]
+        self.core_id = [None for i in range(self.nr_cpu_ids)]
+        self.smt_siblings = [None for i in range(self.nr_cpu_ids)]
+        self.smt_cpumask = [None for i in range(self.nr_cpu_ids)]
+        self.node_id = list(snapshot.node_id)
 
-    def get_llc_sd(self):
-        import os
-        domain_list = sorted(os.listdir("/proc/sys/kernel/sched_domain/cpu0/"), reverse=True)
-    
-        for domain_id in domain_list:
-            for line in open("/proc/sys/kernel/sched_domain/cpu0/%s/flags"%(domain_id)):
-                if "SD_SHARE_PKG_RESOURCES" in line:
-                    return int(domain_id[6:])
+        # siblings are shared, convert every distinct mask once
+        siblings = dict()
+        for cpu in range(self.nr_cpu_ids):
+            for level, ids, sibling_lists, cpumasks in (
+                    (topology_snapshot.LLC, self.llc_id, self.llc_siblings, self.llc_cpumask),
+                    (topology_snapshot.SMT, self.core_id, self.smt_siblings, self.smt_cpumask)):
+                mask = snapshot.masks[level][cpu]
+                if not mask:
+                    continue
+                if mask not in siblings:
+                    siblings[mask] = tuple(mask_to_cpulist(mask))
+                sibling_lists[cpu] = siblings[mask]
+                ids[cpu] = siblings[mask][0]
+                cpumasks[cpu] = mask
 
     def llc_sibling(self, cpu):
-        return self.topology[cpu][self.llc_sd_id]
+        return list(self.llc_siblings[cpu])
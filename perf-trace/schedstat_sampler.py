@@ -0,0 +1,226 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Sampler of every counter of /proc/schedstat, cheap enough to run at
+# 10-100 Hz where BPF is not allowed.
+#
+# The file is opened once and re-read with os.pread. Every byte but digits is
+# translated to a space, so that NumPy parses the whole file in one call. The
+# positions of the counters among the parsed numbers are found once, from the
+# first read, into a SchedstatLayout. Later reads then only gather the
+# counters into preallocated per-CPU and per-domain arrays. Reads are checked
+# against the layout through the cpu and domain numbers, and the layout is
+# rebuilt when they change, e.g. on CPU hotplug.
+#
+# Field names follow Documentation/scheduler/sched-stats.rst of schedstat
+# versions 15 to 17, other versions get positional names.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import os
+import time
+
+import numpy as np
+
+SCHEDSTAT_PATH = "/proc/schedstat"
+READ_SIZE = 1<<16 # first pread size, doubled until the file fits
+
+CPU_FIELDS = ('yld_count', 'unused', 'sched_count', 'sched_goidle', 'ttwu_count',
+        'ttwu_local', 'rq_cpu_time', 'run_delay', 'pcount')
+
+LB_FIELDS = ('lb_count', 'lb_balanced', 'lb_failed', 'lb_imbalance', 'lb_gained',
+        'lb_hot_gained', 'lb_nobusyq', 'lb_nobusyg')
+# version 17 splits lb_imbalance by its kind
+LB_FIELDS_V17 = ('lb_count', 'lb_balanced', 'lb_failed', 'lb_imbalance_load',
+        'lb_imbalance_util', 'lb_imbalance_task', 'lb_imbalance_misfit', 'lb_gained',
+        'lb_hot_gained', 'lb_nobusyq', 'lb_nobusyg')
+# version 16 swaps the columns of CPU_IDLE and CPU_NOT_IDLE
+IDLE_TYPES = ('idle', 'busy', 'newidle')
+IDLE_TYPES_V16 = ('busy', 'idle', 'newidle')
+DOMAIN_FIELDS = ('alb_count', 'alb_failed', 'alb_pushed', 'sbe_count', 'sbe_balanced',
+        'sbe_pushed', 'sbf_count', 'sbf_balanced', 'sbf_pushed', 'ttwu_wake_remote',
+        'ttwu_move_affine', 'ttwu_move_balance')
+
+# bytes other than digits become separators
+DIGITS = bytes(c if ord('0') <= c <= ord('9') else ord(' ') for c in range(256))
+
+def domain_fields(version):
+    if version == 15:
+        lb_fields, idle_types = LB_FIELDS, IDLE_TYPES
+    elif version == 16:
+        lb_fields, idle_types = LB_FIELDS, IDLE_TYPES_V16
+    elif version == 17:
+        lb_fields, idle_types = LB_FIELDS_V17, IDLE_TYPES_V16
+    else:
+        return None
+    return tuple("%s_%s" % (field, idle) for idle in idle_types for field in lb_fields) + DOMAIN_FIELDS
+
+def field_names(names, nr_fields, prefix):
+    if names is not None and len(names) == nr_fields:
+        return names
+    return tuple("%s%d" % (prefix, i) for i in range(nr_fields))
+
+
+class SchedstatLayout:
+    '''
+    Positions of the counters of a /proc/schedstat read among the numbers
+    parsed from it
+    '''
+    def __init__(self, data):
+        self.version = None
+        self.timestamp_pos = None
+        self.cpus = []
+        # per cpu: (level, name, cpumask) of its domains
+        self.domains = []
+        cpu_pos, domain_pos = [], []
+        label_pos, labels = [], []
+        nr_cpu_fields = nr_domain_fields = 0
+        pos = 0
+        for line in data.decode(errors='replace').splitlines():
+            words = line.split()
+            nr_numbers = len(line.encode().translate(DIGITS).split())
+            if not words:
+                continue
+            if words[0] == 'version':
+                self.version = int(words[1])
+                self.timestamp_pos = None
+            elif words[0] == 'timestamp':
+                self.timestamp_pos = pos
+            elif words[0].startswith('cpu'):
+                self.cpus.append(int(words[0][3:]))
+                self.domains.append([])
+                nr_cpu_fields = len(words) - 1
+                cpu_pos.append(range(pos + nr_numbers - nr_cpu_fields, pos + nr_numbers))
+                domain_pos.append([])
+                label_pos.append(pos)
+                labels.append(self.cpus[-1])
+            elif words[0].startswith('domain') and self.cpus:
+                # domain<N> [<name>] <cpumask> <fields>, names since version 17
+                named = self.version is not None and self.version >= 17
+                name = words[1] if named else words[0]
+                cpumask = words[2] if named else words[1]
+                nr_domain_fields = len(words) - (3 if named else 2)
+                self.domains[-1].append((int(words[0][6:]), name, cpumask))
+                domain_pos[-1].append(range(pos + nr_numbers - nr_domain_fields, pos + nr_numbers))
+                label_pos.append(pos)
+                labels.append(self.domains[-1][-1][0])
+            pos += nr_numbers
+        self.nr_numbers = pos
+        self.label_pos = np.array(label_pos, dtype=np.int64)
+        self.labels = np.array(labels, dtype=np.int64)
+
+        self.cpu_fields = field_names(CPU_FIELDS if self.version in (15, 16, 17) else None,
+                nr_cpu_fields, 'cpu_field')
+        self.domain_fields = field_names(domain_fields(self.version), nr_domain_fields,
+                'domain_field')
+        self.cpu_pos = np.array([list(positions) for positions in cpu_pos],
+                dtype=np.int64).reshape(len(self.cpus), nr_cpu_fields)
+        # CPUs with less domains than others read position 0 and are masked out
+        self.nr_levels = max([len(domains) for domains in self.domains] + [0])
+        self.domain_pos = np.zeros((len(self.cpus), self.nr_levels, nr_domain_fields), dtype=np.int64)
+        self.domain_valid = np.zeros((len(self.cpus), self.nr_levels), dtype=bool)
+        for i, positions in enumerate(domain_pos):
+            for level, level_pos in enumerate(positions):
+                self.domain_pos[i, level] = list(level_pos)
+                self.domain_valid[i, level] = True
+        # domain names of the most complete CPU, e.g. SMT, MC, PKG, NUMA
+        self.level_names = [name for level, name, cpumask in
+                max(self.domains + [[]], key=len)]
+
+    def matches(self, numbers):
+        return len(numbers) == self.nr_numbers and \
+                np.array_equal(numbers[self.label_pos], self.labels)
+
+    def cpu_column(self, field):
+        return self.cpu_fields.index(field)
+
+    def domain_columns(self, field):
+        '''
+        Columns of a domain field, one per idle type for the lb_* fields
+        '''
+        return [i for i, name in enumerate(self.domain_fields)
+                if name == field or name.startswith(field + '_') and
+                    name[len(field) + 1:] in IDLE_TYPES]
+
+
+class SchedstatSampler:
+    '''
+    Keeps /proc/schedstat open and reads its counters into preallocated
+    arrays:
+    - cpu: nr_cpus x cpu_fields
+    - domain: nr_cpus x nr_levels x domain_fields, 0 for missing domains
+    sample() also leaves the counter deltas since the previous sample in
+    cpu_delta and domain_delta, and the nsec between the samples in delta_ns.
+    '''
+    def __init__(self, path=SCHEDSTAT_PATH):
+        self.fd = os.open(path, os.O_RDONLY)
+        self.read_size = READ_SIZE
+        self.layout = None
+        self.ts = None
+        self.jiffies = None
+        self.delta_ns = None
+
+    def close(self):
+        os.close(self.fd)
+
+    def read(self):
+        data = os.pread(self.fd, self.read_size, 0)
+        while len(data) >= self.read_size:
+            self.read_size *= 2
+            data = os.pread(self.fd, self.read_size, 0)
+        return data
+
+    def allocate(self, layout):
+        self.layout = layout
+        shape = (len(layout.cpus), len(layout.cpu_fields))
+        self.cpu, self.prev_cpu, self.cpu_delta = [np.zeros(shape, dtype=np.int64) for i in range(3)]
+        shape = layout.domain_pos.shape
+        self.domain, self.prev_domain, self.domain_delta = [np.zeros(shape, dtype=np.int64) for i in range(3)]
+
+    def sample(self):
+        '''
+        Read the counters. Returns False when there are no deltas: on the
+        first sample and when the layout changed since the previous one.
+        '''
+        ts = time.monotonic_ns()
+        data = self.read()
+        numbers = np.fromstring(data.translate(DIGITS), dtype=np.int64, sep=' ')
+        has_delta = self.layout is not None and self.layout.matches(numbers)
+        if not has_delta:
+            self.allocate(SchedstatLayout(data))
+        layout = self.layout
+        self.cpu, self.prev_cpu = self.prev_cpu, self.cpu
+        self.domain, self.prev_domain = self.prev_domain, self.domain
+        np.take(numbers, layout.cpu_pos, out=self.cpu)
+        np.take(numbers, layout.domain_pos, out=self.domain)
+        self.domain[~layout.domain_valid] = 0
+        if layout.timestamp_pos is not None:
+            self.jiffies = int(numbers[layout.timestamp_pos])
+        if has_delta:
+            np.subtract(self.cpu, self.prev_cpu, out=self.cpu_delta)
+            np.subtract(self.domain, self.prev_domain, out=self.domain_delta)
+            self.delta_ns = ts - self.ts
+        self.ts = ts
+        return has_delta
+
+    def samples(self, frequency, duration=None):
+        '''
+        Sample at frequency Hz for duration sec (forever if None), yielding
+        the ktime of every sample with deltas. The delta arrays are reused by
+        the next sample.
+        '''
+        period = (10**9)//frequency
+        self.sample()
+        deadline = self.ts
+        end = None if duration is None else self.ts + int(duration*(10**9))
+        while end is None or deadline + period <= end:
+            deadline += period
+            now = time.monotonic_ns()
+            if deadline > now:
+                time.sleep((deadline - now)/(10**9))
+            else:
+                # fell behind, skip the missed periods
+                deadline += ((now - deadline)//period)*period
+            if self.sample():
+                yield self.ts
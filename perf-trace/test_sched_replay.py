@@ -0,0 +1,107 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# sched-replay.py must print the same report whatever number of time shards
+# the trace is split into. Run with:
+# python -m pytest test_sched_replay.py
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def write_trace(path, nr_events=20000, nr_cpus=16, nr_pids=40, seed=1):
+    '''
+    Write a random `perf script --ns` text dump of the sched events
+    '''
+    rand = random.Random(seed)
+    ts = 10**9
+    runqlen = [0]*nr_cpus
+    with open(path, 'w') as f:
+        for i in range(nr_events):
+            ts += rand.randint(100, 20000)
+            pid = rand.randint(1, nr_pids)
+            cpu = rand.randrange(nr_cpus)
+            kind = rand.random()
+            if kind < 0.25:
+                event = "sched_waking: comm=t%d pid=%d prio=120 success=1 target_cpu=%03d" % (
+                        pid, pid, rand.randrange(nr_cpus))
+            elif kind < 0.5:
+                event = "sched_wakeup: comm=t%d pid=%d prio=120 success=1 target_cpu=%03d" % (
+                        pid, pid, rand.randrange(nr_cpus))
+            elif kind < 0.7:
+                event = ("sched_switch: prev_comm=t%d prev_pid=%d prev_prio=120 prev_state=%s ==> "
+                        "next_comm=t%d next_pid=%d next_prio=120" % (0, rand.randint(1, nr_pids),
+                        rand.choice("RSD"), pid, pid))
+            elif kind < 0.8:
+                event = "sched_migrate_task: comm=t%d pid=%d prio=120 orig_cpu=%d dest_cpu=%d" % (
+                        pid, pid, rand.randrange(nr_cpus), rand.randrange(nr_cpus))
+            elif kind < 0.805:
+                event = "sched_process_exit: comm=t%d pid=%d prio=120 group_dead=1" % (pid, pid)
+            else:
+                target = rand.randrange(nr_cpus)
+                runqlen[target] = max(0, runqlen[target] + rand.choice([-1, 1]))
+                event = "sched_update_nr_running: cpu=%d change=1 nr_running=%d" % (target,
+                        runqlen[target])
+            f.write("%16s %6d [%03d] %d.%09d: sched:%s\n" % ("bench", 42, cpu, ts//(10**9),
+                    ts%(10**9), event))
+
+
+class ShardedReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.trace = os.path.join(self.tmpdir, "trace.txt")
+        write_trace(self.trace)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def replay(self, shards, *args, **kwargs):
+        trace = kwargs.get('trace', self.trace)
+        return subprocess.check_output([sys.executable, os.path.join(SCRIPT_DIR, "sched-replay.py"),
+            "-j", "4", "-s", str(shards), "--nr-cpus", "16", "--no-topology", trace] + list(args),
+            universal_newlines=True)
+
+    def assertShardsAgree(self, *args):
+        sequential = self.replay(1, *args)
+        for shards in (4, 7):
+            self.assertEqual(self.replay(shards, *args), sequential)
+        return sequential
+
+    def test_default_report(self):
+        report = self.assertShardsAgree()
+        self.assertIn("Accuracy = ", report)
+        self.assertNotIn("Top scheduling latency", report)
+
+    def test_extended_report(self):
+        report = self.assertShardsAgree("-x", "-v", "2")
+        self.assertIn("Task migrations by topology distance", report)
+
+    def test_pending_ttl(self):
+        report = self.assertShardsAgree("-x", "--pending-ttl-us", "1000")
+        self.assertNotIn("Orphaned wakeups (not switched in within TTL) =  0", report)
+
+    def test_latency_windows(self):
+        report = self.assertShardsAgree("--window-us", "20000", "--window-step-us", "5000")
+        self.assertIn("window", report.lower())
+
+    def test_trace_file(self):
+        converted = os.path.join(self.tmpdir, "trace.sched")
+        subprocess.check_call([sys.executable, os.path.join(SCRIPT_DIR, "sched-convert.py"),
+            "--trace", self.trace, "-o", converted], stdout=subprocess.DEVNULL)
+        sequential = self.replay(1, "-x")
+        self.assertEqual(self.replay(4, "-x", trace=converted), sequential)
+
+    def test_top_latency(self):
+        report = self.assertShardsAgree("--top-k", "10", "--latency-threshold-us", "1000")
+        self.assertIn("Top scheduling latency over 1000 us by comm/pid", report)
+        self.assertNotIn("approximate", report)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,244 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# CPU topology snapshot: SMT cores, LLCs, packages (DIE) and NUMA nodes of
+# every CPU as integer bitmasks, with the possible/present/online masks.
+#
+# The snapshot is built from the cpulist strings of sysfs. CPUs sharing a
+# level share its mask, so sysfs is only read for CPUs not already covered by
+# the mask of a sibling. Snapshots are cached in CACHE_DIR, keyed by the boot
+# id and the present/online cpulists, so that later runs on the same boot and
+# CPU hotplug state load the cache instead of walking sysfs. A snapshot can
+# also be saved to a file (see save-topology.py), to analyze traces
+# recorded on another machine with its topology.
+#
+# Only the standard library is used, so that bpf_scripts can import it too:
+# sys.path.append(os.path.join(os.path.dirname(__file__), '../perf-trace'))
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+import json
+import os
+
+SYSFS = "/sys"
+BOOT_ID = "/proc/sys/kernel/random/boot_id"
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+        'scheduler-benchmarks')
+SNAPSHOT_VERSION = 1
+
+# topology levels, from the smallest
+SMT = 'smt'
+LLC = 'llc'
+DIE = 'die'
+NUMA = 'numa'
+LEVELS = (SMT, LLC, DIE, NUMA)
+
+def cpulist_to_mask(text):
+    '''
+    Bitmask of a cpulist string like "0-3,8,10-11"
+    '''
+    mask = 0
+    for part in text.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            mask |= ((1 << (int(last) + 1)) - 1) ^ ((1 << int(first)) - 1)
+        elif part:
+            mask |= 1 << int(part)
+    return mask
+
+def parse_cpulist(text):
+    '''
+    Sorted CPUs of a cpulist string like "0-3,8,10-11"
+    '''
+    return mask_to_cpulist(cpulist_to_mask(text))
+
+def cpus_to_mask(cpus):
+    '''
+    Bitmask of an iterable of CPUs
+    '''
+    mask = 0
+    for cpu in cpus:
+        mask |= 1 << cpu
+    return mask
+
+def mask_to_cpulist(mask):
+    # one step per set bit, the scan for the next one is done by str.find
+    bits = bin(mask)[:1:-1]
+    cpulist = []
+    cpu = bits.find('1')
+    while cpu >= 0:
+        cpulist.append(cpu)
+        cpu = bits.find('1', cpu + 1)
+    return cpulist
+
+def read_file(path):
+    with open(path) as f:
+        return f.read().strip()
+
+def snapshot_key(sysfs=SYSFS, boot_id=BOOT_ID):
+    '''
+    Identity of the running topology: boot id and present/online CPUs, which
+    change on every boot and CPU hotplug
+    '''
+    cpu_dir = os.path.join(sysfs, 'devices/system/cpu')
+    return dict(boot_id=read_file(boot_id), present=read_file(os.path.join(cpu_dir, 'present')),
+            online=read_file(os.path.join(cpu_dir, 'online')))
+
+
+class Topology:
+    '''
+    Per level list of the mask of every CPU (0 when unknown, e.g. offline
+    CPUs), indexed by cpu-id up to nr_cpu_ids
+    '''
+    def __init__(self, nr_cpu_ids, possible, present, online, masks, node_id, key=None):
+        self.nr_cpu_ids = nr_cpu_ids
+        self.possible_mask = possible
+        self.present_mask = present
+        self.online_mask = online
+        self.masks = masks
+        # NUMA node of every CPU, None when unknown
+        self.node_id = node_id
+        self.key = key
+
+    @classmethod
+    def from_sysfs(cls, sysfs=SYSFS):
+        cpu_dir = os.path.join(sysfs, 'devices/system/cpu')
+        possible = cpulist_to_mask(read_file(os.path.join(cpu_dir, 'possible')))
+        present = cpulist_to_mask(read_file(os.path.join(cpu_dir, 'present')))
+        online = cpulist_to_mask(read_file(os.path.join(cpu_dir, 'online')))
+        nr_cpu_ids = possible.bit_length()
+        masks = dict((level, [0 for i in range(nr_cpu_ids)]) for level in LEVELS)
+        node_id = [None for i in range(nr_cpu_ids)]
+
+        def read_level(level, cpu, read_mask):
+            '''
+            Fill the mask of cpu and its siblings at level, unless a
+            sibling already did
+            '''
+            if masks[level][cpu]:
+                return
+            try:
+                mask = read_mask(os.path.join(cpu_dir, 'cpu%d' % cpu))
+            except (IOError, OSError, ValueError):
+                return
+            mask &= online
+            for sibling in mask_to_cpulist(mask):
+                if sibling < nr_cpu_ids:
+                    masks[level][sibling] = mask
+
+        def read_llc(path):
+            llc, llc_level = 0, -1
+            for index in os.listdir(os.path.join(path, 'cache')):
+                if not index.startswith('index'):
+                    continue
+                index = os.path.join(path, 'cache', index)
+                if read_file(os.path.join(index, 'type')) == 'Instruction':
+                    continue
+                level = int(read_file(os.path.join(index, 'level')))
+                if level > llc_level:
+                    llc, llc_level = cpulist_to_mask(read_file(os.path.join(index, 'shared_cpu_list'))), level
+            if llc_level < 0:
+                raise ValueError("No cache information")
+            return llc
+
+        def read_package(path):
+            for name in ('package_cpus_list', 'core_siblings_list'):
+                if os.path.exists(os.path.join(path, 'topology', name)):
+                    return cpulist_to_mask(read_file(os.path.join(path, 'topology', name)))
+            raise ValueError("No package information")
+
+        for cpu in mask_to_cpulist(online):
+            read_level(SMT, cpu, lambda path: cpulist_to_mask(read_file(
+                    os.path.join(path, 'topology/thread_siblings_list'))))
+            read_level(LLC, cpu, read_llc)
+            read_level(DIE, cpu, read_package)
+
+        node_dir = os.path.join(sysfs, 'devices/system/node')
+        if os.path.isdir(node_dir):
+            for name in os.listdir(node_dir):
+                if not (name.startswith('node') and name[4:].isdigit()):
+                    continue
+                mask = cpulist_to_mask(read_file(os.path.join(node_dir, name, 'cpulist')))
+                for cpu in mask_to_cpulist(mask):
+                    if cpu < nr_cpu_ids:
+                        masks[NUMA][cpu] = mask & online
+                        node_id[cpu] = int(name[4:])
+        return cls(nr_cpu_ids, possible, present, online, masks, node_id)
+
+    def save(self, path):
+        '''
+        Write the snapshot as JSON, with every distinct mask of a level
+        stored once
+        '''
+        levels = dict()
+        for level, masks in self.masks.items():
+            distinct = sorted(set(masks))
+            index = dict((mask, i) for i, mask in enumerate(distinct))
+            levels[level] = dict(masks=['%x' % mask for mask in distinct],
+                    index=[index[mask] for mask in masks])
+        snapshot = dict(version=SNAPSHOT_VERSION, key=self.key, nr_cpu_ids=self.nr_cpu_ids,
+                possible='%x' % self.possible_mask, present='%x' % self.present_mask,
+                online='%x' % self.online_mask, levels=levels,
+                node_id=[-1 if node is None else node for node in self.node_id])
+        # rename so that concurrent readers never see a partial file
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            snapshot = json.load(f)
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported topology snapshot version %s" % snapshot.get('version'))
+        masks = dict()
+        for level, stored in snapshot['levels'].items():
+            distinct = [int(mask, 16) for mask in stored['masks']]
+            masks[level] = [distinct[i] for i in stored['index']]
+        return cls(snapshot['nr_cpu_ids'], int(snapshot['possible'], 16),
+                int(snapshot['present'], 16), int(snapshot['online'], 16), masks,
+                [None if node < 0 else node for node in snapshot['node_id']], snapshot['key'])
+
+    def siblings(self, level, cpu):
+        '''
+        cpulist of the CPUs sharing level with cpu, None when unknown
+        '''
+        if not 0 <= cpu < self.nr_cpu_ids or not self.masks[level][cpu]:
+            return None
+        return mask_to_cpulist(self.masks[level][cpu])
+
+    def first_cpu(self, level, cpu):
+        mask = self.masks[level][cpu] if 0 <= cpu < self.nr_cpu_ids else 0
+        return (mask & -mask).bit_length() - 1 if mask else None
+
+
+def cached(cache_dir=CACHE_DIR, sysfs=SYSFS, boot_id=BOOT_ID):
+    '''
+    Topology of this machine, from the cache when it was saved on the same
+    boot and CPU hotplug state, from sysfs (updating the cache) otherwise
+    '''
+    key = snapshot_key(sysfs, boot_id)
+    path = os.path.join(cache_dir, 'topology.json')
+    try:
+        topology = Topology.load(path)
+        if topology.key == key:
+            return topology
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    topology = Topology.from_sysfs(sysfs)
+    topology.key = key
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        topology.save(path)
+    except (IOError, OSError):
+        pass
+    return topology
+
+def load(path=None):
+    '''
+    Topology of a saved snapshot, or of this machine if path is None
+    '''
+    if path is None:
+        return cached()
+    return Topology.load(path)
@@ -0,0 +1,291 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Compact binary intermediate format for sched/power traces, so repeated
+# analyses of one capture don't go through perf script every time.
+#
+# Convert once with sched-convert.py, then read it with TraceFile, which
+# mmaps the file and views every section as a NumPy structured array without
+# copying. read_events() and split() have the same interface as
+# perf_script_reader, with event numbers in place of byte offsets.
+#
+# File layout, all little-endian:
+# - header: magic, version, nr_sections, nr_events, footer offset
+# - one section per event type in SECTIONS, holding fixed-width RECORDS
+#   in time order, 64 byte aligned
+# - order: one byte per event, the SECTIONS index of each event in trace
+#   order, so that events of all sections can be merged back in the order
+#   perf script saw them
+# - footer: order offset and index length, the section table (name,
+#   offset, count, itemsize) and the time index. Every INDEX_STRIDE events
+#   the index stores the ktime of that event and how many records of each
+#   section precede it.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+import mmap
+import shutil
+import struct
+import tempfile
+
+import numpy as np
+
+MAGIC = b'SCHEDTRC'
+VERSION = 2
+HEADER = struct.Struct('<8sIIQQ') # magic, version, nr_sections, nr_events, footer offset
+FOOTER = struct.Struct('<QQ') # order offset, nr_index
+ALIGN = 64
+INDEX_STRIDE = 4096
+# Records spooled per section before they are written out
+CHUNK = 1<<16
+
+COMM = 'S16' # TASK_COMM_LEN
+
+# Every record starts with ts (ktime in nsec) and common_cpu
+RECORDS = {
+    'sched_waking': [('ts', '<i8'), ('common_cpu', '<i4'), ('common_pid', '<i4'),
+        ('pid', '<i4'), ('prio', '<i4'), ('target_cpu', '<i4'),
+        ('comm', COMM), ('common_comm', COMM)],
+    'sched_wakeup': [('ts', '<i8'), ('common_cpu', '<i4'), ('common_pid', '<i4'),
+        ('pid', '<i4'), ('prio', '<i4'), ('target_cpu', '<i4'),
+        ('comm', COMM), ('common_comm', COMM)],
+    'sched_switch': [('ts', '<i8'), ('common_cpu', '<i4'), ('common_pid', '<i4'),
+        ('prev_pid', '<i4'), ('prev_prio', '<i4'), ('prev_state', '<i4'),
+        ('next_pid', '<i4'), ('next_prio', '<i4'),
+        ('prev_comm', COMM), ('next_comm', COMM), ('common_comm', COMM)],
+    'sched_migrate_task': [('ts', '<i8'), ('common_cpu', '<i4'), ('common_pid', '<i4'),
+        ('pid', '<i4'), ('prio', '<i4'), ('orig_cpu', '<i4'), ('dest_cpu', '<i4'),
+        ('comm', COMM), ('common_comm', COMM)],
+    'cpu_idle': [('ts', '<i8'), ('common_cpu', '<i4'), ('common_pid', '<i4'),
+        ('state', '<u4'), ('cpu_id', '<i4'), ('common_comm', COMM)],
+    'sched_update_nr_running': [('ts', '<i8'), ('common_cpu', '<i4'), ('common_pid', '<i4'),
+        ('cpu', '<i4'), ('change', '<i4'), ('nr_running', '<i4'), ('common_comm', COMM)],
+    'sched_process_exit': [('ts', '<i8'), ('common_cpu', '<i4'), ('common_pid', '<i4'),
+        ('pid', '<i4'), ('prio', '<i4'), ('comm', COMM), ('common_comm', COMM)],
+}
+SECTIONS = ('sched_waking', 'sched_wakeup', 'sched_switch', 'sched_migrate_task',
+        'cpu_idle', 'sched_update_nr_running', 'sched_process_exit')
+DTYPES = [np.dtype(RECORDS[name]) for name in SECTIONS]
+CODES = dict((name, code) for code, name in enumerate(SECTIONS))
+
+SECTION_TABLE = np.dtype([('name', 'S32'), ('offset', '<u8'), ('count', '<u8'), ('itemsize', '<u8')])
+INDEX = np.dtype([('ts', '<i8'), ('rows', '<u8', (len(SECTIONS),))])
+
+def _align(fd):
+    pad = -fd.tell() % ALIGN
+    fd.write(b'\0'*pad)
+    return fd.tell()
+
+def _string_fields(dtype):
+    return [name for name in dtype.names if dtype[name].kind == 'S']
+
+
+class TraceWriter:
+    '''
+    Write events (in time order) to a trace file. Events not in SECTIONS
+    are dropped.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.nr_events = 0
+        self.last_ts = None
+        self.rows = [0 for i in SECTIONS]
+        self.pending = [[] for i in SECTIONS]
+        self.spools = [tempfile.TemporaryFile() for i in SECTIONS]
+        self.order = bytearray()
+        self.order_spool = tempfile.TemporaryFile()
+        self.index = []
+        self.fields = [dtype.names[2:] for dtype in DTYPES]
+        self.string_fields = [set(_string_fields(dtype)) for dtype in DTYPES]
+
+    def _flush(self, code):
+        if self.pending[code]:
+            np.array(self.pending[code], dtype=DTYPES[code]).tofile(self.spools[code])
+            self.pending[code] = []
+
+    def write(self, event_name, ts, common_cpu, fields):
+        '''
+        Returns False if event_name has no section
+        '''
+        code = CODES.get(event_name)
+        if code is None:
+            return False
+        if self.last_ts is not None and ts < self.last_ts:
+            raise ValueError("%s at %d.%09d is older than the previous event" %
+                    (event_name, ts//(10**9), ts%(10**9)))
+        self.last_ts = ts
+
+        if self.nr_events % INDEX_STRIDE == 0:
+            self.index.append((ts, tuple(self.rows)))
+        record = [ts, common_cpu]
+        string_fields = self.string_fields[code]
+        for name in self.fields[code]:
+            value = fields.get(name, 0)
+            if name in string_fields:
+                value = value.encode(errors='replace') if value else b''
+            record.append(value)
+        self.pending[code].append(tuple(record))
+        if len(self.pending[code]) == CHUNK:
+            self._flush(code)
+        self.rows[code] += 1
+
+        self.order.append(code)
+        if len(self.order) == CHUNK:
+            self.order_spool.write(self.order)
+            self.order = bytearray()
+        self.nr_events += 1
+        return True
+
+    def close(self):
+        self.order_spool.write(self.order)
+        table = np.zeros(len(SECTIONS), dtype=SECTION_TABLE)
+        with open(self.path, 'wb') as fd:
+            fd.write(HEADER.pack(MAGIC, VERSION, len(SECTIONS), self.nr_events, 0))
+            for code, name in enumerate(SECTIONS):
+                self._flush(code)
+                table[code] = (name.encode(), _align(fd), self.rows[code], DTYPES[code].itemsize)
+                self.spools[code].seek(0)
+                shutil.copyfileobj(self.spools[code], fd)
+                self.spools[code].close()
+            order_offset = _align(fd)
+            self.order_spool.seek(0)
+            shutil.copyfileobj(self.order_spool, fd)
+            self.order_spool.close()
+
+            footer_offset = _align(fd)
+            fd.write(FOOTER.pack(order_offset, len(self.index)))
+            fd.write(table.tobytes())
+            fd.write(np.array(self.index, dtype=INDEX).tobytes())
+            fd.seek(0)
+            fd.write(HEADER.pack(MAGIC, VERSION, len(SECTIONS), self.nr_events, footer_offset))
+
+
+class TraceFile:
+    '''
+    Read-only mmap of a trace file. sections[name] is a structured array
+    view of the records of one event type, in time order.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fd:
+            self.mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < HEADER.size:
+            raise ValueError("%s is not a sched trace file" % path)
+        magic, version, nr_sections, self.nr_events, footer_offset = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise ValueError("%s is not a sched trace file" % path)
+        if version != VERSION or nr_sections != len(SECTIONS):
+            raise ValueError("%s: unsupported trace file version %d" % (path, version))
+
+        order_offset, nr_index = FOOTER.unpack_from(self.mm, footer_offset)
+        offset = footer_offset + FOOTER.size
+        table = np.frombuffer(self.mm, SECTION_TABLE, nr_sections, offset)
+        offset += table.nbytes
+        self.index = np.frombuffer(self.mm, INDEX, nr_index, offset)
+        self.order = np.frombuffer(self.mm, np.uint8, self.nr_events, order_offset)
+
+        self.sections = dict()
+        self._sections = []
+        for code, name in enumerate(SECTIONS):
+            entry = table[code]
+            if entry['name'].decode() != name or entry['itemsize'] != DTYPES[code].itemsize:
+                raise ValueError("%s: unexpected section %s" % (path, entry['name'].decode()))
+            records = np.frombuffer(self.mm, DTYPES[code], int(entry['count']), int(entry['offset']))
+            self.sections[name] = records
+            self._sections.append(records)
+        self.fields = [dtype.names[2:] for dtype in DTYPES]
+        self.string_fields = [_string_fields(dtype) for dtype in DTYPES]
+
+    def __len__(self):
+        return self.nr_events
+
+    def _rows(self, event):
+        '''
+        Records of each section preceding event number event
+        '''
+        block = min(event//INDEX_STRIDE, len(self.index) - 1)
+        first = block*INDEX_STRIDE
+        rows = self.index['rows'][block].astype(np.int64)
+        return rows + np.bincount(self.order[first:event], minlength=len(SECTIONS))
+
+    def _ts(self, start, end):
+        '''
+        ktime of events [start, end)
+        '''
+        order = self.order[start:end]
+        ts = np.empty(len(order), dtype=np.int64)
+        rows = self._rows(start)
+        for code, records in enumerate(self._sections):
+            mask = order == code
+            count = np.count_nonzero(mask)
+            if count:
+                ts[mask] = records['ts'][rows[code]:rows[code] + count]
+        return ts
+
+    def seek(self, ts):
+        '''
+        Number of the first event at or after ktime ts
+        '''
+        if self.nr_events == 0:
+            return 0
+        block = max(np.searchsorted(self.index['ts'], ts, side='left') - 1, 0)
+        start = block*INDEX_STRIDE
+        end = min(start + INDEX_STRIDE, self.nr_events)
+        return start + int(np.searchsorted(self._ts(start, end), ts, side='left'))
+
+    def time_range(self, start_ts=None, end_ts=None):
+        '''
+        Event numbers [start, end) of the events in ktime [start_ts, end_ts)
+        '''
+        start = 0 if start_ts is None else self.seek(start_ts)
+        end = self.nr_events if end_ts is None else self.seek(end_ts)
+        return start, max(start, end)
+
+    def section(self, name, start_ts=None, end_ts=None):
+        '''
+        View of the name records in ktime [start_ts, end_ts)
+        '''
+        records = self.sections[name]
+        start = 0 if start_ts is None else np.searchsorted(records['ts'], start_ts, side='left')
+        end = len(records) if end_ts is None else np.searchsorted(records['ts'], end_ts, side='left')
+        return records[start:end]
+
+    def events(self, start=0, end=None):
+        '''
+        Events [start, end) in trace order, as (ktime_ns, event_name,
+        common_cpu, fields) like perf_script_reader.read_events
+        '''
+        end = self.nr_events if end is None else min(end, self.nr_events)
+        while start < end:
+            chunk_end = min((start//INDEX_STRIDE + 1)*INDEX_STRIDE, end)
+            order = self.order[start:chunk_end]
+            counts = np.bincount(order, minlength=len(SECTIONS))
+            rows = self._rows(start)
+            records = [iter(self._sections[code][rows[code]:rows[code] + counts[code]].tolist())
+                    for code in range(len(SECTIONS))]
+            for code in order.tolist():
+                record = next(records[code])
+                fields = dict(zip(self.fields[code], record[2:]))
+                for name in self.string_fields[code]:
+                    fields[name] = fields[name].decode(errors='replace')
+                yield record[0], SECTIONS[code], record[1], fields
+            start = chunk_end
+
+
+def is_trace_file(path):
+    with open(path, 'rb') as fd:
+        return fd.read(len(MAGIC)) == MAGIC
+
+def read_events(path, start=0, end=None):
+    '''
+    Events [start, end) of the trace file at path
+    '''
+    return TraceFile(path).events(start, end)
+
+def split(path, nr_shards):
+    '''
+    Split the events of path into at most nr_shards ranges of similar size,
+    each a time shard.
+    '''
+    nr_events = len(TraceFile(path))
+    offsets = sorted(set(nr_events*i//nr_shards for i in range(nr_shards)))
+    return list(zip(offsets, offsets[1:] + [nr_events]))
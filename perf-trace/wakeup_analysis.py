@@ -0,0 +1,456 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# Scheduler wakeup accuracy and latency analysis used by sched-test.py.
+#
+# The analysis lives outside of the perf script so that it can be driven both
+# from perf's embedded interpreter (sched-test.py) and from offline runners
+# such as sched-replay.py. Every handler takes the event ktime in nsec and
+# common_cpu, followed by the tracepoint fields as keyword arguments.
+#
+# The per-CPU runqueue length and the pending wakeup marks can be exported
+# with get_state() and loaded into a fresh analyzer with set_state(), which
+# lets a trace be analyzed in consecutive shards. WakeupSummary objects of the
+# shards merge into the same report as a sequential run.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import sys
+
+from event_store import WAKEUP, WAKING
+import heavy_hitters
+import latency_analysis
+import migration_analysis
+from topology_snapshot import cpus_to_mask, mask_to_cpulist
+
+# default tunables, see sched-test.py
+NR_CPUS = 176
+WAKEUP_SCOPE_SIZE = 8
+LATENCY_THRESHOLD_US = (10**3)*10 # 10ms
+VERBOSE_LEVEL = 1 # 0-No extra info, 1-wakeup errors, 2-runqlength at every wakeup
+OFFLINE_CPUS = []
+WHITELIST_TASKS = []
+LATENCY_PERCENTILES = latency_analysis.LATENCY_PERCENTILES
+LATENCY_RELATIVE_ERROR = latency_analysis.LATENCY_RELATIVE_ERROR
+PENDING_WAKEUP_TTL_US = latency_analysis.PENDING_WAKEUP_TTL_US
+TOP_K = 0 # comms/pids listed with the highest scheduling latency, see heavy_hitters.py
+WINDOW_US = latency_analysis.WINDOW_US
+WINDOW_STEP_US = latency_analysis.WINDOW_STEP_US
+EXTENDED_REPORT = latency_analysis.EXTENDED_REPORT
+
+# DECISION flags, used as enumeration
+CORRECT_DECISION_ON_IDLE_CPU = 1
+CORRECT_DECISION_ON_BUSY_CPU = 2
+INCORRECT_DECISION = 3
+
+# tracepoints handled by WakeupAnalyzer
+EVENTS = ('sched_waking', 'sched_wakeup', 'sched_switch', 'sched_migrate_task',
+        'sched_update_nr_running', 'sched_process_exit')
+
+def is_comm_blacklist(comm, whitelist_tasks=WHITELIST_TASKS):
+    blacklist = ["migration", "kworker", "ksoftirqd"]
+
+    if len(whitelist_tasks)>0:
+        for i in whitelist_tasks:
+            if i in comm:
+                return False
+        return True
+
+    for i in blacklist:
+        if i in comm:
+            return True
+
+    return False
+
+def sd_mask(cpu, cpumask_size):
+    '''
+    Find domain cpumask for a given cpu
+    @cpu: cpu-id number
+    @cpumask_size: size of the cpumask for specific domain
+
+    For cpumask_size = 4, sd_mask return first and last cpu of small core
+    lly, for size = 8, this returns cpus of big core.
+    '''
+    first_cpu = (cpu//cpumask_size)*cpumask_size
+    return range(first_cpu,first_cpu+cpumask_size)
+
+def print_parameters(cpu_topology, nr_cpus=NR_CPUS, wakeup_scope_size=WAKEUP_SCOPE_SIZE,
+        offline_cpus=OFFLINE_CPUS, latency_relative_error=LATENCY_RELATIVE_ERROR,
+        extended_report=EXTENDED_REPORT, out=sys.stdout):
+    print("Perf-script for calculating scheduler wakeup stats", file=out)
+    print("Script parameters: ", file=out)
+    if cpu_topology == None:
+        print("WAKEUP_SCOPE_SIZE : ", wakeup_scope_size, file=out)
+    print("OFFLINE_CPUS : ", offline_cpus, file=out)
+    print("NR_CPUS : ", nr_cpus, file=out)
+    if extended_report:
+        print("LATENCY_RELATIVE_ERROR : ", latency_relative_error, file=out)
+    print("============================Starting perf-script===========================\n", file=out)
+
+
+class WakeupSummary:
+    '''
+    Mergeable end-of-trace results of a WakeupAnalyzer
+    '''
+    def __init__(self, latency_relative_error=LATENCY_RELATIVE_ERROR, top_k=TOP_K,
+            latency_threshold_us=LATENCY_THRESHOLD_US, extended_report=EXTENDED_REPORT):
+        self.correct_decision_on_idle_cpu = 0
+        self.correct_decision_on_busy_cpu = 0
+        self.incorrect_decision = 0
+        # incorrect decisions while a whole SMT core was idle in the LLC
+        self.incorrect_decision_idle_core = 0
+        #If a task wakes up on idle core then it is said to be woken up on SMT-1.
+        self.smt_after_wakeup = dict()
+        self.wake_affine_pulled = 0
+        self.latency = latency_analysis.LatencySummary(latency_relative_error)
+        # comms/pids with the highest scheduling latency, None if top_k = 0
+        self.attribution = heavy_hitters.LatencyAttribution(top_k,
+                latency_threshold_us=latency_threshold_us) if top_k else None
+        # migration_analysis.MigrationSummary, set up by WakeupAnalyzer
+        self.migrations = None
+        # also report the sections sched-test.py didn't always have
+        self.extended_report = extended_report
+
+    def merge(self, other):
+        self.correct_decision_on_idle_cpu += other.correct_decision_on_idle_cpu
+        self.correct_decision_on_busy_cpu += other.correct_decision_on_busy_cpu
+        self.incorrect_decision += other.incorrect_decision
+        self.incorrect_decision_idle_core += other.incorrect_decision_idle_core
+        for smt_mode, count in other.smt_after_wakeup.items():
+            self.smt_after_wakeup[smt_mode] = self.smt_after_wakeup.get(smt_mode, 0) + count
+        self.wake_affine_pulled += other.wake_affine_pulled
+        self.latency.merge(other.latency)
+        if self.attribution is not None:
+            self.attribution.merge(other.attribution)
+        if self.migrations is not None:
+            self.migrations.merge(other.migrations)
+        return self
+
+    def report(self, percentiles=LATENCY_PERCENTILES, out=sys.stdout):
+        print("Correct wakeup decision on idle rq = ", self.correct_decision_on_idle_cpu, file=out)
+        print("Correct wakeup decision in busy cpu = ", self.correct_decision_on_busy_cpu, file=out)
+        print("Incorrect wakeup decision =", self.incorrect_decision, file=out)
+        if self.extended_report:
+            print("Incorrect wakeup decision with an idle core in LLC =", self.incorrect_decision_idle_core, file=out)
+        correct = self.correct_decision_on_idle_cpu + self.correct_decision_on_busy_cpu
+        decisions = correct + self.incorrect_decision
+        if decisions:
+            print("Accuracy = ", (correct*100)/decisions, "%", file=out)
+        else:
+            print("Accuracy = n/a", file=out)
+        self.latency.report_decision_latency(percentiles, out, self.extended_report)
+        self.latency.report_sched_latency(percentiles, out, self.extended_report)
+        print('------------------SMT Mode of target_cpu during sched_wakeup----------------', file=out)
+        print('key:value = SMT-mode : sample-count =', self.smt_after_wakeup, file=out)
+        print('------------------#Wake affine pulled---------------------------------------', file=out)
+        print('Number of times a task got pulled to waker\'s llc = ', self.wake_affine_pulled, file=out)
+        self.latency.report_pre_migration_wait_time(percentiles, out, self.extended_report)
+        if self.extended_report:
+            if self.migrations is not None:
+                self.migrations.report(out)
+            self.latency.report_dropped_wakeups(out)
+        if self.attribution is not None:
+            self.attribution.report(percentiles, out)
+        self.latency.report_series(out)
+
+
+class WakeupAnalyzer:
+    EVENTS = EVENTS
+
+    def __init__(self, cpu_topology=None, nr_cpus=NR_CPUS, wakeup_scope_size=WAKEUP_SCOPE_SIZE,
+            latency_threshold_us=LATENCY_THRESHOLD_US, verbose_level=VERBOSE_LEVEL,
+            offline_cpus=OFFLINE_CPUS, whitelist_tasks=WHITELIST_TASKS,
+            latency_percentiles=LATENCY_PERCENTILES,
+            latency_relative_error=LATENCY_RELATIVE_ERROR,
+            pending_ttl_us=PENDING_WAKEUP_TTL_US, top_k=TOP_K, window_us=WINDOW_US,
+            window_step_us=WINDOW_STEP_US, extended_report=EXTENDED_REPORT, out=sys.stdout):
+        self.cpu_topology = cpu_topology
+        self.nr_cpus = nr_cpus
+        self.wakeup_scope_size = wakeup_scope_size
+        self.latency_threshold_us = latency_threshold_us
+        self.verbose_level = verbose_level
+        self.offline_cpus = offline_cpus
+        self.whitelist_tasks = whitelist_tasks
+        self.latency_percentiles = latency_percentiles
+        self.latency_relative_error = latency_relative_error
+        self.out = out
+
+        self.online_mask = ((1 << nr_cpus) - 1) & ~cpus_to_mask(
+                [i for i in offline_cpus if 0 <= i < nr_cpus])
+
+        # Flat per-CPU topology lookup tables, llc_id/core_id is the first
+        # CPU of the LLC/SMT core
+        self.llc_id = []
+        self.llc_cpumask = []
+        self.core_id = []
+        self.smt_cpumask = []
+        for cpu in range(nr_cpus):
+            llc = [i for i in self.sd_llc_mask(cpu) if 0 <= i < nr_cpus]
+            core = [i for i in self.smt_mask(cpu) if 0 <= i < nr_cpus]
+            self.llc_id.append(min(llc))
+            self.llc_cpumask.append(cpus_to_mask(llc))
+            self.core_id.append(min(core))
+            self.smt_cpumask.append(cpus_to_mask(core))
+
+        self.set_runqlen([0 for i in range(nr_cpus)])
+        # Pending wakeup marks and the latencies derived from them
+        self.latency = latency_analysis.LatencyAnalyzer(latency_threshold_us=latency_threshold_us,
+                verbose_level=verbose_level, latency_relative_error=latency_relative_error,
+                pending_ttl_us=pending_ttl_us, window_us=window_us,
+                window_step_us=window_step_us, out=out)
+        self.summary = WakeupSummary(latency_relative_error, top_k, latency_threshold_us,
+                extended_report)
+        self.summary.migrations = migration_analysis.MigrationSummary(self.core_id, self.llc_id,
+                migration_analysis.node_ids(cpu_topology, nr_cpus))
+
+    def get_state(self):
+        '''
+        Runqueue lengths and pending wakeup marks needed to continue the
+        analysis of the trace in another analyzer
+        '''
+        return list(self.runqlen), self.latency.get_state()
+
+    def set_runqlen(self, runqlen):
+        '''
+        Load runqueue lengths and rebuild the indexes derived from them:
+        - core_busy: nr of threads with nr_running > 0, indexed by core_id
+        - idle_mask: bitmask of online idle CPUs
+        - idle_core_mask: bitmask of the online CPUs of fully idle SMT cores
+        '''
+        self.runqlen = list(runqlen)
+        self.core_busy = [0 for i in range(self.nr_cpus)]
+        for cpu in range(self.nr_cpus):
+            if self.runqlen[cpu] != 0:
+                self.core_busy[self.core_id[cpu]] += 1
+        self.idle_mask = 0
+        self.idle_core_mask = 0
+        for cpu in range(self.nr_cpus):
+            self.update_idle_index(cpu)
+
+    def set_state(self, runqlen, pending):
+        self.set_runqlen(runqlen)
+        self.latency.set_state(pending)
+
+    def print_runqlen(self, rows, columns):
+        for i in range(rows):
+            print("CPU = "+ str(i*columns) +" --- " + str(columns*(i+1)-1)+": ", end="", file=self.out)
+            for j in range(columns):
+                if (i*columns + j >= self.nr_cpus):
+                    break
+                print(self.runqlen[i*columns + j], end="\t", file=self.out)
+            print(file=self.out)
+
+    def pr(self):
+        self.print_runqlen(20, self.nr_cpus//20+1)
+
+    def is_idle_cpu(self, cpu):
+        return self.runqlen[cpu]
+
+    def sd_llc_mask(self, cpu):
+        topology = self.cpu_topology
+        if topology is not None and 0 <= cpu < topology.nr_cpu_ids and topology.llc_siblings[cpu] is not None:
+            return topology.llc_siblings[cpu]
+        return sd_mask(cpu, self.wakeup_scope_size)
+
+    def smt_mask(self, cpu, smt_size=4):
+        topology = self.cpu_topology
+        if topology is not None and 0 <= cpu < topology.nr_cpu_ids and topology.smt_siblings[cpu] is not None:
+            return topology.smt_siblings[cpu]
+        return sd_mask(cpu, smt_size)
+
+    def same_llc(self, cpu, other_cpu):
+        if 0 <= cpu < self.nr_cpus and 0 <= other_cpu < self.nr_cpus:
+            return self.llc_id[cpu] == self.llc_id[other_cpu]
+        # -1 for unknown waker/prev cpu
+        llc_mask = self.sd_llc_mask(cpu)
+        return cpu in llc_mask and other_cpu in llc_mask
+
+    def update_idle_index(self, cpu):
+        bit = 1 << cpu
+        if self.runqlen[cpu] == 0 and self.online_mask & bit:
+            self.idle_mask |= bit
+        else:
+            self.idle_mask &= ~bit
+
+        core = self.smt_cpumask[cpu] & self.online_mask
+        if core and self.idle_mask & core == core:
+            self.idle_core_mask |= core
+        else:
+            self.idle_core_mask &= ~core
+
+    def idle_cpus_in_llc(self, cpu):
+        '''
+        Bitmask of online idle CPUs sharing LLC with cpu
+        '''
+        return self.idle_mask & self.llc_cpumask[cpu]
+
+    def idle_cores_in_llc(self, cpu):
+        '''
+        Bitmask of the CPUs of fully idle SMT cores sharing LLC with cpu
+        '''
+        return self.idle_core_mask & self.llc_cpumask[cpu]
+
+    def nr_busy_in_smt(self, cpu):
+        return self.core_busy[self.core_id[cpu]]
+
+    def sched_migrate_task(self, ts, common_cpu, orig_cpu, dest_cpu, **fields):
+        self.latency.sched_migrate_task(ts, common_cpu, orig_cpu=orig_cpu, dest_cpu=dest_cpu, **fields)
+        self.summary.migrations.record(ts, orig_cpu, dest_cpu)
+
+    def sched_switch(self, ts, common_cpu, next_pid, next_comm, **fields):
+        latency = self.latency.sched_switch(ts, common_cpu, next_pid=next_pid, **fields)
+        if latency is not None and self.summary.attribution is not None:
+            self.summary.attribution.record(next_comm, next_pid, latency)
+
+    def sched_waking(self, ts, common_cpu, **fields):
+        self.latency.sched_waking(ts, common_cpu, **fields)
+
+    def sched_process_exit(self, ts, common_cpu, **fields):
+        self.latency.sched_process_exit(ts, common_cpu, **fields)
+
+    def sched_wakeup(self, ts, common_cpu, pid, comm, target_cpu, **fields):
+        summary = self.summary
+        runqlen = self.runqlen
+
+        waker_cpu, prev_cpu = self.latency.sched_wakeup(ts, common_cpu, pid=pid,
+                target_cpu=target_cpu, **fields)
+
+        # Update smt_after_wakeup
+        target_smt_mode = self.nr_busy_in_smt(target_cpu)
+        if target_smt_mode in summary.smt_after_wakeup:
+            summary.smt_after_wakeup[target_smt_mode] += 1
+        else:
+            summary.smt_after_wakeup[target_smt_mode] = 1
+
+        # Analyse affinity related decision
+        # If prev_cpu and waker_cpu are in same sd then affinity does not matter
+        same_llc = self.same_llc(waker_cpu, prev_cpu)
+
+        if same_llc:
+            '''
+            If prev_cpu and waker_cpu both share LLC then wake affine never happens
+            '''
+            pass
+        else:
+            if target_cpu != prev_cpu:
+                summary.wake_affine_pulled += 1
+
+        # review scheduler wakeup decisions
+        decision = CORRECT_DECISION_ON_IDLE_CPU
+        suggestion_str = ""
+        if (runqlen[target_cpu] > 1) and prev_cpu != -1 and waker_cpu != -1:
+            decision = CORRECT_DECISION_ON_BUSY_CPU
+
+            if self.verbose_level >= 2:
+                self.pr()
+
+            if not is_comm_blacklist(comm, self.whitelist_tasks):
+                idle_cpus = [self.idle_cpus_in_llc(waker_cpu)]
+                idle_cores = self.idle_cores_in_llc(waker_cpu)
+                if not same_llc:
+                    idle_cpus.append(self.idle_cpus_in_llc(prev_cpu))
+                    idle_cores |= self.idle_cores_in_llc(prev_cpu)
+
+                for mask in idle_cpus:
+                    for i in mask_to_cpulist(mask):
+                        if (suggestion_str == ""):
+                            suggestion_str = str(comm)+"/"+str(pid)+" could have woken up on idle cpu = "
+                        suggestion_str += str(i)+", "
+                        decision = INCORRECT_DECISION
+
+                if idle_cores:
+                    summary.incorrect_decision_idle_core += 1
+
+                if self.verbose_level >= 1:
+                    if same_llc:
+                        print (suggestion_str, 'where target_cpu = ', target_cpu, file=self.out)
+                    else:
+                        print(suggestion_str, "\twhere waker_cpu = ", waker_cpu, " and prev_cpu = ", prev_cpu, " and target_cpu = ", target_cpu, file=self.out)
+
+        if decision == CORRECT_DECISION_ON_IDLE_CPU:
+            summary.correct_decision_on_idle_cpu += 1
+        elif decision == CORRECT_DECISION_ON_BUSY_CPU:
+            summary.correct_decision_on_busy_cpu += 1
+        else:
+            summary.incorrect_decision += 1
+
+    def sched_update_nr_running(self, ts, common_cpu, cpu, nr_running, **fields):
+        if (self.runqlen[cpu] != 0) != (nr_running != 0):
+            self.core_busy[self.core_id[cpu]] += 1 if nr_running != 0 else -1
+        self.runqlen[cpu] = nr_running
+        self.update_idle_index(cpu)
+
+    def finish(self):
+        self.summary.latency = self.latency.finish()
+        self.summary.migrations.matrix.flush()
+        return self.summary
+
+    def report(self, out=None):
+        self.finish().report(self.latency_percentiles, out or self.out)
+
+
+def scan_boundary(events, pending_ttl_us=PENDING_WAKEUP_TTL_US):
+    '''
+    Changes made to the WakeupAnalyzer state by a shard of events, found
+    without knowing the state the shard starts from.
+
+    Returns (runqlen, marks, last_ts) where runqlen maps a cpu to its last
+    nr_running and marks maps a pid to its last pending mark, as in
+    get_state(), or to None when a sched_switch or sched_process_exit
+    removed it. waker_cpu/prev_cpu of a WAKEUP mark are None when they come
+    from a WAKING mark of an earlier shard. last_ts is the ktime of the last
+    event expiring pending marks, None if there is none.
+    '''
+    ttl = pending_ttl_us*(10**3)
+    runqlen = dict()
+    marks = dict()
+    last_ts = None
+    for ts, event_name, common_cpu, fields in events:
+        if event_name in latency_analysis.EVENTS:
+            last_ts = ts
+        if event_name == 'sched_waking':
+            marks[fields['pid']] = (ts, WAKING, common_cpu, common_cpu, fields['target_cpu'], -1)
+        elif event_name == 'sched_wakeup':
+            pid = fields['pid']
+            waker_cpu = prev_cpu = -1
+            if pid not in marks:
+                waker_cpu = prev_cpu = None
+            elif marks[pid] is not None and marks[pid][1] == WAKING and \
+                    not (ttl and ts - marks[pid][0] > ttl):
+                waker_cpu, prev_cpu = marks[pid][3], marks[pid][4]
+            marks[pid] = (ts, WAKEUP, common_cpu, waker_cpu, prev_cpu, fields['target_cpu'])
+        elif event_name == 'sched_switch':
+            marks[fields['next_pid']] = None
+        elif event_name == 'sched_process_exit':
+            marks[fields['pid']] = None
+        elif event_name == 'sched_update_nr_running':
+            runqlen[fields['cpu']] = fields['nr_running']
+    return runqlen, marks, last_ts
+
+def chain_state(state, boundary, pending_ttl_us=PENDING_WAKEUP_TTL_US):
+    '''
+    Apply the scan_boundary() of a shard to the get_state() it starts from,
+    giving the state the next shard starts from
+    '''
+    ttl = pending_ttl_us*(10**3)
+    runqlen, pending = list(state[0]), dict(state[1])
+    boundary_runqlen, marks, last_ts = boundary
+    for cpu, nr_running in boundary_runqlen.items():
+        runqlen[cpu] = nr_running
+    for pid, mark in marks.items():
+        if mark is None:
+            pending.pop(pid, None)
+            continue
+        if mark[3] is None:
+            waker_cpu = prev_cpu = -1
+            if pid in pending and pending[pid][1] == WAKING and \
+                    not (ttl and mark[0] - pending[pid][0] > ttl):
+                waker_cpu, prev_cpu = pending[pid][3], pending[pid][4]
+            mark = mark[:3] + (waker_cpu, prev_cpu) + mark[5:]
+        pending[pid] = mark
+    # marks the shard's analyzer found expired
+    if ttl and last_ts is not None:
+        for pid in [pid for pid, mark in pending.items() if last_ts - mark[0] > ttl]:
+            del(pending[pid])
+    return runqlen, pending
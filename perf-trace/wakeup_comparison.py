@@ -0,0 +1,150 @@
+# Licensed under the terms of the GNU GPL License version 2
+#
+# A/B comparison of the WakeupSummary of traces taken on different kernels,
+# with bootstrap confidence intervals on the deltas.
+#
+# Every metric is resampled BOOTSTRAP_RESAMPLES times per trace, all at once:
+# - accuracy and wake affine pulls as binomial draws over the wakeups,
+# - the smt_after_wakeup distribution as multinomial draws over its modes,
+# - latency percentiles as multinomial draws over the bucket counts of the
+#   latency sketches, which is resampling the latency samples quantized to
+#   the relative error of the sketch.
+# The confidence interval of a delta is the percentile interval of the
+# differences between the resamples of the two traces. A delta whose interval
+# excludes 0 is flagged as significant.
+#
+# @author: Parth Shah <parth@linux.ibm.com>
+
+from __future__ import print_function
+
+import math
+import sys
+
+import numpy as np
+
+# default tunables
+BOOTSTRAP_RESAMPLES = 1000
+CONFIDENCE = 95 # % confidence of the reported intervals
+LATENCY_PERCENTILES = [50, 90, 99, 99.99]
+
+def resample_proportion(successes, n, resamples, rng):
+    '''
+    resamples bootstrap replicates of successes/n, in %
+    '''
+    if n == 0:
+        return np.full(resamples, np.nan)
+    return 100.0*rng.binomial(n, successes/float(n), resamples)/n
+
+def resample_distribution(counts, resamples, rng):
+    '''
+    resamples x len(counts) bootstrap replicates of the share of each count, in %
+    '''
+    counts = np.asarray(counts, dtype=np.int64)
+    n = int(counts.sum())
+    if n == 0:
+        return np.full((resamples, len(counts)), np.nan)
+    return 100.0*rng.multinomial(n, counts/float(n), size=resamples)/n
+
+def resample_percentiles(sketch, percentiles, resamples, rng):
+    '''
+    resamples x len(percentiles) bootstrap replicates of the percentiles of a
+    LatencySketch, ranked as in LatencySketch.percentiles()
+    '''
+    if len(sketch) == 0:
+        return np.full((resamples, len(percentiles)), np.nan)
+    buckets = np.nonzero(sketch.counts)[0]
+    counts = sketch.counts[buckets]
+    values = np.array([min(max(sketch._bucket_value(idx), sketch.min), sketch.max)
+            for idx in buckets.tolist()])
+    cumulative = np.cumsum(rng.multinomial(sketch.count, counts/float(sketch.count),
+            size=resamples), axis=1)
+    ranks = [max(int(math.ceil((sketch.count*p)/100)), 1) for p in percentiles]
+    return np.stack([values[(cumulative < rank).sum(axis=1)] for rank in ranks], axis=1)
+
+
+class Metrics:
+    '''
+    Point estimates of the compared metrics of a WakeupSummary and their
+    bootstrap replicates, keyed by metric name
+    '''
+    def __init__(self, summary, smt_modes, percentiles=LATENCY_PERCENTILES,
+            resamples=BOOTSTRAP_RESAMPLES, rng=None):
+        rng = rng or np.random.default_rng()
+        self.names = []
+        self.value = dict()
+        self.replicates = dict()
+
+        correct = summary.correct_decision_on_idle_cpu + summary.correct_decision_on_busy_cpu
+        decisions = correct + summary.incorrect_decision
+        self.add("Accuracy (%)", 100.0*correct/decisions if decisions else np.nan,
+                resample_proportion(correct, decisions, resamples, rng))
+
+        smt_counts = [summary.smt_after_wakeup.get(mode, 0) for mode in smt_modes]
+        wakeups = sum(summary.smt_after_wakeup.values())
+        shares = resample_distribution(smt_counts, resamples, rng)
+        for i, mode in enumerate(smt_modes):
+            self.add("SMT-mode %s at wakeup (%%)" % mode,
+                    100.0*smt_counts[i]/wakeups if wakeups else np.nan, shares[:, i])
+
+        self.add("Wake affine pulls (%)",
+                100.0*summary.wake_affine_pulled/wakeups if wakeups else np.nan,
+                resample_proportion(summary.wake_affine_pulled, wakeups, resamples, rng))
+
+        latency = summary.latency
+        for name, sketch in (("Scheduler decision latency", latency.scheduler_decision_latency),
+                ("Scheduling latency", latency.sched_latency),
+                ("Pre-migration wait time", latency.pre_migration_wait_time)):
+            values = sketch.percentiles(percentiles) if len(sketch) else [np.nan]*len(percentiles)
+            replicates = resample_percentiles(sketch, percentiles, resamples, rng)
+            for i, p in enumerate(percentiles):
+                self.add("%s %s%%ile (us)" % (name, p), values[i], replicates[:, i])
+
+    def add(self, name, value, replicates):
+        self.names.append(name)
+        self.value[name] = value
+        self.replicates[name] = replicates
+
+
+def smt_modes(summaries):
+    modes = set()
+    for summary in summaries:
+        modes.update(summary.smt_after_wakeup)
+    return sorted(modes)
+
+def compare(baseline, other, confidence=CONFIDENCE):
+    '''
+    (name, baseline value, other value, delta, low, high) of every metric,
+    low/high bounding the delta at the given % confidence
+    '''
+    rows = []
+    tail = (100 - confidence)/2.0
+    for name in baseline.names:
+        differences = other.replicates[name] - baseline.replicates[name]
+        differences = differences[~np.isnan(differences)]
+        low = high = np.nan
+        if len(differences):
+            low, high = np.percentile(differences, [tail, 100 - tail])
+        rows.append((name, baseline.value[name], other.value[name],
+                other.value[name] - baseline.value[name], low, high))
+    return rows
+
+def report(names, summaries, percentiles=LATENCY_PERCENTILES, resamples=BOOTSTRAP_RESAMPLES,
+        confidence=CONFIDENCE, seed=None, out=sys.stdout):
+    '''
+    Compare the summaries of every trace in names to the first one
+    '''
+    rng = np.random.default_rng(seed)
+    modes = smt_modes(summaries)
+    metrics = [Metrics(summary, modes, percentiles, resamples, rng) for summary in summaries]
+    for name, other in zip(names[1:], metrics[1:]):
+        print('------------------A/B comparison------------------------------------------', file=out)
+        print("baseline = ", names[0], file=out)
+        print("compared = ", name, file=out)
+        print("%-40s %12s %12s %12s   %s" % ("metric", "baseline", "compared", "delta",
+                "%s%% CI" % confidence), file=out)
+        for metric, base_value, value, delta, low, high in compare(metrics[0], other, confidence):
+            significant = "*" if low > 0 or high < 0 else ""
+            print("%-40s %12.3f %12.3f %+12.3f   [%.3f, %.3f] %s" % (metric, base_value, value,
+                    delta, low, high, significant), file=out)
+        print("* delta outside noise: its", "%s%% CI" % confidence, "excludes 0,",
+                resamples, "bootstrap resamples", file=out)